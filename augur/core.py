@@ -1,8 +1,37 @@
-import math
+import functools
+from typing import NamedTuple
 import pandas as pd
 import numpy as np
 import augur.data as agd
 
+LAND_COVERS = ['farmland', 'pasture', 'forest', 'settlement', 'debris']
+LAND_COVER_COLUMNS = agd.LAND_COVER_COLUMNS
+SOIL_TYPES = agd.SOIL_TYPES
+
+# Catchment properties needed to compute the hydrographs
+CATCHMENT_COLUMNS = ['area', 'length_watercourse', 'slope_gradient'] + \
+                    LAND_COVER_COLUMNS
+
+# Hyetogram length above which the convolution is computed with FFTs
+FFT_CONVOLUTION_THRESHOLD = 64
+
+# Hyetogram shapes, as the rainfall fractions of consecutive equal periods of the storm
+# (see register_hyetogram()). The 'constant' method is handled separately.
+HYETOGRAM_SHAPES = {'augur': np.array([0.18, 0.46, 0.23, 0.13])}
+
+# Maximum number of hyetogram and unit hydrograph templates kept in memory
+TEMPLATE_CACHE_SIZE = 64
+
+# Maximum number of unit discharges on the fixed time grid kept in memory (one per
+# time to peak, i.e. per catchment in a calibration)
+UNIT_DISCHARGE_CACHE_SIZE = 4096
+
+# Time step of the storm and of the fixed time grid [h]
+TIME_STEP = 0.1
+
+# Options of the time grid: a fixed grid, or a grid adapted to each catchment
+TIME_GRIDS = ['fixed', 'adaptive']
+
 
 def get_default_cn_parameters(version='redcross'):
     """
@@ -19,7 +48,7 @@ def get_default_cn_parameters(version='redcross'):
     """
 
     cns = None
-    land_covers = ['farmland', 'pasture', 'forest', 'settlement', 'debris']
+    land_covers = LAND_COVERS
 
     if version == 'redcross':
         cns = pd.DataFrame(np.array([[67, 76, 83, 86],
@@ -59,8 +88,8 @@ def create_cn_parameters_from_array(cns_array):
     A dataframe with the curve number parameters.
     """
     return pd.DataFrame(cns_array,
-                        columns=['A', 'B', 'C', 'D'],
-                        index=['farmland', 'pasture', 'forest', 'settlement', 'debris'],
+                        columns=SOIL_TYPES,
+                        index=LAND_COVERS,
                         dtype=np.int64)
 
 
@@ -72,16 +101,23 @@ def compute_cn_factor(catchment, cns, soil_type):
     Parameters
     ----------
     catchment: Pandas dataframe
-        Dataframe containing the land cover percentages.
+        Dataframe containing the land cover percentages (or a CatchmentBatch).
     cns: Pandas dataframe
         Dataframe containing the curve number values for all land covers and soil types.
-    soil_type: str
-        The soil type category.
+    soil_type: str|int|array-like
+        The soil type category, or its integer code (see augur.data.SOIL_TYPES). An
+        array gives the soil type of each catchment when several are provided.
 
     Returns
     -------
     The curve number factor for the different land covers for a given soil type.
     """
+    if np.ndim(soil_type) > 0:
+        return _compute_cn_factor_batch(_get_land_cover(catchment), cns, soil_type)
+
+    if isinstance(soil_type, (int, np.integer)):
+        soil_type = SOIL_TYPES[soil_type]
+
     cn = catchment['cover_farmland'] / 100 * cns.at['farmland', soil_type] + \
          catchment['cover_pasture'] / 100 * cns.at['pasture', soil_type] + \
          catchment['cover_forest'] / 100 * cns.at['forest', soil_type] + \
@@ -92,42 +128,48 @@ def compute_cn_factor(catchment, cns, soil_type):
     return cn
 
 
-def get_rain_area(area, a=106.61, x=-0.289):
+def get_rain_area(area, a=106.61, x=-0.289, validate=True):
     """
-    Compute the rainfall area.
+    Compute the rainfall area. The inputs can be scalars or arrays of any shape,
+    which are broadcast against each other.
 
     Parameters
     ----------
-    area: float
+    area: float|np.ndarray
         The catchment area [km2].
-    a: float
+    a: float|np.ndarray
         A multiplicative parameter a.
-    x: float
+    x: float|np.ndarray
         An exponent parameter x.
+    validate: bool
+        Whether to check the input values. Default: True
 
     Returns
     -------
-    The rainfall area [%].
+    The rainfall area [%] (a scalar if all the inputs are scalars).
     """
-    if area <= 0:
-        raise ValueError("The catchment area cannot be null or negative.")
+    area = np.asarray(area, dtype=float)
+    if validate:
+        _check_values(area <= 0, area,
+                      "The catchment area cannot be null or negative.")
 
-    return a * math.pow(area, x)
+    return a * np.power(area, x)
 
 
 def get_production(area_rain, precipitation, cn_factor, a=0.7):
     """
-    Compute the precipitation relevant for runoff.
+    Compute the precipitation relevant for runoff. The inputs can be scalars or
+    arrays of any shape, which are broadcast against each other.
 
     Parameters
     ----------
-    area_rain: float
+    area_rain: float|np.ndarray
         The rainfall area [%].
-    precipitation: float
+    precipitation: float|np.ndarray
         The precipitation [mm].
-    cn_factor: float
+    cn_factor: float|np.ndarray
         The curve number factor.
-    a: float
+    a: float|np.ndarray
         A multiplicative parameter a.
 
     Returns
@@ -137,22 +179,26 @@ def get_production(area_rain, precipitation, cn_factor, a=0.7):
     return a * area_rain / 100 * precipitation * cn_factor / 100
 
 
-def get_time_to_peak(watercourse_length, slope_gradient, storm_duration):
+def get_time_to_peak(watercourse_length, slope_gradient, storm_duration,
+                     validate=True):
     """
-    Compute the time to peak.
+    Compute the time to peak. The inputs can be scalars or arrays of any shape,
+    which are broadcast against each other.
 
     Parameters
     ----------
-    watercourse_length: float
+    watercourse_length: float|np.ndarray
         The watercourse length [m].
-    slope_gradient
+    slope_gradient: float|np.ndarray
         The slope gradient [%].
-    storm_duration
+    storm_duration: float|np.ndarray
         The storm duration [min].
+    validate: bool
+        Whether to check the input values. Default: True
 
     Returns
     -------
-    The time to peak [h].
+    The time to peak [h] (a scalar if all the inputs are scalars).
 
     Notes
     -----
@@ -161,36 +207,46 @@ def get_time_to_peak(watercourse_length, slope_gradient, storm_duration):
 
     From: Ratnayaka, D. D., Brandt, M. J., & Johnson, M. (2009). Water supply. Butterworth-Heinemann.
     """
-    if watercourse_length <= 0:
-        raise ValueError("The watercourse length cannot be null or negative.")
-    if slope_gradient < 0:
-        raise ValueError("The slope gradient cannot be negative.")
-    if storm_duration <= 0:
-        raise ValueError("The storm duration cannot be null or negative.")
-
-    return (storm_duration / 2 + 0.6 * 0.02 * math.pow(watercourse_length, 0.77) *
-            math.pow(slope_gradient, -.385)) / 60
-
-
-def get_unit_peakflow(area, t_p):
+    watercourse_length = np.asarray(watercourse_length, dtype=float)
+    slope_gradient = np.asarray(slope_gradient, dtype=float)
+    storm_duration = np.asarray(storm_duration, dtype=float)
+    if validate:
+        _check_values(watercourse_length <= 0, watercourse_length,
+                      "The watercourse length cannot be null or negative.")
+        _check_values(slope_gradient < 0, slope_gradient,
+                      "The slope gradient cannot be negative.")
+        _check_values(storm_duration <= 0, storm_duration,
+                      "The storm duration cannot be null or negative.")
+
+    return (storm_duration / 2 + 0.6 * 0.02 * np.power(watercourse_length, 0.77) *
+            np.power(slope_gradient, -.385)) / 60
+
+
+def get_unit_peakflow(area, t_p, validate=True):
     """
-    Compute the unit peakflow.
+    Compute the unit peakflow. The inputs can be scalars or arrays of any shape,
+    which are broadcast against each other.
 
     Parameters
     ----------
-    area: float
+    area: float|np.ndarray
         The catchment area [km2].
-    t_p: float
+    t_p: float|np.ndarray
         The time to peak [h].
+    validate: bool
+        Whether to check the input values. Default: True
 
     Returns
     -------
-    The unit peakflow [m3/s].
+    The unit peakflow [m3/s] (a scalar if all the inputs are scalars).
     """
-    if area <= 0:
-        raise ValueError("The area be null or negative.")
-    if t_p <= 0:
-        raise ValueError("The time to peak cannot be null or negative.")
+    area = np.asarray(area, dtype=float)
+    t_p = np.asarray(t_p, dtype=float)
+    if validate:
+        _check_values(area <= 0, area,
+                      "The catchment area cannot be null or negative.")
+        _check_values(t_p <= 0, t_p,
+                      "The time to peak cannot be null or negative.")
 
     return 0.278 * area / t_p
 
@@ -211,12 +267,9 @@ def get_unit_hydrograph(q_up, t_p):
     The unit hydrograph discharge [m3/s].
     The unit hydrograph time [h].
     """
+    q_r, q = _get_unit_hydrograph_template(0.1, 31)
 
-    q_r = np.arange(0, 3.1, 0.1)
-    t = q_r * t_p
-    q = np.concatenate((q_r[q_r <= 1] * q_up, q_up - ((q_r[q_r > 1] - 1) / 2 * q_up)))
-
-    return t, q
+    return q_r * t_p, q * q_up
 
 
 def get_unit_discharge(time_rain, q_up, t_p):
@@ -237,7 +290,7 @@ def get_unit_discharge(time_rain, q_up, t_p):
     The unit discharge [m3/s].
     """
     q_r = time_rain / t_p  # Corresponding Q/Qp
-    q = np.concatenate((q_r[q_r <= 1] * q_up, q_up - ((q_r[q_r > 1] - 1) / 2 * q_up)))
+    q = _get_unit_hydrograph_shape(q_r) * q_up
     q[q < 0] = 0
 
     return q
@@ -254,29 +307,198 @@ def get_hyetogram(timesteps_nb, rain_runoff, method='augur'):
     rain_runoff: float
         The rainfall for runoff [mm].
     method: str
-        The method to compute the hyetogram. Can be 'augur' or 'constant'.
+        The method to compute the hyetogram. Can be 'augur', 'constant' or the name
+        of a shape registered with register_hyetogram().
 
     Returns
     -------
     The hyetogram.
     """
-    repartition = np.array([])
-    if method == 'augur':
-        # Check that the time steps have a length that is a multiple of 4
-        if timesteps_nb % 4 != 0:
-            raise ValueError("The time steps number must be a multiple of 4.")
-        factor = timesteps_nb // 4
-        # Copy each values the number of times it is needed (factor)
-        repartition = np.repeat(np.array([0.18, 0.46, 0.23, 0.13]), factor) / factor
+    return _get_hyetogram_template(timesteps_nb, method) * rain_runoff
+
+
+def register_hyetogram(name, fractions):
+    """
+    Register a custom hyetogram shape, to be used as a method of get_hyetogram().
+
+    Parameters
+    ----------
+    name: str
+        The name of the shape (method).
+    fractions: array-like
+        The rainfall fractions of consecutive equal periods of the storm. They must
+        be non-negative and sum to 1. The number of time steps of the hyetograms must
+        then be a multiple of the number of fractions.
+    """
+    fractions = np.array(fractions, dtype=float)
+    if name == 'constant':
+        raise ValueError("The 'constant' hyetogram cannot be redefined.")
+    if fractions.ndim != 1 or len(fractions) == 0:
+        raise ValueError("The hyetogram fractions must be a non-empty 1-D array.")
+    if np.any(fractions < 0) or not np.isclose(fractions.sum(), 1):
+        raise ValueError("The hyetogram fractions must be non-negative and sum to 1.")
+
+    HYETOGRAM_SHAPES[name] = fractions
+    _get_hyetogram_template.cache_clear()
 
-    elif method == 'constant':
+
+def get_template_cache_info():
+    """
+    Get the statistics of the hyetogram and unit hydrograph template caches.
+
+    Returns
+    -------
+    A dict with the cache statistics (hits, misses, maxsize, currsize) of the
+    'hyetogram' and 'unit_hydrograph' templates, and of the 'unit_discharge' on the
+    fixed time grid used by compute_hydrograph().
+    """
+    return {'hyetogram': _get_hyetogram_template.cache_info(),
+            'unit_hydrograph': _get_unit_hydrograph_template.cache_info(),
+            'unit_discharge': _get_unit_discharge_template.cache_info()}
+
+
+def clear_template_cache():
+    """
+    Clear the hyetogram and unit hydrograph template caches.
+    """
+    _get_hyetogram_template.cache_clear()
+    _get_unit_hydrograph_template.cache_clear()
+    _get_unit_discharge_template.cache_clear()
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _get_hyetogram_template(timesteps_nb, method):
+    """
+    Compute the hyetogram of a unit rainfall (read-only, cached).
+    """
+    if method == 'constant':
         # Repeat the same value for each time step
         repartition = np.repeat(1 / timesteps_nb, timesteps_nb)
 
+    elif method in HYETOGRAM_SHAPES:
+        fractions = HYETOGRAM_SHAPES[method]
+        # Check that the time steps have a length that is a multiple of the periods
+        if timesteps_nb % len(fractions) != 0:
+            raise ValueError(f"The time steps number must be a multiple of "
+                             f"{len(fractions)}.")
+        factor = timesteps_nb // len(fractions)
+        # Copy each values the number of times it is needed (factor)
+        repartition = np.repeat(fractions, factor) / factor
+
     else:
-        raise ValueError("The method must be 'augur' or 'constant'.")
+        raise ValueError(f"The method must be 'constant' or one of "
+                         f"{list(HYETOGRAM_SHAPES)}.")
+
+    repartition.flags.writeable = False
+
+    return repartition
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _get_unit_hydrograph_template(step, steps_nb):
+    """
+    Compute the dimensionless unit hydrograph (Q/Qp) at regular multiples of the
+    time to peak (read-only, cached).
+    """
+    q_r = np.arange(steps_nb) * step
+    q = _get_unit_hydrograph_shape(q_r)
+    q_r.flags.writeable = False
+    q.flags.writeable = False
+
+    return q_r, q
 
-    return repartition * rain_runoff
+
+@functools.lru_cache(maxsize=UNIT_DISCHARGE_CACHE_SIZE)
+def _get_unit_discharge_template(t_p):
+    """
+    Compute the unit discharge of a unit peakflow on the fixed time grid for a time
+    to peak (read-only, cached).
+    """
+    q = np.maximum(_get_unit_hydrograph_shape(np.arange(0, 5, TIME_STEP) / t_p), 0)
+    q.flags.writeable = False
+
+    return q
+
+
+def _get_unit_hydrograph_shape(q_r):
+    """
+    Dimensionless triangular unit hydrograph for the given time ratios t/Tp.
+    """
+    return np.where(q_r <= 1, q_r, 1 - (q_r - 1) / 2)
+
+
+def get_adaptive_time_grid(t_p, storm_duration, rise_steps_nb=5, recession_steps_nb=10):
+    """
+    Compute a time grid adapted to the time to peak and the storm duration. The
+    hydrograph is the sum of triangular unit hydrographs starting every TIME_STEP
+    during the storm, so that it is piecewise linear and peaks at the apex of one of
+    them. The grid is made of:
+     - the rise, from 0 to the time to peak, with rise_steps_nb regular steps;
+     - the apexes of the unit hydrographs (t_p + j * TIME_STEP), which guarantee that
+       the peak is captured;
+     - the recession, from the last apex to the end of the last unit hydrograph
+       (3 * t_p after its start), with recession_steps_nb regular steps.
+    The number of time steps is rise_steps_nb + S + recession_steps_nb, with S the
+    number of time steps of the storm, whatever the catchment (see
+    get_time_steps_nb()).
+
+    Parameters
+    ----------
+    t_p: float|np.ndarray
+        The time to peak [h], of shape (N,) for several catchments.
+    storm_duration
+        The duration of the storm (minutes).
+    rise_steps_nb: int
+        The number of time steps before the time to peak. Default: 5
+    recession_steps_nb: int
+        The number of time steps after the last apex. Default: 10
+
+    Returns
+    -------
+    The time steps [h], of shape (T,) or (N, T) for several catchments.
+    """
+    t_p = np.asarray(t_p, dtype=float)[..., np.newaxis]
+    storm_time_steps_nb = _get_precip_time_steps_nb(storm_duration)
+    storm_end = (storm_time_steps_nb - 1) * TIME_STEP
+
+    rise = t_p * np.arange(rise_steps_nb) / rise_steps_nb
+    apexes = t_p + np.arange(storm_time_steps_nb) * TIME_STEP
+    recession = t_p + storm_end + 2 * t_p * np.arange(
+        1, recession_steps_nb + 1) / recession_steps_nb
+
+    return np.concatenate([rise, apexes, recession], axis=-1)
+
+
+def get_time_steps_nb(storm_duration=120, time_grid='fixed', rise_steps_nb=5,
+                      recession_steps_nb=10):
+    """
+    Get the number of time steps of the hydrographs. It does not depend on the time
+    to peak, so that it is the same for all the catchments.
+
+    Parameters
+    ----------
+    storm_duration
+        The duration of the storm (minutes). Default: 120
+    time_grid: str
+        The time grid of the hydrographs. Options: 'fixed' or 'adaptive'.
+        Default: 'fixed'
+    rise_steps_nb: int
+        The number of time steps before the time to peak of the adaptive grid.
+        Default: 5
+    recession_steps_nb: int
+        The number of time steps after the last apex of the adaptive grid. Default: 10
+
+    Returns
+    -------
+    The number of time steps T.
+    """
+    if time_grid not in TIME_GRIDS:
+        raise ValueError(f"The time grid must be one of {TIME_GRIDS}.")
+    if time_grid == 'adaptive':
+        return rise_steps_nb + _get_precip_time_steps_nb(storm_duration) + \
+            recession_steps_nb
+
+    return len(np.arange(0, 5, TIME_STEP))
 
 
 def build_hydrograph_from_uh(time, q_uh, precip, precip_time_steps_nb, factor=0.9):
@@ -301,17 +523,72 @@ def build_hydrograph_from_uh(time, q_uh, precip, precip_time_steps_nb, factor=0.
     The hydrograph [m3/s].
     """
     hyetogram = get_hyetogram(precip_time_steps_nb, precip)
-    q_array = np.zeros((len(time), len(time)))
-    for i_time in range(len(time)):
-        for i_hyeto in range(len(hyetogram)):
-            if i_time + i_hyeto > len(time) - 1:
-                break
-            q_array[i_time + i_hyeto, i_time] = q_uh[i_time] * hyetogram[i_hyeto]
 
-    return np.sum(q_array, axis=1) * factor
+    return convolve_hyetogram(q_uh[:len(time)], hyetogram) * factor
 
 
-def compute_hydrograph(catchment, soil_type, precipitation, cns, storm_duration=120):
+def convolve_hyetogram(q_uh, hyetogram, method='auto'):
+    """
+    Convolve unit hydrographs with hyetograms. The result is truncated to the length
+    of the unit hydrographs, i.e. the discharge after the end of the time window is
+    dropped.
+
+    Parameters
+    ----------
+    q_uh: np.array
+        The unit hydrograph discharge [m3/s], with the time along the last axis.
+        Several unit hydrographs can be stacked along the leading axes.
+    hyetogram: np.array
+        The hyetogram [mm], with the time along the last axis. Several hyetograms
+        can be stacked along the leading axes, which are broadcast against the ones
+        of q_uh.
+    method: str
+        The convolution method: 'direct', 'fft' or 'auto'. The automatic choice uses
+        the direct method for short hyetograms and FFTs for the long ones.
+
+    Returns
+    -------
+    The discharge [m3/s] with the broadcast shape of the inputs.
+    """
+    q_uh = np.asarray(q_uh, dtype=float)
+    hyetogram = np.asarray(hyetogram, dtype=float)
+
+    time_steps_nb = q_uh.shape[-1]
+    hyeto_steps_nb = min(hyetogram.shape[-1], time_steps_nb)
+    hyetogram = hyetogram[..., :hyeto_steps_nb]
+    shape = np.broadcast_shapes(q_uh.shape[:-1], hyetogram.shape[:-1])
+
+    if method == 'auto':
+        if hyeto_steps_nb > FFT_CONVOLUTION_THRESHOLD:
+            method = 'fft'
+        else:
+            method = 'direct'
+
+    if method == 'direct':
+        if hyeto_steps_nb == 0:
+            return np.zeros(shape + (time_steps_nb,))
+        if q_uh.ndim == 1 and hyetogram.ndim == 1:
+            return np.convolve(q_uh, hyetogram)[:time_steps_nb]
+        q = np.zeros(shape + (time_steps_nb,))
+        for i_hyeto in range(hyeto_steps_nb):
+            q[..., i_hyeto:] += (q_uh[..., :time_steps_nb - i_hyeto] *
+                                 hyetogram[..., i_hyeto:i_hyeto + 1])
+        return q
+
+    if method == 'fft':
+        if hyeto_steps_nb == 0:
+            return np.zeros(shape + (time_steps_nb,))
+        # Zero padding to a power of 2 to avoid the circular wrap-around
+        fft_size = 1 << (time_steps_nb + hyeto_steps_nb - 2).bit_length()
+        spectrum = np.fft.rfft(q_uh, fft_size) * np.fft.rfft(hyetogram, fft_size)
+        q = np.fft.irfft(spectrum, fft_size)[..., :time_steps_nb]
+        return np.broadcast_to(q, shape + (time_steps_nb,)).copy()
+
+    raise ValueError("The method must be 'auto', 'direct' or 'fft'.")
+
+
+def compute_hydrograph(catchment, soil_type, precipitation, cns, storm_duration=120,
+                       validate=True, time_grid='fixed', ret_periods=None):
     """
     Compute the hydrograph according to the SCS CN method.
     Adapted from the work of Omar Bellprat and Georg Heim
@@ -327,51 +604,515 @@ def compute_hydrograph(catchment, soil_type, precipitation, cns, storm_duration=
         The soil type category. Options: 'A', 'B', 'C', 'D'
     precipitation: Pandas dataframe
         A Pandas dataframe containing the aggregated precipitation values [mm] for
-        different return periods ('p10', 'p30', 'p100')
+        different return periods ('p10', 'p30', 'p100' by default)
     cns: Pandas dataframe
         The curve number parameters
     storm_duration
         The duration of the storm (minutes). Default: 120
+    validate: bool
+        Whether to check the catchment properties (land cover total, area, length and
+        slope). Can be disabled when the catchments were checked beforehand at once
+        with augur.data.check_catchments(). Default: True
+    time_grid: str
+        The time grid of the hydrographs. Options: 'fixed' (0 to 5 h every 0.1 h) or
+        'adaptive' (see get_adaptive_time_grid()). Default: 'fixed'
+    ret_periods: list
+        The return periods [years] to compute, the precipitation being taken from the
+        fields 'p{return period}'. Default: [10, 30, 100]
 
     Returns
     -------
-    The hydrographs [m3/s] for the different return periods.
+    The time steps [h] and the hydrographs [m3/s] as an array of shape (T, R), with
+    R the number of return periods.
+    When a CatchmentBatch is provided, compute_hydrograph_batch() is used instead.
     """
+    if isinstance(catchment, CatchmentBatch):
+        return compute_hydrograph_batch(catchment, soil_type, precipitation, cns,
+                                        storm_duration, validate, time_grid,
+                                        ret_periods)
+    if time_grid not in TIME_GRIDS:
+        raise ValueError(f"The time grid must be one of {TIME_GRIDS}.")
+
+    if validate:
+        agd.check_land_cover_total(catchment)
+
     # Parameterized rain covered area
-    area_rain = get_rain_area(catchment['area'])
+    area_rain = get_rain_area(catchment['area'], validate=validate)
 
     # Compute the factor from the land covers
-    agd.check_land_cover_total(catchment)
     cn_factor = compute_cn_factor(catchment, cns, soil_type)
 
-    # Precipitation relevant to runoff
-    rain_ret_period = {
-        'yr10': get_production(area_rain, precipitation['p10'], cn_factor),
-        'yr30': get_production(area_rain, precipitation['p30'], cn_factor),
-        'yr100': get_production(area_rain, precipitation['p100'], cn_factor)}
+    # Precipitation relevant to runoff, shape (R,)
+    precip = np.array([precipitation[k] for k in
+                       agd.get_return_period_columns('p', ret_periods)], dtype=float)
+    production = get_production(area_rain, precip, cn_factor)
 
     # Time from start of rain to maximum outflow [h]
     t_p = get_time_to_peak(catchment['length_watercourse'],
                            catchment['slope_gradient'],
-                           storm_duration)
+                           storm_duration, validate)
 
     # Unit peakflow [m^3 / s]
-    q_up = get_unit_peakflow(catchment['area'], t_p)
+    q_up = get_unit_peakflow(catchment['area'], t_p, validate)
+
+    if time_grid == 'adaptive':
+        time = get_adaptive_time_grid(t_p, storm_duration)
+        repartition = get_hyetogram(_get_precip_time_steps_nb(storm_duration), 1)
+        response = _compute_unit_response(time, q_up, t_p, repartition)
+        return time, response[:, np.newaxis] * production * 0.9
 
     # Time
-    time = np.arange(0, 5, 0.1)
+    time = np.arange(0, 5, TIME_STEP)
 
-    # Unit discharge
-    q_uh = get_unit_discharge(time, q_up, t_p)
+    # Unit discharge, the same for every evaluation of the catchment
+    q_uh = _get_unit_discharge_template(float(t_p)) * q_up
 
     # Precipitation time steps number
     precip_time_steps_nb = len(time[(time > 0) & (time <= storm_duration / 60)])
 
-    # Hydrograph
-    hydrograph = np.zeros((len(time), len(rain_ret_period)))
-    for i_ret_period, k_ret_period in enumerate(rain_ret_period):
-        precip = rain_ret_period[k_ret_period]
-        hydrograph[:, i_ret_period] = build_hydrograph_from_uh(time, q_uh, precip,
-                                                               precip_time_steps_nb)
+    # Hydrographs of all return periods in a single convolution, shape (T, R)
+    hyetograms = get_hyetogram(precip_time_steps_nb, production[:, np.newaxis])
+    hydrograph = convolve_hyetogram(q_uh, hyetograms).T * 0.9
 
     return time, hydrograph
+
+
+class CatchmentBatch:
+    """
+    Columnar container of N catchments backed by contiguous, read-only NumPy arrays
+    (one per property). It can be passed wherever the functions of this module expect
+    a catchment dataframe, and provides the batch functions with a single validated
+    input type. Columns are accessed by name as in a dataframe.
+    """
+
+    def __init__(self, columns, soil_types=None):
+        """
+        Initialize the catchment batch.
+
+        Parameters
+        ----------
+        columns: dict
+            The catchment properties, as a mapping of names to 1-D arrays of the same
+            length. The catchment properties needed to compute the hydrographs
+            (CATCHMENT_COLUMNS) are mandatory.
+        soil_types: array-like
+            The soil type of each catchment (labels or integer codes). Optional.
+        """
+        missing = [name for name in CATCHMENT_COLUMNS if name not in columns]
+        if missing:
+            raise ValueError(f"Missing catchment properties: {missing}.")
+
+        self._columns = {}
+        length = None
+        for name, values in columns.items():
+            array = np.ascontiguousarray(values, dtype=float)
+            if array.ndim != 1:
+                raise ValueError(f"The property '{name}' is not one-dimensional.")
+            if length is None:
+                length = len(array)
+            elif len(array) != length:
+                raise ValueError(f"The property '{name}' has {len(array)} values "
+                                 f"instead of {length}.")
+            # Read-only view, leaving the flags of the source array untouched
+            array = array.view()
+            array.flags.writeable = False
+            self._columns[name] = array
+        self._length = length
+
+        self.soil_types = None
+        if soil_types is not None:
+            self.soil_types = agd.soil_type_labels_to_codes(soil_types)
+            if len(self.soil_types) != length:
+                raise ValueError(f"There are {len(self.soil_types)} soil types "
+                                 f"instead of {length}.")
+            self.soil_types.flags.writeable = False
+
+    @classmethod
+    def from_dataframe(cls, df, columns=None, soil_type_column='soil_type'):
+        """
+        Create a catchment batch from the columns of a dataframe. The arrays are not
+        copied when the columns are already stored as contiguous float64 values.
+
+        Parameters
+        ----------
+        df: Pandas dataframe
+            The catchment properties.
+        columns: list
+            The columns to use. Default: all numeric columns.
+        soil_type_column: str
+            The column of the soil types, used if present. None to ignore it.
+
+        Returns
+        -------
+        The catchment batch.
+        """
+        if columns is None:
+            columns = df.select_dtypes(include='number').columns
+        soil_types = None
+        if soil_type_column is not None and soil_type_column in df.columns:
+            soil_types = df[soil_type_column]
+
+        return cls({name: df[name].to_numpy(dtype=float, copy=False)
+                    for name in columns}, soil_types)
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def columns(self):
+        """ The names of the catchment properties. """
+        return list(self._columns)
+
+
+def compute_hydrograph_batch(catchments, soil_types, precipitation, cns,
+                             storm_duration=120, validate=True, time_grid='fixed',
+                             ret_periods=None):
+    """
+    Compute the hydrographs of several catchments at once according to the SCS CN
+    method. This is the vectorized counterpart of compute_hydrograph(): all
+    catchments are processed in a single NumPy pass and the results are the same
+    (up to floating-point rounding) as calling compute_hydrograph() on every row.
+
+    Parameters
+    ----------
+    catchments: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        properties of N catchments (see compute_hydrograph()).
+    soil_types: array-like
+        The soil type category of each catchment. Options: 'A', 'B', 'C', 'D', or
+        their integer codes (see augur.data.classify_soil_type_codes_augur())
+    precipitation: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        aggregated precipitation values [mm] of the N catchments for different
+        return periods ('p10', 'p30', 'p100' by default)
+    cns: Pandas dataframe
+        The curve number parameters
+    storm_duration
+        The duration of the storm (minutes). Default: 120
+    validate: bool
+        Whether to check the catchment properties and report all the invalid values
+        at once (see augur.data.check_catchments()). Default: True
+    time_grid: str
+        The time grid of the hydrographs. Options: 'fixed' (0 to 5 h every 0.1 h) or
+        'adaptive' (see get_adaptive_time_grid()). Default: 'fixed'
+    ret_periods: list
+        The return periods [years] to compute, the precipitation being taken from the
+        fields 'p{return period}'. Default: [10, 30, 100]
+
+    Returns
+    -------
+    The time steps [h] and the hydrographs [m3/s] as an array of shape (N, T, R),
+    with T the number of time steps and R the number of return periods. The time
+    steps have a shape (T,) with the fixed grid and (N, T) with the adaptive grid.
+    """
+    cache = precompute_catchments(catchments, precipitation, storm_duration, validate,
+                                  time_grid, ret_periods)
+    production = _compute_production_batch(cache, soil_types, cns)
+
+    # Hydrographs, shape (N, T, R)
+    hydrograph = cache.response[:, :, np.newaxis] * production[:, np.newaxis, :] * 0.9
+
+    return cache.time, hydrograph
+
+
+def compute_peak_discharge(catchments, soil_types, precipitation, cns,
+                           storm_duration=120, return_time=False, validate=True,
+                           time_grid='fixed', ret_periods=None):
+    """
+    Compute the peak discharge of several catchments according to the SCS CN method,
+    without building the full hydrographs. The hydrographs are proportional to the
+    precipitation relevant to runoff, so that the peak is found once on the response
+    to a unit rainfall and then scaled for every return period. The values are the
+    same as compute_hydrograph_batch(...)[1].max(axis=1).
+
+    Parameters
+    ----------
+    catchments: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        properties of N catchments (see compute_hydrograph()).
+    soil_types: array-like
+        The soil type category of each catchment. Options: 'A', 'B', 'C', 'D', or
+        their integer codes (see augur.data.classify_soil_type_codes_augur())
+    precipitation: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        aggregated precipitation values [mm] of the N catchments for different
+        return periods ('p10', 'p30', 'p100' by default)
+    cns: Pandas dataframe
+        The curve number parameters
+    storm_duration
+        The duration of the storm (minutes). Default: 120
+    return_time: bool
+        Whether to also return the time to peak of the hydrographs.
+    validate: bool
+        Whether to check the catchment properties and report all the invalid values
+        at once (see augur.data.check_catchments()). Default: True
+    time_grid: str
+        The time grid of the hydrographs. Options: 'fixed' (0 to 5 h every 0.1 h) or
+        'adaptive' (see get_adaptive_time_grid()). Default: 'fixed'
+    ret_periods: list
+        The return periods [years] to compute, the precipitation being taken from the
+        fields 'p{return period}'. Default: [10, 30, 100]
+
+    Returns
+    -------
+    The peak discharge [m3/s] as an array of shape (N, R), with R the number of return
+    periods, and, if return_time is True, the time of the peak [h] with the same shape.
+    """
+    cache = precompute_catchments(catchments, precipitation, storm_duration, validate,
+                                  time_grid, ret_periods)
+
+    return compute_peak_discharge_from_cache(cache, soil_types, cns, return_time)
+
+
+class CatchmentCache(NamedTuple):
+    """
+    Quantities of a set of N catchments that do not depend on the curve numbers, as
+    built by precompute_catchments(). The arrays are read-only.
+    """
+    time: np.ndarray  # Time steps [h], shape (T,) or (N, T) for adaptive grids
+    area_rain: np.ndarray  # Rainfall area [%], shape (N,)
+    t_p: np.ndarray  # Time to peak [h], shape (N,)
+    q_up: np.ndarray  # Unit peakflow [m3/s], shape (N,)
+    land_cover: np.ndarray  # Land cover percentages of LAND_COVERS, shape (N, 5)
+    precipitation: np.ndarray  # Precipitation [mm] per return period, shape (N, R)
+    response: np.ndarray  # Hydrographs of a unit rainfall, shape (N, T)
+    response_i_max: np.ndarray  # Time index of the response maximum, shape (N,)
+    response_i_min: np.ndarray  # Time index of the response minimum, shape (N,)
+
+
+def precompute_catchments(catchments, precipitation, storm_duration=120, validate=True,
+                          time_grid='fixed', ret_periods=None):
+    """
+    Compute the quantities of several catchments that do not depend on the curve
+    numbers (rainfall area, time to peak, unit discharge and hydrograph of a unit
+    rainfall). The catchment properties are checked once here, so that the functions
+    using the cache do not need to.
+
+    Parameters
+    ----------
+    catchments: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        properties of N catchments (see compute_hydrograph()).
+    precipitation: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        aggregated precipitation values [mm] of the N catchments for different
+        return periods ('p10', 'p30', 'p100' by default)
+    storm_duration
+        The duration of the storm (minutes). Default: 120
+    validate: bool
+        Whether to check the catchment properties and report all the invalid values
+        at once (see augur.data.check_catchments()). Default: True
+    time_grid: str
+        The time grid of the hydrographs. Options: 'fixed' (0 to 5 h every 0.1 h) or
+        'adaptive' (see get_adaptive_time_grid()). Default: 'fixed'
+    ret_periods: list
+        The return periods [years] to compute, the precipitation being taken from the
+        fields 'p{return period}'. Default: [10, 30, 100]
+
+    Returns
+    -------
+    A CatchmentCache with read-only arrays.
+    """
+    if validate:
+        agd.check_catchments(catchments, precipitation, ret_periods)
+    if storm_duration <= 0:
+        raise ValueError("The storm duration cannot be null or negative.")
+    if time_grid not in TIME_GRIDS:
+        raise ValueError(f"The time grid must be one of {TIME_GRIDS}.")
+
+    area = np.asarray(catchments['area'], dtype=float)
+
+    # Parameterized rain covered area
+    area_rain = get_rain_area(area, validate=False)
+
+    # Land covers, the bare and cryo covers being merged into debris
+    land_cover = _get_land_cover(catchments)
+
+    # Precipitation, shape (N, R)
+    precip = np.column_stack([np.asarray(precipitation[k], dtype=float) for k in
+                              agd.get_return_period_columns('p', ret_periods)])
+
+    # Time from start of rain to maximum outflow [h]
+    t_p = get_time_to_peak(catchments['length_watercourse'],
+                           catchments['slope_gradient'], storm_duration,
+                           validate=False)
+
+    # Unit peakflow [m^3 / s]
+    q_up = get_unit_peakflow(area, t_p, validate=False)
+
+    if time_grid == 'adaptive':
+        # Time, shape (N, T)
+        time = get_adaptive_time_grid(t_p, storm_duration)
+
+        # Response to a unit rainfall, over the whole hydrograph
+        repartition = get_hyetogram(_get_precip_time_steps_nb(storm_duration), 1)
+        response = _compute_unit_response(time, q_up, t_p, repartition)
+
+    else:
+        # Time
+        time = np.arange(0, 5, TIME_STEP)
+
+        # Unit discharge, shape (N, T)
+        q_r = time[np.newaxis, :] / t_p[:, np.newaxis]
+        q_up_2d = q_up[:, np.newaxis]
+        q_uh = np.where(q_r <= 1, q_r * q_up_2d, q_up_2d - ((q_r - 1) / 2 * q_up_2d))
+        q_uh[q_uh < 0] = 0
+
+        # Precipitation time steps number
+        precip_time_steps_nb = len(time[(time > 0) & (time <= storm_duration / 60)])
+
+        # Response to a unit rainfall, truncated to the time window
+        repartition = get_hyetogram(precip_time_steps_nb, 1)
+        response = convolve_hyetogram(q_uh, repartition)
+
+    cache = CatchmentCache(time=time, area_rain=area_rain, t_p=t_p, q_up=q_up,
+                           land_cover=land_cover, precipitation=precip,
+                           response=response,
+                           response_i_max=response.argmax(axis=1),
+                           response_i_min=response.argmin(axis=1))
+    for array in cache:
+        array.flags.writeable = False
+
+    return cache
+
+
+def compute_peak_discharge_from_cache(cache, soil_types, cns, return_time=False):
+    """
+    Compute the peak discharge of several catchments from their precomputed
+    parameter-invariant quantities. Only the parts depending on the curve numbers
+    are computed here.
+
+    Parameters
+    ----------
+    cache: CatchmentCache
+        The precomputed catchment quantities (see precompute_catchments()).
+    soil_types: array-like
+        The soil type category of each catchment. Options: 'A', 'B', 'C', 'D', or
+        their integer codes (see augur.data.classify_soil_type_codes_augur())
+    cns: Pandas dataframe
+        The curve number parameters
+    return_time: bool
+        Whether to also return the time to peak of the hydrographs.
+
+    Returns
+    -------
+    The peak discharge [m3/s] as an array of shape (N, R), with R the number of return
+    periods, and, if return_time is True, the time of the peak [h] with the same shape.
+    """
+    production = _compute_production_batch(cache, soil_types, cns)
+    response = cache.response
+    rows = np.arange(response.shape[0])
+    i_max = cache.response_i_max
+    i_min = cache.response_i_min
+
+    # The peak of a negative production is the minimum of the unit response
+    positive = production >= 0
+    peak_q = np.where(positive,
+                      response[rows, i_max][:, np.newaxis] * production,
+                      response[rows, i_min][:, np.newaxis] * production) * 0.9
+
+    if not return_time:
+        return peak_q
+
+    i_peak = np.where(positive, i_max[:, np.newaxis], i_min[:, np.newaxis])
+    i_peak[production == 0] = 0
+
+    if cache.time.ndim == 2:
+        return peak_q, cache.time[rows[:, np.newaxis], i_peak]
+
+    return peak_q, cache.time[i_peak]
+
+
+def _get_land_cover(catchments):
+    """
+    Get the land cover percentages of the catchments as an array of shape (N, 5),
+    ordered as LAND_COVERS (the bare and cryo covers being merged into debris).
+    """
+    return np.column_stack([
+        np.asarray(catchments['cover_farmland'], dtype=float),
+        np.asarray(catchments['cover_pasture'], dtype=float),
+        np.asarray(catchments['cover_forest'], dtype=float),
+        np.asarray(catchments['cover_settlement'], dtype=float),
+        np.asarray(catchments['cover_bare'], dtype=float) +
+        np.asarray(catchments['cover_cryo'], dtype=float)])
+
+
+def _compute_production_batch(cache, soil_types, cns):
+    """
+    Compute the precipitation relevant to runoff [mm] of several catchments, as an
+    array of shape (N, R).
+    """
+    cn_factor = _compute_cn_factor_batch(cache.land_cover, cns, soil_types)
+
+    return 0.7 * (cache.area_rain / 100 * cn_factor / 100)[:, np.newaxis] * \
+        cache.precipitation
+
+
+def _compute_cn_factor_batch(land_cover, cns, soil_types):
+    """
+    Compute the curve number factors of several catchments at once from their land
+    cover percentages (shape (N, 5), ordered as LAND_COVERS).
+    """
+    codes = agd.soil_type_labels_to_codes(soil_types)
+    cns_soil = cns.loc[LAND_COVERS, SOIL_TYPES].to_numpy(dtype=float)[:, codes]
+
+    cn = land_cover[:, 0] / 100 * cns_soil[0]
+    for i_land in range(1, len(LAND_COVERS)):
+        cn = cn + land_cover[:, i_land] / 100 * cns_soil[i_land]
+
+    return cn
+
+
+def _get_precip_time_steps_nb(storm_duration):
+    """
+    Get the number of time steps of the storm.
+    """
+    time = np.arange(0, storm_duration / 60 + TIME_STEP, TIME_STEP)
+
+    return len(time[(time > 0) & (time <= storm_duration / 60)])
+
+
+def _compute_unit_response(time, q_up, t_p, hyetogram):
+    """
+    Compute the hydrograph of a unit rainfall at arbitrary time steps, as the sum of
+    the unit hydrographs starting at every time step of the hyetogram.
+
+    Parameters
+    ----------
+    time: np.ndarray
+        The time steps [h], of shape (T,) or (N, T).
+    q_up: float|np.ndarray
+        The unit peakflow [m3/s], of shape (N,) for several catchments.
+    t_p: float|np.ndarray
+        The time to peak [h], of shape (N,) for several catchments.
+    hyetogram: np.ndarray
+        The hyetogram of a unit rainfall, of shape (S,).
+
+    Returns
+    -------
+    The response [m3/s] with the shape of the time steps.
+    """
+    q_up = np.asarray(q_up, dtype=float)[..., np.newaxis, np.newaxis]
+    t_p = np.asarray(t_p, dtype=float)[..., np.newaxis, np.newaxis]
+    starts = np.arange(len(hyetogram)) * TIME_STEP
+
+    # Unit hydrographs of all the pulses, shape (..., T, S)
+    q_r = (time[..., np.newaxis] - starts) / t_p
+    q_uh = np.maximum(_get_unit_hydrograph_shape(q_r), 0) * q_up
+
+    return q_uh @ hyetogram
+
+
+def _check_values(invalid, values, message):
+    """
+    Raise an error listing the invalid values, if any.
+    """
+    if np.any(invalid):
+        invalid_values = np.atleast_1d(values)[np.atleast_1d(invalid)]
+        raise ValueError(f"{message} Here: {invalid_values}.")
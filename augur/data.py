@@ -1,8 +1,66 @@
+import functools
+import hashlib
 import math
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
+import rasterio
+from affine import Affine
+from rasterio import features, windows
+from rasterio.errors import WindowError
 from rasterstats import zonal_stats
 
+# Soil types, the code of a soil type being its index in the list
+SOIL_TYPES = ['A', 'B', 'C', 'D']
+
+# Land cover percentages of the catchments
+LAND_COVER_COLUMNS = ['cover_farmland', 'cover_pasture', 'cover_forest',
+                      'cover_settlement', 'cover_bare', 'cover_cryo', 'cover_water']
+
+# Default return periods [years] of the design precipitation and floods
+RETURN_PERIODS = [10, 30, 100]
+
+# Number of rows of the time series files read at once
+READ_CHUNK_SIZE = 200000
+
+# Default memory budget of the raster block cache [bytes]
+RASTER_CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+# Number of catchments processed at once by ZonalWeights (one raster window each)
+ZONAL_CHUNK_SIZE = 256
+
+# Kinds of catchment properties extracted from rasters (see extract_properties())
+EXTRACTION_KINDS = ['soil_content', 'soil_depth', 'land_cover']
+
+# Land cover types extracted from the land cover datasets
+LAND_COVER_TYPES = ['farmland', 'pasture', 'forest', 'settlement', 'water', 'bare',
+                    'cryo']
+
+# Raster codes of the land cover types for the land cover datasets (inclusive ranges)
+LAND_COVER_SCHEMAS = {
+    'cci': {
+        'farmland': [(10, 30)],
+        'pasture': [(40, 40), (100, 153)],
+        'forest': [(50, 90)],
+        'settlement': [(190, 190)],
+        'water': [(160, 180), (210, 210)],
+        'bare': [(200, 202)],
+        'cryo': [(220, 220)]},
+    'worldcover': {
+        'farmland': [(40, 40)],
+        'pasture': [(20, 30), (90, 100)],
+        'forest': [(10, 10)],
+        'settlement': [(50, 50)],
+        'water': [(80, 80)],
+        'bare': [(60, 60)],
+        'cryo': [(70, 70)]},
+}
+
 
 def reclassify_slope_gradients(catchment):
     """
@@ -25,7 +83,7 @@ def reclassify_slope_gradients(catchment):
     return catchment
 
 
-def get_soil_content(raster_file, polygon):
+def get_soil_content(raster_file, polygon, cache=None):
     """
     Extract the soil content from SoilGrid data.
 
@@ -35,15 +93,19 @@ def get_soil_content(raster_file, polygon):
         Path to the SoilGrid file.
     polygon: geometry
         Polygon for which to extract the soil properties.
+    cache: RasterBlockCache
+        The cache through which the raster is read. Default: None (no cache)
 
     Returns
     -------
     The soil fraction of clay/sand, for example ([0 .. 1]).
     """
-    return 100 * zonal_stats(polygon, raster_file, nodata=-999)[0]['mean'] / 1000
+    stats = _zonal_stats(polygon, raster_file, cache, nodata=-999)
 
+    return 100 * stats[0]['mean'] / 1000
 
-def get_soil_depth(raster_file, polygon):
+
+def get_soil_depth(raster_file, polygon, cache=None):
     """
     Extract the soil depth from SoilGrid data.
 
@@ -53,12 +115,32 @@ def get_soil_depth(raster_file, polygon):
         Path to the SoilGrid file.
     polygon: geometry
         Polygon for which to extract the soil properties.
+    cache: RasterBlockCache
+        The cache through which the raster is read. Default: None (no cache)
 
     Returns
     -------
     The soil depth in meters.
     """
-    return zonal_stats(polygon, raster_file, nodata=-999)[0]['mean']
+    return _zonal_stats(polygon, raster_file, cache, nodata=-999)[0]['mean']
+
+
+def _zonal_stats(polygon, raster_file, cache=None, **kwargs):
+    """
+    Compute zonal statistics with rasterstats, reading the raster through a
+    RasterBlockCache if provided.
+    """
+    if cache is None:
+        return zonal_stats(polygon, raster_file, **kwargs)
+
+    if hasattr(polygon, 'total_bounds'):
+        bounds = polygon.total_bounds
+    else:
+        bounds = polygon.bounds
+    values, transform, _ = cache.read_bounds(raster_file, bounds,
+                                             fill_value=kwargs.get('nodata'))
+
+    return zonal_stats(polygon, values, affine=transform, **kwargs)
 
 
 def check_land_cover_total(catchment):
@@ -68,24 +150,164 @@ def check_land_cover_total(catchment):
     Parameters
     ----------
     catchment: Pandas dataframe
-        Dataframe containing the land cover percentages
+        Dataframe containing the land cover percentages. The fields can be scalars
+        (single catchment) or arrays (several catchments).
     """
     total = catchment['cover_farmland'] + catchment['cover_pasture'] + \
             catchment['cover_forest'] + catchment['cover_settlement'] + \
             catchment['cover_bare'] + catchment['cover_cryo'] + catchment['cover_water']
 
-    if not math.isclose(total, 100):
-        raise ValueError(f"The sum of land covers should be 100%. Here: {total}.")
+    if np.ndim(total) == 0:
+        if not math.isclose(total, 100):
+            raise ValueError(f"The sum of land covers should be 100%. Here: {total}.")
+        return
+
+    total = np.asarray(total, dtype=float)
+    invalid = ~np.isclose(total, 100, rtol=1e-09, atol=0)
+    if np.any(invalid):
+        raise ValueError(f"The sum of land covers should be 100%. "
+                         f"Here: {total[invalid]}.")
+
+
+def get_return_period_columns(prefix, ret_periods=None):
+    """
+    Get the names of the columns holding values for different return periods.
+
+    Parameters
+    ----------
+    prefix: str
+        The prefix of the columns, e.g. 'p' for the precipitation and 'q' for the
+        discharge.
+    ret_periods: list
+        The return periods [years]. Default: RETURN_PERIODS ([10, 30, 100])
+
+    Returns
+    -------
+    The list of the column names (e.g. ['p10', 'p30', 'p100']).
+    """
+    if ret_periods is None:
+        ret_periods = RETURN_PERIODS
+
+    return [f'{prefix}{ret_period:g}' for ret_period in ret_periods]
 
 
-def get_land_cover(dataset, raster_file, polygon, type):
+def validate_catchments(catchments, precipitation=None, ret_periods=None):
+    """
+    Check the properties of several catchments in a single vectorized pass and report
+    every invalid value at once, instead of raising on the first one. The checks are
+    the same as the ones of the hydrograph computation (positive area and watercourse
+    length, non-negative slope gradient, land covers summing to 100%), plus missing
+    values, negative land covers and negative precipitation.
+
+    Parameters
+    ----------
+    catchments: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        properties of N catchments ('area', 'length_watercourse', 'slope_gradient'
+        and the land cover percentages).
+    precipitation: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        aggregated precipitation values of the N catchments for different return
+        periods (e.g. 'p10', 'p30', 'p100'). Not checked if not provided.
+    ret_periods: list
+        The return periods [years] of the precipitation. Default: [10, 30, 100]
+
+    Returns
+    -------
+    A dataframe with one row per error and the fields 'row' (the index label of the
+    catchment, or its position if the catchments are not a dataframe), 'column',
+    'value' and 'reason'. It is empty if the catchments are valid.
+    """
+    names = ['area', 'length_watercourse', 'slope_gradient'] + LAND_COVER_COLUMNS
+    tables = [(catchments, names)]
+    precipitation_columns = get_return_period_columns('p', ret_periods)
+    if precipitation is not None:
+        tables.append((precipitation, precipitation_columns))
+
+    missing = [name for table, columns in tables for name in columns
+               if name not in table]
+    if missing:
+        raise ValueError(f"Missing catchment properties: {missing}.")
+
+    columns = {name: np.atleast_1d(np.asarray(table[name], dtype=float))
+               for table, columns in tables for name in columns}
+    columns = dict(zip(columns, np.broadcast_arrays(*columns.values())))
+    total = sum(columns[name] for name in LAND_COVER_COLUMNS)
+
+    if isinstance(catchments, pd.DataFrame):
+        labels = catchments.index.to_numpy()
+    else:
+        labels = np.arange(len(total))
+
+    checks = [(name, np.isnan(values), "Missing value.")
+              for name, values in columns.items()]
+    checks += [
+        ('area', columns['area'] <= 0,
+         "The catchment area cannot be null or negative."),
+        ('length_watercourse', columns['length_watercourse'] <= 0,
+         "The watercourse length cannot be null or negative."),
+        ('slope_gradient', columns['slope_gradient'] < 0,
+         "The slope gradient cannot be negative.")]
+    checks += [(name, columns[name] < 0, "The land cover cannot be negative.")
+               for name in LAND_COVER_COLUMNS]
+    checks.append(('land_cover_total',
+                   ~np.isnan(total) & ~np.isclose(total, 100, rtol=1e-09, atol=0),
+                   "The sum of land covers should be 100%."))
+    if precipitation is not None:
+        checks += [(name, columns[name] < 0, "The precipitation cannot be negative.")
+                   for name in precipitation_columns]
+
+    errors = []
+    for name, invalid, reason in checks:
+        rows = np.flatnonzero(invalid)
+        if len(rows) == 0:
+            continue
+        values = total if name == 'land_cover_total' else columns[name]
+        errors.append(pd.DataFrame({'position': rows, 'row': labels[rows],
+                                    'column': name, 'value': values[rows],
+                                    'reason': reason}))
+
+    if not errors:
+        return pd.DataFrame(columns=['row', 'column', 'value', 'reason'])
+
+    errors = pd.concat(errors, ignore_index=True)
+    errors = errors.sort_values('position', kind='stable', ignore_index=True)
+
+    return errors.drop(columns='position')
+
+
+def check_catchments(catchments, precipitation=None, ret_periods=None):
+    """
+    Check the properties of several catchments (see validate_catchments()) and raise
+    a single error listing all the invalid values.
+
+    Parameters
+    ----------
+    catchments: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        properties of N catchments.
+    precipitation: Pandas dataframe|CatchmentBatch
+        A Pandas dataframe (or a CatchmentBatch, or a dict of arrays) containing the
+        aggregated precipitation values of the N catchments. Not checked if not provided.
+    ret_periods: list
+        The return periods [years] of the precipitation. Default: [10, 30, 100]
+    """
+    errors = validate_catchments(catchments, precipitation, ret_periods)
+    if len(errors) > 0:
+        raise ValueError(f"Invalid catchment properties ({len(errors)} errors):\n"
+                         f"{errors.to_string(index=False)}")
+
+
+def get_land_cover(dataset, raster_file, polygon, type, cache=None):
     """
     Get the land cover percent from a given dataset and for a provided polygon.
+    To get several land cover types, get_land_covers() reads the raster only once.
 
     Parameters
     ----------
     dataset: str
-        The dataset to extract the land cover from: cci or worldcover.
+        The dataset to extract the land cover from: cci, worldcover or a schema
+        registered with register_land_cover_schema().
     raster_file: str|Path
         The path to the raster file of the selected dataset.
     polygon
@@ -93,62 +315,152 @@ def get_land_cover(dataset, raster_file, polygon, type):
     type
         The land cover type to compute. Options: farmland, pasture, forest, settlement,
         water, bare, cryo
+    cache: RasterBlockCache
+        The cache through which the raster is read. Default: None (no cache)
 
     Returns
     -------
     The percentage of the land cover of interest.
     """
-    if dataset == 'cci':
-        if type == 'farmland':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_farmland})[0]['cover']
-        if type == 'pasture':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_pasture})[0]['cover']
-        if type == 'forest':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_forest})[0]['cover']
-        if type == 'settlement':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_settlement})[0]['cover']
-        if type == 'water':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_water})[0]['cover']
-        if type == 'bare':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_bare})[0]['cover']
-        if type == 'cryo':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_cci_cryo})[0]['cover']
-
+    if type not in LAND_COVER_TYPES:
         raise ValueError(f"Type {type} is not defined.")
 
-    elif dataset == 'worldcover':
-        if type == 'farmland':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_farmland})[0]['cover']
-        if type == 'pasture':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_pasture})[0]['cover']
-        if type == 'forest':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_forest})[0]['cover']
-        if type == 'settlement':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_settlement})[0]['cover']
-        if type == 'water':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_water})[0]['cover']
-        if type == 'bare':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_bare})[0]['cover']
-        if type == 'cryo':
-            return 100 * zonal_stats(polygon, raster_file, nodata=0,
-                                     add_stats={'cover': cover_wc_cryo})[0]['cover']
+    return get_land_covers(dataset, raster_file, polygon, cache)[type]
 
-        raise ValueError(f"Type {type} is not defined.")
 
-    raise ValueError(f"Dataset {dataset} is not defined.")
+def get_land_covers(dataset, raster_file, polygon, cache=None):
+    """
+    Get the percentages of all the land cover types from a given dataset and for a
+    provided polygon. The raster window is read once, and the raster codes are mapped
+    to the land cover types through a lookup table and counted in a single pass.
+
+    Parameters
+    ----------
+    dataset: str
+        The dataset to extract the land cover from: cci, worldcover or a schema
+        registered with register_land_cover_schema().
+    raster_file: str|Path
+        The path to the raster file of the selected dataset.
+    polygon
+        The polygon of interest.
+    cache: RasterBlockCache
+        The cache through which the raster is read. Default: None (no cache)
+
+    Returns
+    -------
+    A dict with the percentage of every land cover type (LAND_COVER_TYPES).
+    """
+    lut = get_land_cover_lut(dataset)
+    fractions = _zonal_stats(
+        polygon, raster_file, cache, nodata=0,
+        add_stats={'cover': lambda x: count_land_covers(x, lut)}
+    )[0]['cover']
+
+    return dict(zip(LAND_COVER_TYPES, 100 * fractions))
+
+
+def get_land_cover_lut(dataset):
+    """
+    Get the lookup table mapping the raster codes of a land cover dataset to the
+    index of the land cover types in LAND_COVER_TYPES.
+
+    Parameters
+    ----------
+    dataset: str
+        The land cover dataset: cci, worldcover or a schema registered with
+        register_land_cover_schema().
+
+    Returns
+    -------
+    An array of 256 entries, -1 for the codes of no land cover type. It is read-only.
+    """
+    if dataset not in LAND_COVER_SCHEMAS:
+        raise ValueError(f"Dataset {dataset} is not defined.")
+
+    return _get_land_cover_lut(dataset)
+
+
+def register_land_cover_schema(dataset, schema):
+    """
+    Register the land cover codes of a custom dataset, to be used with
+    get_land_cover() and get_land_covers().
+
+    Parameters
+    ----------
+    dataset: str
+        The name of the dataset.
+    schema: dict
+        The raster codes (0 to 255) of every land cover type, as lists of inclusive
+        (first, last) ranges, e.g. {'forest': [(10, 12)], 'water': [(80, 80)], ...}.
+        The types missing from the schema have a null percentage.
+    """
+    _build_land_cover_lut(schema)
+
+    LAND_COVER_SCHEMAS[dataset] = schema
+    _get_land_cover_lut.cache_clear()
+
+
+def count_land_covers(x, lut):
+    """
+    Count the fraction of every land cover type in a raster window.
+
+    Parameters
+    ----------
+    x: np.ndarray|np.ma.MaskedArray
+        The raster codes, masked outside of the polygon and for the nodata values.
+    lut: np.ndarray
+        The lookup table of the dataset (see get_land_cover_lut()).
+
+    Returns
+    -------
+    The fractions [0 .. 1] of the land cover types (LAND_COVER_TYPES), relative to
+    the number of valid pixels.
+    """
+    codes = np.ma.compressed(x).astype(np.intp)
+    if len(codes) == 0:
+        return np.full(len(LAND_COVER_TYPES), np.nan)
+
+    # Histogram of the raster codes, then aggregated per land cover type
+    histogram = np.bincount(codes[(codes >= 0) & (codes < len(lut))],
+                            minlength=len(lut))
+    mapped = lut >= 0
+    counts = np.bincount(lut[mapped], weights=histogram[mapped],
+                         minlength=len(LAND_COVER_TYPES))
+
+    return counts / len(codes)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_land_cover_lut(dataset):
+    """
+    Get the lookup table of a land cover dataset (read-only, cached).
+    """
+    lut = _build_land_cover_lut(LAND_COVER_SCHEMAS[dataset])
+    lut.flags.writeable = False
+
+    return lut
+
+
+def _build_land_cover_lut(schema):
+    """
+    Build the lookup table of a land cover schema, checking its codes.
+    """
+    unknown = set(schema) - set(LAND_COVER_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown land cover types: {sorted(unknown)}.")
+
+    lut = np.full(256, -1, dtype=np.int8)
+    for i_type, land_cover_type in enumerate(LAND_COVER_TYPES):
+        for first, last in schema.get(land_cover_type, []):
+            if not 0 <= first <= last <= 255:
+                raise ValueError(f"Invalid range of codes: ({first}, {last}).")
+            codes = lut[first:last + 1]
+            if np.any((codes >= 0) & (codes != i_type)):
+                raise ValueError(f"The codes of {land_cover_type} overlap other "
+                                 f"land cover types.")
+            lut[first:last + 1] = i_type
+
+    return lut
 
 
 def cover_cci_farmland(x):
@@ -224,6 +536,1065 @@ def cover_wc_cryo(x):
     return np.ma.count(x[x == 70]) / np.ma.count(x)
 
 
+class RasterBlockCache:
+    """
+    Raster reading backend keeping the datasets open and the decoded blocks in a
+    size-bounded LRU cache shared across calls, so that the pixels shared by
+    neighbouring catchments (e.g. in the tiles of a VRT mosaic) are read and
+    decompressed only once. It counts the cache hits and misses and the bytes read
+    from the datasets. An instance must not be shared between processes.
+    """
+
+    def __init__(self, max_bytes=RASTER_CACHE_MAX_BYTES, block_size=512):
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+        max_bytes: int
+            The maximum size of the cached blocks [bytes]. Default:
+            RASTER_CACHE_MAX_BYTES
+        block_size: int
+            The size (in pixels) of the square blocks in which the rasters are read
+            and cached. Default: 512
+        """
+        if block_size < 1:
+            raise ValueError("The block size must be at least 1.")
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_cached = 0
+        self._datasets = {}
+        self._blocks = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self, raster_file):
+        """
+        Get the dataset of a raster file, opened on the first call and kept open.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+
+        Returns
+        -------
+        The rasterio dataset.
+        """
+        key = str(raster_file)
+        if key not in self._datasets:
+            self._datasets[key] = rasterio.open(raster_file)
+
+        return self._datasets[key]
+
+    def read(self, raster_file, window, band=1, fill_value=None):
+        """
+        Read a window of a raster from the cached blocks, reading the missing blocks.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+        window: tuple
+            The window (row_start, row_stop, col_start, col_stop) to read. It can
+            extend beyond the raster, the outside pixels being set to fill_value.
+        band: int
+            The band to read. Default: 1
+        fill_value: float
+            The value of the pixels outside of the raster. Default: the nodata value
+            of the raster, or 0
+
+        Returns
+        -------
+        The values of the window, with the data type of the raster, promoted if
+        needed to hold the fill value (e.g. int16 for a uint8 raster filled with
+        -999).
+        """
+        dataset = self.open(raster_file)
+        row_start, row_stop, col_start, col_stop = (int(v) for v in window)
+        if fill_value is None:
+            fill_value = 0 if dataset.nodata is None else dataset.nodata
+        dtype = np.dtype(dataset.dtypes[band - 1])
+        fill_dtype = np.min_scalar_type(fill_value)
+        if not np.can_cast(fill_dtype, dtype):
+            dtype = np.promote_types(dtype, fill_dtype)
+        values = np.full((row_stop - row_start, col_stop - col_start), fill_value,
+                         dtype=dtype)
+
+        # Part of the window inside the raster
+        height, width = dataset.shape
+        inner_rows = (max(row_start, 0), min(row_stop, height))
+        inner_cols = (max(col_start, 0), min(col_stop, width))
+        if inner_rows[0] >= inner_rows[1] or inner_cols[0] >= inner_cols[1]:
+            return values
+
+        size = self.block_size
+        for block_row in range(inner_rows[0] // size, (inner_rows[1] - 1) // size + 1):
+            for block_col in range(inner_cols[0] // size,
+                                   (inner_cols[1] - 1) // size + 1):
+                block = self._get_block(dataset, str(raster_file), band, block_row,
+                                        block_col)
+                rows = (max(inner_rows[0], block_row * size),
+                        min(inner_rows[1], (block_row + 1) * size))
+                cols = (max(inner_cols[0], block_col * size),
+                        min(inner_cols[1], (block_col + 1) * size))
+                values[rows[0] - row_start:rows[1] - row_start,
+                       cols[0] - col_start:cols[1] - col_start] = \
+                    block[rows[0] - block_row * size:rows[1] - block_row * size,
+                          cols[0] - block_col * size:cols[1] - block_col * size]
+
+        return values
+
+    def read_bounds(self, raster_file, bounds, band=1, fill_value=None):
+        """
+        Read the window of a raster covering the given bounds.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+        bounds: tuple
+            The bounds (left, bottom, right, top) in the coordinate system of the
+            raster.
+        band: int
+            The band to read. Default: 1
+        fill_value: float
+            The value of the pixels outside of the raster. Default: the nodata value
+            of the raster, or 0
+
+        Returns
+        -------
+        The values of the window, its affine transform and the nodata value.
+        """
+        dataset = self.open(raster_file)
+        window = windows.from_bounds(*bounds, transform=dataset.transform)
+        window = window.round_offsets('floor').round_lengths('ceil')
+        row_start, col_start = int(window.row_off), int(window.col_off)
+        values = self.read(raster_file, (row_start, row_start + int(window.height),
+                                         col_start, col_start + int(window.width)),
+                           band, fill_value)
+
+        return values, windows.transform(window, dataset.transform), dataset.nodata
+
+    def cache_info(self):
+        """
+        Get the statistics of the cache.
+
+        Returns
+        -------
+        A dict with the number of hits and misses, the bytes read from the datasets,
+        the bytes and number of the cached blocks and the number of open datasets.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes_read': self.bytes_read, 'bytes_cached': self.bytes_cached,
+                'blocks_nb': len(self._blocks), 'datasets_nb': len(self._datasets)}
+
+    def clear(self):
+        """
+        Drop the cached blocks (the datasets are kept open).
+        """
+        self._blocks.clear()
+        self.bytes_cached = 0
+
+    def close(self):
+        """
+        Drop the cached blocks and close the datasets.
+        """
+        self.clear()
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets.clear()
+
+    def _get_block(self, dataset, key, band, block_row, block_col):
+        """
+        Get a block from the cache, or read it from the dataset.
+        """
+        block_key = (key, band, block_row, block_col)
+        block = self._blocks.get(block_key)
+        if block is not None:
+            self.hits += 1
+            self._blocks.move_to_end(block_key)
+            return block
+
+        self.misses += 1
+        size = self.block_size
+        block = dataset.read(band, window=windows.Window(
+            block_col * size, block_row * size,
+            min(size, dataset.width - block_col * size),
+            min(size, dataset.height - block_row * size)))
+        block.flags.writeable = False
+        self.bytes_read += block.nbytes
+
+        # Evict the least recently used blocks
+        while self._blocks and self.bytes_cached + block.nbytes > self.max_bytes:
+            _, evicted = self._blocks.popitem(last=False)
+            self.bytes_cached -= evicted.nbytes
+        if block.nbytes <= self.max_bytes:
+            self._blocks[block_key] = block
+            self.bytes_cached += block.nbytes
+
+        return block
+
+
+class ZonalWeights:
+    """
+    Sparse catchment-by-pixel weight operator of N catchments on a raster grid, in
+    compressed sparse row form (one row per catchment). It is built once per set of
+    catchments and raster grid, after which the zonal statistics of any co-registered
+    raster are computed for all the catchments, instead of rasterizing every polygon
+    for every raster. The pixels are stored as flat indices (int32 when the grid
+    allows it) with float32 weights, i.e. 8 to 12 bytes per covered pixel, and the
+    rasters are read in windows covering chunks of catchments.
+    """
+
+    def __init__(self, indptr, pixels, weights, shape):
+        """
+        Initialize the weight operator.
+
+        Parameters
+        ----------
+        indptr: array-like
+            The offsets of the pixels of every catchment, of length N + 1.
+        pixels: array-like
+            The flat index (row * width + col) of every pixel in the raster grid.
+        weights: array-like
+            The weight of every pixel, i.e. the fraction of the pixel covered by the
+            catchment ([0 .. 1]).
+        shape: tuple
+            The shape (height, width) of the raster grid.
+        """
+        self.shape = tuple(int(v) for v in shape)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.pixels = np.asarray(pixels, dtype=self._get_pixel_dtype(self.shape))
+        self.weights = np.asarray(weights, dtype=np.float32)
+        if self.indptr[0] != 0 or self.indptr[-1] != len(self.weights) or \
+                np.any(np.diff(self.indptr) < 0):
+            raise ValueError("The pixel offsets are not consistent with the weights.")
+        if len(self.pixels) != len(self.weights):
+            raise ValueError("The pixels and weights must have the same length.")
+
+    @classmethod
+    def from_geometries(cls, geometries, shape, transform, supersampling=1,
+                        all_touched=False):
+        """
+        Build the weight operator of polygons on a raster grid.
+
+        Parameters
+        ----------
+        geometries: list|GeoSeries|GeoDataFrame
+            The polygons of the N catchments, in the coordinate system of the raster.
+        shape: tuple
+            The shape (height, width) of the raster grid.
+        transform: Affine
+            The affine transform of the raster grid.
+        supersampling: int
+            The number of subdivisions of the pixels along each axis used to compute
+            the fraction of the boundary pixels covered by the polygons. With 1, the
+            pixels whose center is in a polygon have a weight of 1, as in zonal_stats().
+            Default: 1
+        all_touched: bool
+            Whether to include all the pixels touched by the polygons (with
+            supersampling = 1 only). Default: False
+
+        Returns
+        -------
+        A ZonalWeights instance.
+        """
+        if supersampling < 1:
+            raise ValueError("The supersampling factor must be at least 1.")
+        if hasattr(geometries, 'geometry'):
+            geometries = geometries.geometry
+        grid = windows.Window(0, 0, shape[1], shape[0])
+        pixel_dtype = cls._get_pixel_dtype(shape)
+
+        indptr = [0]
+        pixels, weights = [], []
+        for geometry in geometries:
+            window = windows.from_bounds(*geometry.bounds, transform=transform)
+            window = window.round_offsets('floor').round_lengths('ceil')
+            try:
+                window = window.intersection(grid)
+            except WindowError:
+                indptr.append(indptr[-1])
+                continue
+            height, width = int(window.height), int(window.width)
+            fine_transform = windows.transform(window, transform) * \
+                Affine.scale(1 / supersampling)
+            mask = features.rasterize(
+                [(geometry, 1)], fill=0, dtype='uint8', transform=fine_transform,
+                out_shape=(height * supersampling, width * supersampling),
+                all_touched=all_touched)
+            coverage = mask.reshape(height, supersampling, width, supersampling).sum(
+                axis=(1, 3), dtype=np.float32) / supersampling ** 2
+            window_rows, window_cols = np.nonzero(coverage)
+            pixels.append(((window_rows + int(window.row_off)) * shape[1] +
+                           window_cols + int(window.col_off)).astype(pixel_dtype))
+            weights.append(coverage[window_rows, window_cols])
+            indptr.append(indptr[-1] + len(window_rows))
+
+        if not weights:
+            pixels = weights = [np.zeros(0)]
+
+        return cls(indptr, np.concatenate(pixels), np.concatenate(weights), shape)
+
+    @classmethod
+    def from_raster(cls, geometries, raster_file, supersampling=1, all_touched=False):
+        """
+        Build the weight operator of polygons on the grid of a raster file (see
+        from_geometries()).
+
+        Parameters
+        ----------
+        geometries: list|GeoSeries|GeoDataFrame
+            The polygons of the N catchments, in the coordinate system of the raster.
+        raster_file: str|Path
+            The path to a raster file of the grid.
+        supersampling: int
+            The number of subdivisions of the pixels along each axis. Default: 1
+        all_touched: bool
+            Whether to include all the pixels touched by the polygons. Default: False
+
+        Returns
+        -------
+        A ZonalWeights instance.
+        """
+        with rasterio.open(raster_file) as src:
+            shape, transform = src.shape, src.transform
+
+        return cls.from_geometries(geometries, shape, transform, supersampling,
+                                   all_touched)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def window(self):
+        """
+        The window (row_start, row_stop, col_start, col_stop) of the raster grid
+        covering all the catchments.
+        """
+        return self._get_window(0, len(self))
+
+    def read(self, raster_file, band=1, cache=None):
+        """
+        Read the window of a co-registered raster covering all the catchments. For
+        large domains, prefer zonal_mean() and zonal_fractions(), which read the
+        raster by chunks of catchments.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+        band: int
+            The band to read. Default: 1
+        cache: RasterBlockCache
+            The cache through which the raster is read. Default: None (no cache)
+
+        Returns
+        -------
+        The values of the window, and the nodata value of the raster.
+        """
+        with _ZonalReader(raster_file, self.shape, cache) as reader:
+            return reader.read(self.window, band)
+
+    def mean(self, values, nodata=None, chunk_size=ZONAL_CHUNK_SIZE):
+        """
+        Compute the weighted mean of a raster for every catchment, ignoring the
+        nodata and NaN values.
+
+        Parameters
+        ----------
+        values: np.ndarray
+            The raster values, over the whole grid or over the window (see read()).
+        nodata: float
+            The nodata value. Default: None
+        chunk_size: int
+            The number of catchments processed at once. Default: ZONAL_CHUNK_SIZE
+
+        Returns
+        -------
+        The mean values of the N catchments (NaN without valid pixel).
+        """
+        window = self._get_values_window(values)
+        means = [self._mean_chunk(values, window, nodata, start, stop)
+                 for start, stop in self._get_chunks(chunk_size)]
+
+        return np.concatenate(means) if means else np.zeros(0)
+
+    def fractions(self, values, lut, nodata=0, classes_nb=None,
+                  chunk_size=ZONAL_CHUNK_SIZE):
+        """
+        Compute the fractions of classes of a categorical raster for every catchment,
+        relative to the weight of the valid pixels.
+
+        Parameters
+        ----------
+        values: np.ndarray
+            The raster codes, over the whole grid or over the window (see read()).
+        lut: np.ndarray
+            The lookup table mapping the codes to the class indices, -1 for no class
+            (see get_land_cover_lut()).
+        nodata: int
+            The nodata value. Default: 0, as in get_land_covers()
+        classes_nb: int
+            The number of classes C. Default: the number of land cover types
+        chunk_size: int
+            The number of catchments processed at once. Default: ZONAL_CHUNK_SIZE
+
+        Returns
+        -------
+        The fractions [0 .. 1] as an array of shape (N, C) (NaN without valid pixel).
+        """
+        lut, classes_nb = self._check_lut(lut, classes_nb)
+        window = self._get_values_window(values)
+        fractions = [self._fractions_chunk(values, window, lut, nodata, classes_nb,
+                                           start, stop)
+                     for start, stop in self._get_chunks(chunk_size)]
+
+        return np.concatenate(fractions) if fractions else np.zeros((0, classes_nb))
+
+    def zonal_mean(self, raster_file, band=1, cache=None, nodata=None,
+                   chunk_size=ZONAL_CHUNK_SIZE):
+        """
+        Read a co-registered raster and compute its mean for every catchment. The
+        raster is read in windows covering chunks of catchments.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+        band: int
+            The band to read. Default: 1
+        cache: RasterBlockCache
+            The cache through which the raster is read. Default: None (no cache)
+        nodata: float
+            The nodata value. Default: the nodata value of the raster
+        chunk_size: int
+            The number of catchments whose window is read at once.
+            Default: ZONAL_CHUNK_SIZE
+
+        Returns
+        -------
+        The mean values of the N catchments.
+        """
+        means = []
+        with _ZonalReader(raster_file, self.shape, cache) as reader:
+            for start, stop in self._get_chunks(chunk_size):
+                window = self._get_window(start, stop)
+                values, raster_nodata = reader.read(window, band)
+                means.append(self._mean_chunk(
+                    values, window, raster_nodata if nodata is None else nodata,
+                    start, stop))
+
+        return np.concatenate(means) if means else np.zeros(0)
+
+    def zonal_fractions(self, raster_file, lut, band=1, classes_nb=None, cache=None,
+                        nodata=0, chunk_size=ZONAL_CHUNK_SIZE):
+        """
+        Read a co-registered categorical raster and compute its class fractions for
+        every catchment. The raster is read in windows covering chunks of catchments.
+
+        Parameters
+        ----------
+        raster_file: str|Path
+            The path to the raster file.
+        lut: np.ndarray
+            The lookup table mapping the codes to the class indices.
+        band: int
+            The band to read. Default: 1
+        classes_nb: int
+            The number of classes C. Default: the number of land cover types
+        cache: RasterBlockCache
+            The cache through which the raster is read. Default: None (no cache)
+        nodata: int
+            The code of the pixels without data. Default: 0, as in get_land_covers()
+            (the nodata value of the raster is not used)
+        chunk_size: int
+            The number of catchments whose window is read at once.
+            Default: ZONAL_CHUNK_SIZE
+
+        Returns
+        -------
+        The fractions [0 .. 1] as an array of shape (N, C).
+        """
+        lut, classes_nb = self._check_lut(lut, classes_nb)
+        fractions = []
+        with _ZonalReader(raster_file, self.shape, cache) as reader:
+            for start, stop in self._get_chunks(chunk_size):
+                window = self._get_window(start, stop)
+                values, _ = reader.read(window, band)
+                fractions.append(self._fractions_chunk(
+                    values, window, lut, nodata, classes_nb, start, stop))
+
+        return np.concatenate(fractions) if fractions else np.zeros((0, classes_nb))
+
+    @staticmethod
+    def _get_pixel_dtype(shape):
+        """
+        Get the smallest integer type of the flat pixel indices of a grid.
+        """
+        return np.int32 if shape[0] * shape[1] <= np.iinfo(np.int32).max else np.int64
+
+    def _get_chunks(self, chunk_size):
+        """
+        Get the (start, stop) ranges of the chunks of catchments.
+        """
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1.")
+
+        return [(start, min(start + chunk_size, len(self)))
+                for start in range(0, len(self), chunk_size)]
+
+    def _get_window(self, start, stop):
+        """
+        Get the window (row_start, row_stop, col_start, col_stop) covering the pixels
+        of a range of catchments.
+        """
+        pixels = self.pixels[self.indptr[start]:self.indptr[stop]]
+        if len(pixels) == 0:
+            return 0, 0, 0, 0
+        rows, cols = np.divmod(pixels, self.shape[1])
+
+        return (int(rows.min()), int(rows.max()) + 1,
+                int(cols.min()), int(cols.max()) + 1)
+
+    def _get_values_window(self, values):
+        """
+        Get the window of the grid covered by raster values: the whole grid or the
+        window of all the catchments.
+        """
+        shape = np.shape(values)
+        row_start, row_stop, col_start, col_stop = self.window
+        if shape == self.shape:
+            return 0, self.shape[0], 0, self.shape[1]
+        if shape == (row_stop - row_start, col_stop - col_start):
+            return self.window
+        raise ValueError(f"The values shape {shape} matches neither the grid nor the "
+                         f"window.")
+
+    def _check_lut(self, lut, classes_nb):
+        """
+        Check a lookup table and get the number of classes.
+        """
+        lut = np.asarray(lut)
+        if classes_nb is None:
+            classes_nb = len(LAND_COVER_TYPES)
+        if lut.max() >= classes_nb:
+            raise ValueError("The lookup table has more classes than classes_nb.")
+
+        return lut, classes_nb
+
+    def _mean_chunk(self, values, window, nodata, start, stop):
+        """
+        Compute the weighted means of a range of catchments.
+        """
+        pixel_values, valid, weights, catchments = self._get_pixel_values(
+            values, window, nodata, start, stop)
+        weights = np.where(valid, weights, 0)
+        sums = np.bincount(catchments, weights * np.where(valid, pixel_values, 0),
+                           minlength=stop - start)
+        totals = np.bincount(catchments, weights, minlength=stop - start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / totals
+
+    def _fractions_chunk(self, values, window, lut, nodata, classes_nb, start, stop):
+        """
+        Compute the class fractions of a range of catchments.
+        """
+        pixel_values, valid, weights, catchments = self._get_pixel_values(
+            values, window, nodata, start, stop)
+        codes = pixel_values.astype(np.intp)
+        in_table = valid & (codes >= 0) & (codes < len(lut))
+        classes = np.full(len(codes), -1, dtype=np.intp)
+        classes[in_table] = lut[codes[in_table]]
+
+        classified = classes >= 0
+        counts = np.bincount(catchments[classified] * classes_nb + classes[classified],
+                             weights[classified],
+                             minlength=(stop - start) * classes_nb)
+        totals = np.bincount(catchments, np.where(valid, weights, 0),
+                             minlength=stop - start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return counts.reshape(stop - start, classes_nb) / totals[:, np.newaxis]
+
+    def _get_pixel_values(self, values, window, nodata, start, stop):
+        """
+        Gather the values of the pixels of a range of catchments from the values of
+        a window, with their validity, weights and catchment (relative to start).
+        """
+        pixels = self.pixels[self.indptr[start]:self.indptr[stop]]
+        rows, cols = np.divmod(pixels, self.shape[1])
+        pixel_values = np.asarray(values)[rows - window[0], cols - window[2]]
+
+        valid = np.ones(len(pixel_values), dtype=bool)
+        if np.issubdtype(pixel_values.dtype, np.floating):
+            valid &= ~np.isnan(pixel_values)
+        if nodata is not None:
+            valid &= pixel_values != nodata
+
+        weights = self.weights[self.indptr[start]:self.indptr[stop]].astype(float)
+        catchments = np.repeat(np.arange(stop - start),
+                               np.diff(self.indptr[start:stop + 1]))
+
+        return pixel_values, valid, weights, catchments
+
+
+class _ZonalReader:
+    """
+    Reader of the windows of a raster co-registered with a ZonalWeights grid, either
+    directly or through a RasterBlockCache.
+    """
+
+    def __init__(self, raster_file, shape, cache=None):
+        self.raster_file = raster_file
+        self.cache = cache
+        self.src = cache.open(raster_file) if cache is not None else \
+            rasterio.open(raster_file)
+        if self.src.shape != shape:
+            self.close()
+            raise ValueError(f"The raster shape {self.src.shape} does not match the "
+                             f"grid shape {shape}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, window, band=1):
+        """
+        Read a window (row_start, row_stop, col_start, col_stop). Returns its values
+        and the nodata value of the raster.
+        """
+        if self.cache is not None:
+            return self.cache.read(self.raster_file, window, band), self.src.nodata
+        row_start, row_stop, col_start, col_stop = window
+        values = self.src.read(band, window=windows.Window.from_slices(
+            (row_start, row_stop), (col_start, col_stop)))
+
+        return values, self.src.nodata
+
+    def close(self):
+        # The datasets of the cache stay open
+        if self.cache is None:
+            self.src.close()
+
+
+def extract_properties(catchments, properties, workers_nb=None, chunk_size=8,
+                       cache_max_bytes=RASTER_CACHE_MAX_BYTES, cache_dir=None,
+                       fingerprint='mtime'):
+    """
+    Extract the soil and land cover properties of many catchments in parallel worker
+    processes. Every worker keeps its rasters open and its decoded blocks in its own
+    RasterBlockCache. The catchments are processed in chunks of consecutive rows, so
+    that neighbouring catchments (if sorted spatially) share the cached blocks.
+
+    Parameters
+    ----------
+    catchments: GeoDataFrame|GeoSeries|list
+        The polygons of the catchments, in the coordinate system of the rasters.
+    properties: dict
+        The properties to extract, as a mapping of the output names to tuples
+        (kind, raster_file) or, for the land covers, (kind, raster_file, dataset).
+        The kinds are 'soil_content' (see get_soil_content()), 'soil_depth' (see
+        get_soil_depth()) and 'land_cover' (see get_land_covers()), the latter giving
+        one column per land cover type named '{name}_{type}'. Example:
+        {'clay_0_5': ('soil_content', clay_file),
+         'cover_wc': ('land_cover', wc_file, 'worldcover')}
+    workers_nb: int
+        The number of worker processes. Default: the number of processors. With 1,
+        the catchments are processed in the current process.
+    chunk_size: int
+        The number of catchments sent at once to a worker. Default: 8
+    cache_max_bytes: int
+        The maximum size of the raster block cache of every worker [bytes].
+        Default: RASTER_CACHE_MAX_BYTES
+    cache_dir: str|Path
+        The directory of the persistent cache of the extracted properties. Every
+        entry is addressed by a hash of the geometry (WKB), of the raster identity
+        and of the statistic (kind and dataset), so that only the properties of new
+        or modified catchments, rasters or statistics are extracted. Default: None
+        (no cache)
+    fingerprint: str
+        The identity of the rasters in the cache: 'mtime' (path, size and
+        modification time) or 'hash' (path, size and SHA-256 of the content, read
+        once per call), of the raster file and of all its source files (e.g. the
+        tiles of a VRT). Default: 'mtime'
+
+    Returns
+    -------
+    A dataframe of the properties, with a row per catchment in the input order (and
+    the index of the catchments if they are a GeoDataFrame or a GeoSeries).
+    """
+    for name, spec in properties.items():
+        if spec[0] not in EXTRACTION_KINDS:
+            raise ValueError(f"The kind of {name} must be one of {EXTRACTION_KINDS}.")
+        if spec[0] == 'land_cover' and len(spec) != 3:
+            raise ValueError(f"The land cover dataset of {name} is missing.")
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be at least 1.")
+
+    index = None
+    if isinstance(catchments, (pd.DataFrame, pd.Series)):
+        index = catchments.index
+    if hasattr(catchments, 'geometry'):
+        catchments = catchments.geometry
+    geometries = list(catchments)
+
+    # Properties of every catchment, as {name: {column suffix: value}}
+    results = [{} for _ in geometries]
+    tasks = [(geometry, properties) for geometry in geometries]
+    if cache_dir is not None:
+        cache_files = _get_properties_cache_files(cache_dir, geometries, properties,
+                                                  fingerprint)
+        tasks = []
+        for result, geometry, files in zip(results, geometries, cache_files):
+            for name, cache_file in files.items():
+                values = _load_properties(cache_file)
+                if values is not None:
+                    result[name] = values
+            missing = {name: spec for name, spec in properties.items()
+                       if name not in result}
+            tasks.append((geometry, missing))
+
+    todo = [i for i, (_, missing) in enumerate(tasks) if missing]
+    chunks = [[tasks[i] for i in todo[j:j + chunk_size]]
+              for j in range(0, len(todo), chunk_size)]
+
+    if not todo:
+        extracted = []
+    elif workers_nb == 1:
+        with RasterBlockCache(cache_max_bytes) as cache:
+            extracted = [_extract_catchment_properties(geometry, missing, cache)
+                         for geometry, missing in tasks if missing]
+    else:
+        with ProcessPoolExecutor(max_workers=workers_nb,
+                                 initializer=_init_extraction_worker,
+                                 initargs=(cache_max_bytes,)) as executor:
+            extracted = [result for chunk in executor.map(_extract_in_worker, chunks)
+                         for result in chunk]
+
+    for i, result in zip(todo, extracted):
+        results[i].update(result)
+        if cache_dir is not None:
+            for name, values in result.items():
+                _save_properties(cache_files[i][name], values)
+
+    rows = []
+    for result in results:
+        row = {}
+        for name in properties:
+            for suffix, value in result[name].items():
+                row[f'{name}_{suffix}' if suffix else name] = value
+        rows.append(row)
+
+    return pd.DataFrame(rows, index=index)
+
+
+# Raster block cache of the worker processes of extract_properties()
+_worker_raster_cache = None
+
+
+def _init_extraction_worker(cache_max_bytes):
+    """
+    Initialize a worker process with its own raster block cache.
+    """
+    global _worker_raster_cache
+    _worker_raster_cache = RasterBlockCache(cache_max_bytes)
+
+
+def _extract_in_worker(tasks):
+    """
+    Extract the properties of a chunk of catchments in a worker process.
+    """
+    return [_extract_catchment_properties(geometry, properties, _worker_raster_cache)
+            for geometry, properties in tasks]
+
+
+def _extract_catchment_properties(geometry, properties, cache):
+    """
+    Extract the properties of a catchment (see extract_properties()), as
+    {name: {column suffix: value}}.
+    """
+    result = {}
+    for name, (kind, raster_file, *options) in properties.items():
+        if kind == 'soil_content':
+            result[name] = {'': get_soil_content(raster_file, geometry, cache)}
+        elif kind == 'soil_depth':
+            result[name] = {'': get_soil_depth(raster_file, geometry, cache)}
+        else:
+            result[name] = get_land_covers(options[0], raster_file, geometry, cache)
+
+    return result
+
+
+def _get_properties_cache_files(cache_dir, geometries, properties, fingerprint):
+    """
+    Get the cache files of the properties of the catchments, as a list (one item per
+    catchment) of {name: cache file}.
+    """
+    statistics = {}
+    for name, (kind, raster_file, *options) in properties.items():
+        statistic = hashlib.sha256(repr(
+            (kind, _get_raster_fingerprint(raster_file, fingerprint)) +
+            tuple(options)).encode())
+        if kind == 'land_cover':
+            # The schema can be registered again under the same name
+            statistic.update(get_land_cover_lut(options[0]).tobytes())
+        statistics[name] = statistic.digest()
+
+    cache_files = []
+    for geometry in geometries:
+        wkb = geometry.wkb
+        files = {}
+        for name, statistic in statistics.items():
+            key = hashlib.sha256(wkb + b'\0' + statistic).hexdigest()
+            files[name] = Path(cache_dir) / key[:2] / f'properties_{key[:32]}.npz'
+        cache_files.append(files)
+
+    return cache_files
+
+
+def _get_raster_fingerprint(raster_file, fingerprint):
+    """
+    Get the fingerprint of a raster: the paths and fingerprints of all its files,
+    including the source files of a VRT.
+    """
+    with rasterio.open(raster_file) as src:
+        files = sorted({str(Path(file).resolve()) for file in src.files})
+
+    return tuple((file, _get_file_fingerprint(file, fingerprint)) for file in files)
+
+
+def _load_properties(cache_file):
+    """
+    Load the cached values of a property, as {column suffix: value}. Returns None if
+    there are none.
+    """
+    if not cache_file.exists():
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            return dict(zip(cached['suffixes'].tolist(), cached['values'].tolist()))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_properties(cache_file, values):
+    """
+    Save the values of a property in the cache (see _save_annual_maxima()).
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=cache_file.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, suffixes=np.array(list(values), dtype=str),
+                     values=np.array(list(values.values()), dtype=float))
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def read_annual_maxima(file, value_column, year_column='YYYY', sep=';', nodata=None,
+                       chunk_size=READ_CHUNK_SIZE, cache_dir=None, fingerprint='mtime'):
+    """
+    Read the annual maxima of a time series file (e.g. the LamaH discharge or
+    precipitation). The file is streamed in chunks and only the year and value
+    columns are read, so that the whole series is never held in memory.
+
+    Parameters
+    ----------
+    file: str|Path
+        Path to the CSV file.
+    value_column: str
+        The column holding the values (e.g. 'qobs' or 'prec').
+    year_column: str
+        The column holding the year. Default: 'YYYY'
+    sep: str
+        The column separator. Default: ';'
+    nodata: float
+        The value of the missing data (e.g. -999), ignored. Default: None
+    chunk_size: int
+        The number of rows read at once. Default: READ_CHUNK_SIZE
+    cache_dir: str|Path
+        Directory in which the annual maxima are cached (one npz file per source file
+        and columns). The cached values are used as long as the source file is
+        unchanged, and recomputed otherwise. Default: None (no cache)
+    fingerprint: str
+        How to detect changes of the source file: 'mtime' (path, size and
+        modification time) or 'hash' (content hash, slower). Default: 'mtime'
+
+    Returns
+    -------
+    A Pandas series of the annual maxima, indexed by year.
+    """
+    if cache_dir is not None:
+        cache_file, file_fingerprint = _get_annual_maxima_cache_file(
+            cache_dir, file, fingerprint, value_column, year_column, sep, nodata)
+        annual_max = _load_annual_maxima(cache_file, file_fingerprint, value_column,
+                                         year_column)
+        if annual_max is not None:
+            return annual_max
+        annual_max = read_annual_maxima(file, value_column, year_column, sep, nodata,
+                                        chunk_size)
+        _save_annual_maxima(cache_file, file_fingerprint, annual_max)
+        return annual_max
+
+    na_values = None if nodata is None else [nodata]
+    reader = pd.read_csv(file, sep=sep, usecols=[year_column, value_column],
+                         na_values=na_values, chunksize=chunk_size)
+
+    annual_max = pd.Series(dtype=float, name=value_column,
+                           index=pd.Index([], dtype=int, name=year_column))
+    with reader:
+        for chunk in reader:
+            chunk_max = chunk.groupby(year_column)[value_column].max()
+            if len(annual_max) > 0:
+                # A year can span several chunks
+                chunk_max = pd.concat([annual_max, chunk_max]).groupby(level=0).max()
+            annual_max = chunk_max
+
+    return annual_max
+
+
+def read_annual_maxima_batch(files, value_column, year_column='YYYY', sep=';',
+                             nodata=None, chunk_size=READ_CHUNK_SIZE, stations=None,
+                             workers_nb=None, cache_dir=None, fingerprint='mtime'):
+    """
+    Read the annual maxima of many time series files (see read_annual_maxima()) in
+    parallel worker processes.
+
+    Parameters
+    ----------
+    files: list
+        The paths to the CSV files.
+    value_column: str
+        The column holding the values (e.g. 'qobs' or 'prec').
+    year_column: str
+        The column holding the year. Default: 'YYYY'
+    sep: str
+        The column separator. Default: ';'
+    nodata: float
+        The value of the missing data (e.g. -999), ignored. Default: None
+    chunk_size: int
+        The number of rows read at once. Default: READ_CHUNK_SIZE
+    stations: list
+        The station identifiers of the files. Default: the file names (without
+        extension)
+    workers_nb: int
+        The number of worker processes. Default: the number of processors. With 1,
+        the files are read in the current process.
+    cache_dir: str|Path
+        Directory in which the annual maxima are cached (one npz file per source file
+        and columns). The cached values are used as long as the source file is
+        unchanged, and recomputed otherwise. Default: None (no cache)
+    fingerprint: str
+        How to detect changes of the source file: 'mtime' (path, size and
+        modification time) or 'hash' (content hash, slower). Default: 'mtime'
+
+    Returns
+    -------
+    A long-format dataframe with the fields 'station', 'year' and 'value', in the
+    order of the files (see get_value_return_periods_batch()).
+    """
+    files = list(files)
+    if stations is None:
+        stations = [Path(file).stem for file in files]
+    if len(stations) != len(files):
+        raise ValueError("The number of stations must match the number of files.")
+
+    read = functools.partial(read_annual_maxima, value_column=value_column,
+                             year_column=year_column, sep=sep, nodata=nodata,
+                             chunk_size=chunk_size, cache_dir=cache_dir,
+                             fingerprint=fingerprint)
+    if workers_nb == 1:
+        annual_maxima = list(map(read, files))
+    else:
+        with ProcessPoolExecutor(max_workers=workers_nb) as executor:
+            annual_maxima = list(executor.map(read, files))
+
+    tables = [pd.DataFrame({'station': station, 'year': annual_max.index.to_numpy(),
+                            'value': annual_max.to_numpy()})
+              for station, annual_max in zip(stations, annual_maxima)]
+    if not tables:
+        return pd.DataFrame(columns=['station', 'year', 'value'])
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def _get_annual_maxima_cache_file(cache_dir, file, fingerprint, *options):
+    """
+    Get the cache file of the annual maxima of a source file, and the fingerprint of
+    the source file.
+    """
+    file = Path(file).resolve()
+    file_fingerprint = _get_file_fingerprint(file, fingerprint)
+    key = hashlib.sha256(repr((str(file),) + options).encode()).hexdigest()
+
+    return Path(cache_dir) / f'annual_max_{key[:32]}.npz', file_fingerprint
+
+
+def _get_file_fingerprint(file, fingerprint):
+    """
+    Get the fingerprint of a file: its size and modification time ('mtime') or its
+    size and SHA-256 ('hash').
+    """
+    stat = Path(file).stat()
+    if fingerprint == 'mtime':
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    if fingerprint == 'hash':
+        digest = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(block)
+        return f'{stat.st_size}:{digest.hexdigest()}'
+    raise ValueError("The fingerprint must be 'mtime' or 'hash'.")
+
+
+def _load_annual_maxima(cache_file, file_fingerprint, value_column, year_column):
+    """
+    Load cached annual maxima. Returns None if there are none or if they are stale.
+    """
+    if not cache_file.exists():
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if str(cached['fingerprint']) != file_fingerprint:
+                return None
+            years, values = cached['years'], cached['values']
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return pd.Series(values, index=pd.Index(years, name=year_column),
+                     name=value_column)
+
+
+def _save_annual_maxima(cache_file, file_fingerprint, annual_max):
+    """
+    Save annual maxima in the cache. The file is written atomically so that parallel
+    readers never see a partial file.
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=cache_file.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, fingerprint=np.array(file_fingerprint),
+                     years=annual_max.index.to_numpy(),
+                     values=annual_max.to_numpy(dtype=float))
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
 def get_value_return_periods(annual_max, ret_periods=None):
     """
     Get the discharge/precip values for the provided return periods.
@@ -237,14 +1608,88 @@ def get_value_return_periods(annual_max, ret_periods=None):
 
     Returns
     -------
-    A list of the values for the given return periods. Default: [10, 30, 50]
+    A list of the values for the given return periods. Default: RETURN_PERIODS
+    """
+    return _get_gumbel_quantiles(annual_max.mean(), annual_max.std(), ret_periods)
+
+
+def get_value_return_periods_batch(annual_max, ret_periods=None, mask=None,
+                                   station_column='station', value_column='value'):
+    """
+    Get the discharge/precip values for the provided return periods for many
+    stations at once. A Gumbel distribution is fitted to the annual maxima of every
+    station by the method of moments, as in get_value_return_periods(), in a single
+    vectorized pass. Missing values are ignored.
+
+    Parameters
+    ----------
+    annual_max: Pandas dataframe|np.ndarray
+        The annual maxima, either as a long-format dataframe with one row per station
+        and year, or as a 2-D array of shape (stations, years) in which the missing
+        values are NaN or masked (numpy masked array or mask argument).
+    ret_periods: list
+        List of the desired return periods. Default: RETURN_PERIODS
+    mask: np.ndarray
+        Boolean array with the shape of the 2-D annual maxima, True for the missing
+        values. Not used with a dataframe.
+    station_column: str
+        The column holding the station identifiers in a dataframe. Default: 'station'
+    value_column: str
+        The column holding the annual maxima in a dataframe. Default: 'value'
+
+    Returns
+    -------
+    The values for the given return periods, as an array of shape (stations, R) for
+    a 2-D array, or as a dataframe indexed by station with the columns ret_periods
+    for a dataframe. The values are NaN for the stations with less than two maxima.
+    """
+    if isinstance(annual_max, pd.DataFrame):
+        stations, codes = np.unique(annual_max[station_column].to_numpy(),
+                                    return_inverse=True)
+        values = annual_max[value_column].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        codes, values = codes[valid], values[valid]
+
+        counts = np.bincount(codes, minlength=len(stations))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(codes, values, len(stations)) / counts
+            deviations = (values - mean[codes]) ** 2
+            std = np.sqrt(np.bincount(codes, deviations, len(stations)) / (counts - 1))
+        quantiles = _get_gumbel_quantiles(mean[:, np.newaxis], std[:, np.newaxis],
+                                          ret_periods)
+
+        if ret_periods is None:
+            ret_periods = RETURN_PERIODS
+
+        return pd.DataFrame(quantiles, index=pd.Index(stations, name=station_column),
+                            columns=ret_periods)
+
+    values = np.ma.getdata(annual_max).astype(float)
+    if values.ndim != 2:
+        raise ValueError("The annual maxima must be a 2-D array (stations, years).")
+    missing = np.isnan(values) | np.ma.getmaskarray(annual_max)
+    if mask is not None:
+        missing |= np.asarray(mask, dtype=bool)
+    values = np.where(missing, 0, values)
+
+    counts = np.count_nonzero(~missing, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=1) / counts
+        deviations = np.where(missing, 0, values - mean[:, np.newaxis]) ** 2
+        std = np.sqrt(deviations.sum(axis=1) / (counts - 1))
+
+    return _get_gumbel_quantiles(mean[:, np.newaxis], std[:, np.newaxis], ret_periods)
+
+
+def _get_gumbel_quantiles(mean, std, ret_periods=None):
+    """
+    Get the quantiles of the Gumbel distributions of the given mean and standard
+    deviation for the provided return periods (broadcast along the last axis).
     """
     if ret_periods is None:
-        ret_periods = [10, 30, 100]
-    y_means = annual_max.mean()
-    y_std = annual_max.std()
-    b = np.sqrt(6.0) / math.pi * y_std
-    a = y_means - b * np.euler_gamma
+        ret_periods = RETURN_PERIODS
+    b = np.sqrt(6.0) / math.pi * std
+    a = mean - b * np.euler_gamma
 
     # Get precip values for different return periods
     F_rps = np.ones(len(ret_periods)) - (np.ones(len(ret_periods)) / ret_periods)
@@ -276,13 +1721,7 @@ def classify_soil_type_augur(df):
     - superficial (low clay) -> C
     - high clay content -> D
     """
-    df['soil_type'] = ''
-    df.loc[(df['soil_depth'] >= 0.4), 'soil_type'] = 'A'
-    df.loc[(df['soil_depth'] < 0.4) &
-           (df['sand_fra'] >= 0.5), 'soil_type'] = 'B'
-    df.loc[(df['soil_depth'] < 0.4) &
-           (df['sand_fra'] < 0.5), 'soil_type'] = 'C'
-    df.loc[(df['clay_fra'] >= 0.4), 'soil_type'] = 'D'
+    df['soil_type'] = soil_type_codes_to_labels(classify_soil_type_codes_augur(df))
 
     return df
 
@@ -315,13 +1754,8 @@ def classify_soil_type_augur_params(df, thr_soil_depth, thr_sand_frac,
     - superficial (low clay) (< thr_soil_depth & < thr_sand_frac) -> C
     - high clay content (>= thr_clay_frac) -> D
     """
-    df['soil_type'] = ''
-    df.loc[(df['soil_depth'] >= thr_soil_depth), 'soil_type'] = 'A'
-    df.loc[(df['soil_depth'] < thr_soil_depth) &
-           (df['sand_fra'] >= thr_sand_frac), 'soil_type'] = 'B'
-    df.loc[(df['soil_depth'] < thr_soil_depth) &
-           (df['sand_fra'] < thr_sand_frac), 'soil_type'] = 'C'
-    df.loc[(df['clay_fra'] >= thr_clay_frac), 'soil_type'] = 'D'
+    df['soil_type'] = soil_type_codes_to_labels(classify_soil_type_codes_augur(
+        df, thr_soil_depth, thr_sand_frac, thr_clay_frac))
 
     return df
 
@@ -340,18 +1774,120 @@ def classify_soil_type_usa(df):
     -------
     Dataframe containing the soil type.
     """
-    df['soil_type'] = ''
-    df.loc[(df['soil_depth'] >= 0.5) &
-           (df['clay_fra'] < 0.1), 'soil_type'] = 'A'
-    df.loc[(df['soil_depth'] >= 0.5) &
-           (df['clay_fra'] >= 0.1) &
-           (df['clay_fra'] < 0.2), 'soil_type'] = 'B'
-    df.loc[(df['soil_depth'] >= 0.5) &
-           (df['sand_fra'] < 0.5) &
-           (df['clay_fra'] >= 0.2) &
-           (df['clay_fra'] < 0.4), 'soil_type'] = 'C'
-    df.loc[(df['clay_fra'] >= 0.4) &
-           (df['sand_fra'] < 0.5), 'soil_type'] = 'D'
-    df.loc[(df['soil_depth'] < 0.5), 'soil_type'] = 'D'
+    df['soil_type'] = soil_type_codes_to_labels(classify_soil_type_codes_usa(df))
 
     return df
+
+
+def classify_soil_type_codes_augur(df, thr_soil_depth=0.4, thr_sand_frac=0.5,
+                                   thr_clay_frac=0.4):
+    """
+    Classify the soil type based on the soil depth, sand and clay (AUGUR approach)
+    into integer codes (0 to 3 for A to D, -1 when unclassified). The dataframe is
+    neither copied nor modified.
+
+    Parameters
+    ----------
+    df: Pandas dataframe
+        Dataframe (or dict of arrays) containing the soil depth, sand and clay
+        fractions.
+    thr_soil_depth: float|np.array
+        Threshold for the soil depth (class A vs B and C). Default: 0.4
+    thr_sand_frac: float|np.array
+        Threshold for the sand fraction (class B vs C). Default: 0.5
+    thr_clay_frac: float|np.array
+        Threshold for the clay fraction (class D). Default: 0.4
+
+    Returns
+    -------
+    The soil type codes (np.int8). The thresholds can be arrays broadcasting against
+    the catchments, e.g. of shape (K, 1) to classify for K threshold sets at once
+    (result of shape (K, N)).
+    """
+    depth = np.asarray(df['soil_depth'], dtype=float)
+    sand = np.asarray(df['sand_fra'], dtype=float)
+    clay = np.asarray(df['clay_fra'], dtype=float)
+
+    is_shallow = depth < thr_soil_depth
+
+    # The first matching condition wins (D overrides the other classes)
+    return np.select([clay >= thr_clay_frac,
+                      is_shallow & (sand < thr_sand_frac),
+                      is_shallow & (sand >= thr_sand_frac),
+                      depth >= thr_soil_depth],
+                     [3, 2, 1, 0], default=-1).astype(np.int8)
+
+
+def classify_soil_type_codes_usa(df):
+    """
+    Classify the soil type based on the soil depth, sand and clay (USA approach)
+    into integer codes (0 to 3 for A to D, -1 when unclassified). The dataframe is
+    neither copied nor modified.
+
+    Parameters
+    ----------
+    df: Pandas dataframe
+        Dataframe (or dict of arrays) containing the soil depth, sand and clay
+        fractions.
+
+    Returns
+    -------
+    The soil type codes (np.int8).
+    """
+    depth = np.asarray(df['soil_depth'], dtype=float)
+    sand = np.asarray(df['sand_fra'], dtype=float)
+    clay = np.asarray(df['clay_fra'], dtype=float)
+
+    # The first matching condition wins (shallow soils are always D)
+    return np.select([depth < 0.5,
+                      (clay >= 0.4) & (sand < 0.5),
+                      (depth >= 0.5) & (sand < 0.5) & (clay >= 0.2) & (clay < 0.4),
+                      (depth >= 0.5) & (clay >= 0.1) & (clay < 0.2),
+                      (depth >= 0.5) & (clay < 0.1)],
+                     [3, 3, 2, 1, 0], default=-1).astype(np.int8)
+
+
+def soil_type_codes_to_labels(codes):
+    """
+    Convert soil type codes (0 to 3, -1 when unclassified) into labels ('A' to 'D',
+    '' when unclassified).
+
+    Parameters
+    ----------
+    codes: np.array
+        The soil type codes.
+
+    Returns
+    -------
+    The soil type labels.
+    """
+    return np.array(SOIL_TYPES + [''], dtype=object)[np.asarray(codes)]
+
+
+def soil_type_labels_to_codes(labels):
+    """
+    Convert soil type labels ('A' to 'D') into codes (0 to 3). Integer inputs are
+    considered as codes already and only checked.
+
+    Parameters
+    ----------
+    labels: array-like
+        The soil type labels (or codes).
+
+    Returns
+    -------
+    The soil type codes (np.int8).
+    """
+    labels = np.asarray(labels)
+    if np.issubdtype(labels.dtype, np.integer):
+        invalid = (labels < 0) | (labels >= len(SOIL_TYPES))
+        if np.any(invalid):
+            raise ValueError(f"Unknown soil type codes: {np.unique(labels[invalid])}.")
+        return labels.astype(np.int8)
+
+    labels = labels.astype(str)
+    unknown = ~np.isin(labels, SOIL_TYPES)
+    if np.any(unknown):
+        raise ValueError(f"Unknown soil types: {np.unique(labels[unknown])}.")
+
+    return np.searchsorted(SOIL_TYPES, labels).astype(np.int8)
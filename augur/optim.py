@@ -1,36 +1,78 @@
+import csv
+import warnings
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import spotpy
 import numpy as np
+import pandas as pd
 
 import augur.core as agc
 import augur.data as agd
 
+# Maximum number of design matrices (one per soil classification) kept in memory
+DESIGN_MATRICES_MAX_NB = 32
+
+# Default memory budget of the batched simulations [bytes]
+BATCH_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# Default maximum number of breakpoints per threshold of search_soil_thresholds()
+SOIL_BREAKPOINTS_MAX_NB = 20
+
+# Number of soil classifications above which a full sweep is warned about
+SOIL_CLASSIFICATIONS_WARNING_NB = 100000
+
+# Columns of the data needed by the simulations (besides the catchment cache)
+SOIL_COLUMNS = ['soil_depth', 'sand_fra', 'clay_fra']
+
+# Bounds of the curve numbers
+CN_BOUNDS = (0, 100)
+
+# Bounds of the soil classification thresholds
+SOIL_THRESHOLDS_BOUNDS = {
+    'thr_soil_depth': (0, 10),
+    'thr_sand_frac': (0, 1),
+    'thr_clay_frac': (0, 1),
+}
+
 
 class SpotpySetup(object):
-    def __init__(self, data, optimize_soil_type=False, reverse_score=False):
+    def __init__(self, data, optimize_soil_type=False, reverse_score=False,
+                 cache=None, ret_periods=None):
         """
         Initialize the spotpy setup.
 
         Parameters
         ----------
         data: pd.DataFrame
-            The data to be used for the calibration.
+            The data to be used for the calibration. It is not modified.
         optimize_soil_type: bool
             Whether to optimize the soil type classification (A, B, C, D).
         reverse_score: bool
             Whether to reverse the score (e.g. for minimization).
+        cache: CatchmentCache
+            The precomputed catchment quantities of the data (see
+            augur.core.precompute_catchments()). Computed if not provided.
+        ret_periods: list
+            The return periods [years] to calibrate on. The data must contain the
+            precipitation 'p{return period}' and the discharge 'q{return period}'
+            for each of them. Default: [10, 30, 100]
         """
-        self.data = data
+        self.data = data.reset_index(drop=True)
         self.land_use_nb = 5
         self.optimize_soil_type = optimize_soil_type
         self.reverse_score = reverse_score
+        self.ret_periods = ret_periods
+        self.precipitation_columns = agd.get_return_period_columns('p', ret_periods)
+        self.evaluation_columns = agd.get_return_period_columns('q', ret_periods)
 
         # Define the parameters to be optimized
         self.params = []
         if self.optimize_soil_type:
             self.params = [
-                spotpy.parameter.Uniform('thr_soil_depth', 0, 10),
-                spotpy.parameter.Uniform('thr_sand_frac', 0, 1),
-                spotpy.parameter.Uniform('thr_clay_frac', 0, 1),
+                spotpy.parameter.Uniform(name, low, high)
+                for name, (low, high) in SOIL_THRESHOLDS_BOUNDS.items()
             ]
 
         parameters_cn = []
@@ -38,61 +80,314 @@ class SpotpySetup(object):
             for i_land in range(0, self.land_use_nb):
                 param_name = f'{soil}{i_land + 1}'
                 parameters_cn.append(
-                    spotpy.parameter.Uniform(param_name, 0, 100, as_int=True)
+                    spotpy.parameter.Uniform(param_name, *CN_BOUNDS, as_int=True)
                 )
 
         self.params.extend(parameters_cn)
 
+        # Precompute the quantities that do not depend on the parameters
+        self.cache = cache
+        if self.cache is None:
+            catchments = agc.CatchmentBatch.from_dataframe(
+                self.data, agc.CATCHMENT_COLUMNS + self.precipitation_columns, None)
+            self.cache = agc.precompute_catchments(catchments, catchments,
+                                                   ret_periods=ret_periods)
+        self.soil_types = None
+        if not self.optimize_soil_type:
+            self.soil_types = self._classify_soil_types()
+        self.design_matrices = {}
+        self.classification_scores = {}
+
+        # Process pool of the parallel mode (see simulate_parallel())
+        self._executor = None
+        self._executor_workers_nb = None
+        self._shared_memory = None
+        self._finalizer = None
+
+    def __getstate__(self):
+        # The process pool and the shared memory stay with the main process
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_executor_workers_nb'] = None
+        state['_shared_memory'] = None
+        state['_finalizer'] = None
+
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def parameters(self):
         return spotpy.parameter.generate(self.params)
 
     def simulation(self, x):
         # Unpack the parameters
-        cns_array = np.zeros((self.land_use_nb, 4))
+        cns_vector = np.zeros(4 * self.land_use_nb)
         for i_soil, soil in enumerate(['A', 'B', 'C', 'D']):
             for i_land in range(0, self.land_use_nb):
                 param_name = f'{soil}{i_land + 1}'
-                cns_array[i_land, i_soil] = round(x[param_name])
-
-        cns = agc.create_cn_parameters_from_array(cns_array)
+                cns_vector[i_soil * self.land_use_nb + i_land] = round(x[param_name])
 
         # Classify the soil types
+        soil_types = self.soil_types
         if self.optimize_soil_type:
-            thr_soil_depth = x['thr_soil_depth']
-            thr_sand_frac = x['thr_sand_frac']
-            thr_clay_frac = x['thr_clay_frac']
-            df = agd.classify_soil_type_augur_params(self.data, thr_soil_depth,
-                                                     thr_sand_frac, thr_clay_frac)
-        else:
-            df = agd.classify_soil_type_augur(self.data)
+            soil_types = self._classify_soil_types(x['thr_soil_depth'],
+                                                   x['thr_sand_frac'],
+                                                   x['thr_clay_frac'])
 
-        if len(df[df.soil_type == '']) > 0:
-            raise ValueError(f'{len(df[df.soil_type == ""])} '
-                             'soil types were not classified.')
+        # Compute the peak discharge for each catchment
+        design_matrix = self._get_design_matrix(soil_types)
+        sim = simulate_peak_discharge(design_matrix, cns_vector, len(self.data))
 
-        df.reset_index(inplace=True, drop=True)
+        return sim
 
-        # Compute the peak discharge for each catchment
-        sim = np.zeros((len(df), 3))
+    def calibrate_least_squares(self, bounds=(0, 100)):
+        """
+        Calibrate the curve numbers directly with a bounded integer least-squares
+        fit (see calibrate_cn_least_squares()). The soil types are not optimized.
 
-        for i, catch in df.iterrows():
-            time, hydrograph = agc.compute_hydrograph(catch, catch['soil_type'],
-                                                      catch, cns)
-            peak_q = hydrograph.max(axis=0)
-            sim[i, 0] = peak_q[0]
-            sim[i, 1] = peak_q[1]
-            sim[i, 2] = peak_q[2]
+        Parameters
+        ----------
+        bounds: tuple
+            The lower and upper bounds of the curve numbers.
 
-        return sim
+        Returns
+        -------
+        The curve number dataframe and the RMSE for each return period.
+        """
+        soil_types = self.soil_types
+        if soil_types is None:
+            soil_types = self._classify_soil_types()
+        design_matrix = self._get_design_matrix(soil_types)
 
-    def evaluation(self):
-        # Transform the data into a numpy array
-        data = np.zeros((len(self.data), 3))
-        data[:, 0] = self.data['q10']
-        data[:, 1] = self.data['q30']
-        data[:, 2] = self.data['q100']
+        return calibrate_cn_least_squares(design_matrix, self.evaluation(), bounds)
+
+    def search_soil_thresholds(self, max_breakpoints=SOIL_BREAKPOINTS_MAX_NB,
+                               bounds=(0, 100)):
+        """
+        Search the soil classification thresholds by enumerating the distinct soil
+        classifications (see enumerate_soil_classifications()) instead of sampling
+        the thresholds. Each classification is scored by the mean RMSE of a bounded
+        least-squares fit of the curve numbers. The scores are kept, so that
+        subsequent searches (e.g. with more breakpoints) only fit the new
+        classifications. The curve numbers of the best classification are finally
+        calibrated with calibrate_cn_least_squares().
+
+        Parameters
+        ----------
+        max_breakpoints: int
+            The maximum number of breakpoints per threshold (see
+            enumerate_soil_classifications()). None sweeps all the observed values,
+            which requires up to n**3 fits for n catchments.
+            Default: SOIL_BREAKPOINTS_MAX_NB
+        bounds: tuple
+            The lower and upper bounds of the curve numbers.
+
+        Returns
+        -------
+        A dataframe with the thresholds and scores of the classifications, sorted by
+        increasing score, the curve number dataframe of the best classification and
+        its RMSE for each return period.
+        """
+        if max_breakpoints is None:
+            combinations_nb = np.prod([self.data[column].nunique() + 1
+                                       for column in SOIL_COLUMNS], dtype=float)
+            if combinations_nb > SOIL_CLASSIFICATIONS_WARNING_NB:
+                warnings.warn(f"The full sweep of the soil thresholds can require up "
+                              f"to {combinations_nb:.0f} least-squares fits. Consider "
+                              f"setting max_breakpoints.")
+
+        evaluation = self.evaluation()
+        results = []
+        best_soil_types = None
+        best_score = np.inf
+        for thresholds, soil_types in enumerate_soil_classifications(
+                self.data, max_breakpoints):
+            key = soil_types.tobytes()
+            if key not in self.classification_scores:
+                design_matrix = build_design_matrix(self.cache, soil_types)
+                x = _solve_bounded_least_squares(design_matrix, evaluation, bounds)
+                self.classification_scores[key] = _compute_mean_rmse(
+                    design_matrix @ x, evaluation)
+            score = self.classification_scores[key]
+            if score < best_score:
+                best_soil_types = soil_types
+                best_score = score
+            results.append(dict(thresholds, score=score))
+
+        if not results:
+            raise ValueError('No valid soil classification was found.')
 
-        return data
+        results = pd.DataFrame(results).sort_values('score', ignore_index=True)
+        design_matrix = build_design_matrix(self.cache, best_soil_types)
+        cns, rmse = calibrate_cn_least_squares(design_matrix, evaluation, bounds)
+
+        return results, cns, rmse
+
+    def _get_design_matrix(self, soil_types):
+        key = soil_types.tobytes()
+        if key not in self.design_matrices:
+            if len(self.design_matrices) >= DESIGN_MATRICES_MAX_NB:
+                del self.design_matrices[next(iter(self.design_matrices))]
+            self.design_matrices[key] = build_design_matrix(self.cache, soil_types)
+
+        return self.design_matrices[key]
+
+    def simulate_batch(self, parameter_sets, memory_budget=BATCH_MEMORY_BUDGET):
+        """
+        Evaluate a population of parameter sets in a vectorized way. The parameter
+        sets sharing the same soil classification are evaluated together with one
+        matrix product on the design matrix of the classification. The population is
+        processed in chunks to keep the temporary arrays within the memory budget.
+
+        Parameters
+        ----------
+        parameter_sets: np.array
+            The parameter sets as an array of shape (K, n_params) following the order
+            of the parameters.
+        memory_budget: int
+            The approximate memory budget [bytes] of the temporary arrays.
+
+        Returns
+        -------
+        The simulated peak discharge of shape (K, N, R).
+        """
+        parameter_sets = np.atleast_2d(np.asarray(parameter_sets, dtype=float))
+        if parameter_sets.shape[1] != len(self.params):
+            raise ValueError(f'The parameter sets should have {len(self.params)} '
+                             f'columns. Here: {parameter_sets.shape[1]}.')
+
+        catchments_nb = len(self.data)
+        ret_periods_nb = self.cache.precipitation.shape[1]
+        sims = np.empty((len(parameter_sets), catchments_nb, ret_periods_nb))
+
+        # Output, soil classification and comparison arrays per parameter set
+        row_bytes = catchments_nb * (ret_periods_nb * 8 + 16)
+        chunk_size = max(1, memory_budget // row_bytes)
+
+        thresholds_nb = len(SOIL_THRESHOLDS_BOUNDS) if self.optimize_soil_type else 0
+        for start in range(0, len(parameter_sets), chunk_size):
+            chunk = parameter_sets[start:start + chunk_size]
+            cns_vectors = np.round(chunk[:, thresholds_nb:])
+
+            if not self.optimize_soil_type:
+                design_matrix = self._get_design_matrix(self.soil_types)
+                sims[start:start + len(chunk)] = simulate_peak_discharge(
+                    design_matrix, cns_vectors, catchments_nb)
+                continue
+
+            soil_types = agd.classify_soil_type_codes_augur(
+                self.data, *[chunk[:, [i]] for i in range(thresholds_nb)])
+            unclassified = np.count_nonzero(soil_types < 0, axis=1)
+            if np.any(unclassified):
+                raise ValueError(f'{unclassified.max()} '
+                                 'soil types were not classified.')
+
+            classifications, inverse = np.unique(soil_types, axis=0,
+                                                 return_inverse=True)
+            for i_classif, classification in enumerate(classifications):
+                rows = np.flatnonzero(inverse.ravel() == i_classif)
+                design_matrix = self._get_design_matrix(classification)
+                sims[start + rows] = simulate_peak_discharge(
+                    design_matrix, cns_vectors[rows], catchments_nb)
+
+        return sims
+
+    def simulate_parallel(self, parameter_sets, workers_nb=None, chunk_size=1):
+        """
+        Evaluate several parameter sets in a pool of processes. The catchment arrays
+        are placed once in shared memory, from which the workers read them. The
+        results are returned in the order of the parameter sets. The pool is kept for
+        subsequent calls until close() is called, the setup is garbage collected or
+        the interpreter exits. It is released immediately if the evaluation fails.
+
+        Parameters
+        ----------
+        parameter_sets: list|np.array
+            The parameter sets, either as a list of mappings (parameter name to
+            value) or as an array of shape (K, n_params) following the order of the
+            parameters.
+        workers_nb: int
+            The number of worker processes. Default: the number of processors.
+        chunk_size: int
+            The number of parameter sets sent to a worker at once.
+
+        Returns
+        -------
+        The simulated peak discharge of shape (K, N, R).
+        """
+        if isinstance(parameter_sets, np.ndarray):
+            names = [param.name for param in self.params]
+            parameter_sets = [dict(zip(names, row)) for row in parameter_sets]
+
+        chunks = [parameter_sets[i:i + chunk_size]
+                  for i in range(0, len(parameter_sets), chunk_size)]
+        try:
+            executor = self._get_executor(workers_nb)
+            sims = [sim for chunk in executor.map(_simulate_in_worker, chunks)
+                    for sim in chunk]
+        except BaseException:
+            self.close()
+            raise
+
+        return np.array(sims).reshape(len(parameter_sets), len(self.data), -1)
+
+    def close(self):
+        """
+        Shut down the process pool of the parallel mode and release the shared
+        memory.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+        self._executor = None
+        self._executor_workers_nb = None
+        self._shared_memory = None
+        self._finalizer = None
+
+    def _get_executor(self, workers_nb):
+        if self._executor is not None and self._executor_workers_nb == workers_nb:
+            return self._executor
+        self.close()
+
+        arrays = {f'cache.{field}': array
+                  for field, array in zip(self.cache._fields, self.cache)}
+        for column in SOIL_COLUMNS + self.evaluation_columns:
+            if column in self.data.columns:
+                arrays[f'data.{column}'] = self.data[column].to_numpy(dtype=float)
+        self._shared_memory, layout = _share_arrays(arrays)
+        pool = {'executor': None}
+        self._finalizer = weakref.finalize(self, _release_pool, pool,
+                                           self._shared_memory)
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers_nb, initializer=_init_worker,
+            initargs=(self._shared_memory.name, layout, self.optimize_soil_type,
+                      self.reverse_score, self.ret_periods))
+        pool['executor'] = self._executor
+        self._executor_workers_nb = workers_nb
+
+        return self._executor
+
+    def _classify_soil_types(self, thr_soil_depth=None, thr_sand_frac=None,
+                             thr_clay_frac=None):
+        if thr_soil_depth is not None:
+            soil_types = agd.classify_soil_type_codes_augur(
+                self.data, thr_soil_depth, thr_sand_frac, thr_clay_frac)
+        else:
+            soil_types = agd.classify_soil_type_codes_augur(self.data)
+
+        if np.any(soil_types < 0):
+            raise ValueError(f'{np.count_nonzero(soil_types < 0)} '
+                             'soil types were not classified.')
+
+        return soil_types
+
+    def evaluation(self):
+        # Transform the data into a numpy array, shape (N, R)
+        return self.data[self.evaluation_columns].to_numpy(dtype=float)
 
     def objectivefunction(self, simulation, evaluation):
         # Compute the RMSE
@@ -102,3 +397,498 @@ class SpotpySetup(object):
             return -np.mean(rmse)
 
         return np.mean(rmse)
+
+
+def optimize_differential_evolution(setup, population_size=None, max_generations=1000,
+                                    mutation=0.7, crossover=0.9, seed=None,
+                                    patience=100, tolerance=1e-8, dbname=None):
+    """
+    Calibrate the parameters of a SpotpySetup with a differential evolution
+    (DE/rand/1/bin) evaluating whole generations with SpotpySetup.simulate_batch().
+    The curve numbers are kept integer and the soil thresholds continuous. The mean
+    RMSE of the return periods is minimized.
+
+    Parameters
+    ----------
+    setup: SpotpySetup
+        The calibration setup.
+    population_size: int
+        The number of individuals. Default: 10 times the number of parameters.
+    max_generations: int
+        The maximum number of generations.
+    mutation: float
+        The differential weight F.
+    crossover: float
+        The crossover probability CR.
+    seed: int
+        The seed of the random number generator, for reproducibility.
+    patience: int
+        Stop when the best score did not improve by more than the tolerance during
+        this number of generations.
+    tolerance: float
+        The minimum improvement of the best score.
+    dbname: str
+        If provided, all evaluated parameter sets are written to the file
+        '{dbname}.csv' in the format of the spotpy csv database (columns 'like1',
+        'par{name}', 'simulation{i}_{j}' and 'chain', the latter holding the
+        generation), so that it can be read by spotpy.analyser.load_csv_results().
+
+    Returns
+    -------
+    The best parameter set (as a Pandas series indexed by the parameter names) and
+    its score.
+    """
+    rng = np.random.default_rng(seed)
+    names = [param.name for param in setup.params]
+    params_nb = len(names)
+    if population_size is None:
+        population_size = 10 * params_nb
+    if population_size < 4:
+        raise ValueError("The population size must be at least 4.")
+
+    bounds = np.array([SOIL_THRESHOLDS_BOUNDS.get(name, CN_BOUNDS) for name in names],
+                      dtype=float)
+    is_int = np.array([name not in SOIL_THRESHOLDS_BOUNDS for name in names])
+    evaluation = setup.evaluation()
+
+    def evaluate(population):
+        sims = setup.simulate_batch(population)
+        rmse = np.sqrt(np.mean((sims - evaluation) ** 2, axis=1))
+        return rmse.mean(axis=1), sims
+
+    def constrain(population):
+        population[:, is_int] = np.round(population[:, is_int])
+        return np.clip(population, bounds[:, 0], bounds[:, 1])
+
+    db_file = None
+    writer = None
+    if dbname is not None:
+        db_file = open(f'{dbname}.csv', 'w', newline='')
+        writer = csv.writer(db_file)
+        writer.writerow(['like1'] + [f'par{name}' for name in names] +
+                        [f'simulation{i + 1}_{j + 1}'
+                         for i in range(evaluation.shape[0])
+                         for j in range(evaluation.shape[1])] + ['chain'])
+
+    def save(scores, population, sims, generation):
+        if writer is None:
+            return
+        likes = -scores if setup.reverse_score else scores
+        for like, individual, sim in zip(likes, population, sims):
+            writer.writerow([like] + list(individual) + list(sim.ravel()) +
+                            [generation])
+
+    try:
+        population = constrain(
+            rng.uniform(bounds[:, 0], bounds[:, 1], (population_size, params_nb)))
+        scores, sims = evaluate(population)
+        save(scores, population, sims, 0)
+
+        best_score = scores.min()
+        stagnation = 0
+        for generation in range(1, max_generations + 1):
+            # Three distinct random individuals, different from the target one
+            draws = rng.random((population_size, population_size))
+            np.fill_diagonal(draws, np.inf)
+            r1, r2, r3 = np.argsort(draws, axis=1)[:, :3].T
+
+            mutants = population[r1] + mutation * (population[r2] - population[r3])
+            crossed = rng.random((population_size, params_nb)) < crossover
+            crossed[np.arange(population_size),
+                    rng.integers(0, params_nb, population_size)] = True
+            trials = constrain(np.where(crossed, mutants, population))
+
+            trial_scores, sims = evaluate(trials)
+            save(trial_scores, trials, sims, generation)
+
+            improved = trial_scores <= scores
+            population[improved] = trials[improved]
+            scores[improved] = trial_scores[improved]
+
+            if best_score - scores.min() > tolerance:
+                best_score = scores.min()
+                stagnation = 0
+            else:
+                stagnation += 1
+                if stagnation >= patience:
+                    break
+    finally:
+        if db_file is not None:
+            db_file.close()
+
+    i_best = np.argmin(scores)
+
+    return pd.Series(population[i_best], index=names), scores[i_best]
+
+
+# State of the worker processes of SpotpySetup.simulate_parallel()
+_worker_setup = None
+_worker_shared_memory = None
+
+
+def _init_worker(shared_memory_name, layout, optimize_soil_type, reverse_score,
+                 ret_periods):
+    """
+    Initialize a worker process from the arrays in shared memory.
+    """
+    global _worker_setup, _worker_shared_memory
+    _worker_shared_memory, arrays = _attach_arrays(shared_memory_name, layout)
+    cache = agc.CatchmentCache(**{field: arrays[f'cache.{field}']
+                                  for field in agc.CatchmentCache._fields})
+    data = pd.DataFrame({key[len('data.'):]: array for key, array in arrays.items()
+                         if key.startswith('data.')}, copy=False)
+    _worker_setup = SpotpySetup(data, optimize_soil_type, reverse_score, cache=cache,
+                                ret_periods=ret_periods)
+
+
+def _simulate_in_worker(parameter_sets):
+    """
+    Evaluate a chunk of parameter sets in a worker process.
+    """
+    return [_worker_setup.simulation(x) for x in parameter_sets]
+
+
+def _release_pool(pool, block):
+    """
+    Shut down the process pool of SpotpySetup.simulate_parallel() and release its
+    shared memory block.
+    """
+    try:
+        if pool['executor'] is not None:
+            pool['executor'].shutdown()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _share_arrays(arrays):
+    """
+    Copy arrays into a single shared memory block. Returns the block and the layout
+    (name, dtype, shape and offset of each array) needed to attach to it.
+    """
+    layout = []
+    offset = 0
+    for key, array in arrays.items():
+        offset = -(-offset // 8) * 8  # 8-byte alignment
+        layout.append((key, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (key, dtype, shape, offset), array in zip(layout, arrays.values()):
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        view[...] = array
+
+    return block, layout
+
+
+def _attach_arrays(name, layout):
+    """
+    Attach to a shared memory block created by _share_arrays() and return read-only
+    views of its arrays.
+    """
+    block = shared_memory.SharedMemory(name=name)
+
+    arrays = {}
+    for key, dtype, shape, offset in layout:
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[key] = array
+
+    return block, arrays
+
+
+def get_cn_vector(cns):
+    """
+    Flatten a curve number dataframe into a vector ordered as the parameters of
+    SpotpySetup (A1 .. A5, B1 .. B5, C1 .. C5, D1 .. D5).
+
+    Parameters
+    ----------
+    cns: Pandas dataframe
+        The curve number parameters.
+
+    Returns
+    -------
+    The curve numbers as a vector of length 20.
+    """
+    return cns.loc[agc.LAND_COVERS, agc.SOIL_TYPES].to_numpy(dtype=float).T.ravel()
+
+
+def build_design_matrix(cache, soil_types):
+    """
+    Build the design matrix of the peak discharge with respect to the curve numbers.
+    The model is linear in the curve numbers: the curve number factor is a land cover
+    weighted sum of the curve numbers, the production is proportional to it and the
+    hydrograph is proportional to the production. The peak discharge of the N
+    catchments and R return periods is thus the product of this matrix by the vector
+    of curve numbers (see get_cn_vector()).
+
+    Parameters
+    ----------
+    cache: CatchmentCache
+        The precomputed catchment quantities (see augur.core.precompute_catchments()).
+    soil_types: array-like
+        The soil type category of each catchment. Options: 'A', 'B', 'C', 'D', or
+        their integer codes (see augur.data.classify_soil_type_codes_augur())
+
+    Returns
+    -------
+    The design matrix of shape (N * R, 20), the rows being ordered by catchment and
+    then by return period.
+    """
+    codes = agd.soil_type_labels_to_codes(soil_types)
+    if np.any(cache.precipitation < 0):
+        raise ValueError("The precipitation cannot be negative in the linear model.")
+
+    land_use_nb = len(agc.LAND_COVERS)
+    catchments_nb, ret_periods_nb = cache.precipitation.shape
+    rows = np.arange(catchments_nb)
+
+    # Peak discharge of a unit curve number factor, shape (N, R)
+    peak_unit_cn = 0.9 * 0.7 * \
+        (cache.response[rows, cache.response_i_max] * cache.area_rain / 100 /
+         100)[:, np.newaxis] * cache.precipitation
+
+    # Contribution of each land cover, placed in the block of the soil type
+    weights = np.zeros((catchments_nb, len(agc.SOIL_TYPES), land_use_nb))
+    weights[rows, codes, :] = cache.land_cover / 100
+    weights = weights.reshape(catchments_nb, 1, -1)
+
+    design_matrix = peak_unit_cn[:, :, np.newaxis] * weights
+
+    return design_matrix.reshape(catchments_nb * ret_periods_nb, -1)
+
+
+def simulate_peak_discharge(design_matrix, cns_vectors, catchments_nb):
+    """
+    Compute the peak discharge from the design matrix for one or several curve number
+    vectors.
+
+    Parameters
+    ----------
+    design_matrix: np.array
+        The design matrix of shape (N * R, 20) (see build_design_matrix()).
+    cns_vectors: np.array
+        A curve number vector of length 20 or a population of K vectors of shape
+        (K, 20).
+    catchments_nb: int
+        The number of catchments N.
+
+    Returns
+    -------
+    The peak discharge [m3/s] of shape (N, R), or (K, N, R) for a population.
+    """
+    cns_vectors = np.asarray(cns_vectors, dtype=float)
+    if cns_vectors.ndim == 1:
+        return (design_matrix @ cns_vectors).reshape(catchments_nb, -1)
+
+    sim = cns_vectors @ design_matrix.T
+
+    return sim.reshape(len(cns_vectors), catchments_nb, -1)
+
+
+def enumerate_soil_classifications(data, max_breakpoints=None):
+    """
+    Enumerate the distinct soil classifications that can be obtained with
+    augur.data.classify_soil_type_augur_params(). A classification only changes when a
+    threshold crosses an observed value of the soil depth, sand or clay fraction, so
+    that the candidate thresholds are the sorted unique observed values (within
+    SOIL_THRESHOLDS_BOUNDS), plus the upper bound.
+    Identical classifications are only yielded once and classifications leaving some
+    catchments unclassified are skipped.
+
+    Parameters
+    ----------
+    data: Pandas dataframe
+        Dataframe containing the soil depth, sand and clay fractions.
+    max_breakpoints: int
+        The maximum number of breakpoints per threshold. When there are more distinct
+        values, they are subsampled evenly in rank. Default: all values.
+
+    Yields
+    ------
+    A dict of the thresholds and the corresponding array of soil type codes.
+    """
+    depth = np.asarray(data['soil_depth'], dtype=float)
+    sand = np.asarray(data['sand_fra'], dtype=float)
+    clay = np.asarray(data['clay_fra'], dtype=float)
+    soil_data = {'soil_depth': depth, 'sand_fra': sand, 'clay_fra': clay}
+
+    seen = set()
+    for thr_clay_frac in _get_breakpoints(
+            clay, SOIL_THRESHOLDS_BOUNDS['thr_clay_frac'], max_breakpoints):
+        is_d = clay >= thr_clay_frac
+        for thr_soil_depth in _get_breakpoints(
+                depth[~is_d], SOIL_THRESHOLDS_BOUNDS['thr_soil_depth'],
+                max_breakpoints):
+            is_shallow = ~is_d & (depth < thr_soil_depth)
+            for thr_sand_frac in _get_breakpoints(
+                    sand[is_shallow], SOIL_THRESHOLDS_BOUNDS['thr_sand_frac'],
+                    max_breakpoints):
+                soil_types = agd.classify_soil_type_codes_augur(
+                    soil_data, thr_soil_depth, thr_sand_frac, thr_clay_frac)
+
+                if np.any(soil_types < 0):
+                    continue
+                key = soil_types.tobytes()
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                yield {'thr_soil_depth': thr_soil_depth,
+                       'thr_sand_frac': thr_sand_frac,
+                       'thr_clay_frac': thr_clay_frac}, soil_types
+
+
+def _get_breakpoints(values, bounds, max_breakpoints=None):
+    """
+    Get the candidate thresholds leading to distinct partitions of the values.
+    """
+    lower, upper = bounds
+    values = values[np.isfinite(values)]
+    breakpoints = np.unique(values[(values >= lower) & (values <= upper)])
+    if max_breakpoints is not None and len(breakpoints) > max_breakpoints:
+        ranks = np.linspace(0, len(breakpoints) - 1, max_breakpoints)
+        breakpoints = breakpoints[np.unique(np.round(ranks).astype(int))]
+    breakpoints = [float(v) for v in breakpoints]
+    if float(upper) not in breakpoints:
+        breakpoints.append(float(upper))
+
+    return breakpoints
+
+
+def calibrate_cn_least_squares(design_matrix, observations, bounds=(0, 100),
+                               max_iterations=1000, tolerance=1e-9):
+    """
+    Calibrate the curve numbers directly, taking advantage of the linearity of the
+    peak discharge in the curve numbers. A bounded least-squares problem is first
+    solved with an active-set method. The solution is then rounded to integers
+    and refined by a local search minimizing the mean of the RMSE of the return
+    periods (the objective of SpotpySetup).
+
+    Parameters
+    ----------
+    design_matrix: np.array
+        The design matrix of shape (N * R, 20) (see build_design_matrix()).
+    observations: np.array
+        The observed peak discharge of shape (N, R).
+    bounds: tuple
+        The lower and upper bounds of the curve numbers.
+    max_iterations: int
+        The maximum number of iterations of the active-set method.
+    tolerance: float
+        The convergence tolerance of the active-set method (relative gradient
+        violation at the bounds).
+
+    Returns
+    -------
+    The curve number dataframe (see augur.core.create_cn_parameters_from_array()) and
+    the RMSE for each return period.
+    """
+    observations = np.asarray(observations, dtype=float)
+    catchments_nb = observations.shape[0]
+    lower, upper = bounds
+    if lower > upper:
+        raise ValueError("The lower bound cannot be larger than the upper bound.")
+
+    x = _solve_bounded_least_squares(design_matrix, observations, bounds,
+                                     max_iterations, tolerance)
+    x = _refine_integer_solution(design_matrix, observations, x, bounds)
+
+    sim = (design_matrix @ x).reshape(catchments_nb, -1)
+    rmse = np.sqrt(np.mean((sim - observations) ** 2, axis=0))
+    cns = agc.create_cn_parameters_from_array(x.reshape(len(agc.SOIL_TYPES), -1).T)
+
+    return cns, rmse
+
+
+def _solve_bounded_least_squares(design_matrix, observations, bounds,
+                                 max_iterations=1000, tolerance=1e-9):
+    """
+    Solve the bounded least-squares problem with an active-set method on the normal
+    equations (the free variables are solved exactly, the others are kept at their
+    bounds and released when the gradient points inside the bounds).
+    """
+    lower, upper = bounds
+    gram = design_matrix.T @ design_matrix
+    rhs = design_matrix.T @ observations.ravel()
+    threshold = tolerance * max(1, np.abs(rhs).max())
+
+    # Parameters with no influence (e.g. soil type not present) are left untouched
+    used = np.diag(gram) > 0
+
+    x = np.linalg.lstsq(design_matrix, observations.ravel(), rcond=None)[0]
+    x = np.clip(x, lower, upper)
+    free = used & (x > lower) & (x < upper)
+    for _ in range(max_iterations):
+        # Solve the unbounded problem on the free variables
+        z = x.copy()
+        if np.any(free):
+            z[free] = np.linalg.lstsq(
+                gram[np.ix_(free, free)],
+                rhs[free] - gram[np.ix_(free, ~free)] @ x[~free], rcond=None)[0]
+
+        if np.all((z[free] >= lower) & (z[free] <= upper)):
+            x = z
+            # Release the bounded variable with the largest gradient violation
+            gradient = gram @ x - rhs
+            violation = np.where(x <= lower, -gradient, gradient)
+            violation[free | ~used] = 0
+            i_max = np.argmax(violation)
+            if violation[i_max] <= threshold:
+                break
+            free[i_max] = True
+        else:
+            # Move towards the solution until the first bound is reached
+            step = z - x
+            with np.errstate(divide='ignore', invalid='ignore'):
+                alpha = np.where(step < 0, (lower - x) / step,
+                                 np.where(step > 0, (upper - x) / step, np.inf))
+            alpha = min(1, alpha[free].min())
+            x = np.clip(x + alpha * step, lower, upper)
+            reached = free & ((x - lower <= threshold) | (upper - x <= threshold))
+            x[reached] = np.where(x[reached] - lower < upper - x[reached], lower, upper)
+            free[reached] = False
+
+    return x
+
+
+def _refine_integer_solution(design_matrix, observations, x, bounds):
+    """
+    Round the solution to integers and refine it by a local search (moves of
+    decreasing size on each parameter) minimizing the mean RMSE.
+    """
+    lower, upper = bounds
+    x = np.clip(np.round(x), np.ceil(lower), np.floor(upper))
+    score = _compute_mean_rmse(design_matrix @ x, observations)
+    steps = [16, 8, 4, 2, 1]
+    i_step = 0
+    while i_step < len(steps):
+        deltas = np.concatenate([np.eye(len(x)), -np.eye(len(x))]) * steps[i_step]
+        candidates = x + deltas
+        valid = np.all((candidates >= lower) & (candidates <= upper), axis=1)
+        candidates = candidates[valid]
+        if len(candidates) == 0:
+            break
+        scores = _compute_mean_rmse((candidates @ design_matrix.T).T, observations)
+        i_best = np.argmin(scores)
+        if scores[i_best] < score:
+            x = candidates[i_best]
+            score = scores[i_best]
+        else:
+            i_step += 1
+
+    return x
+
+
+def _compute_mean_rmse(simulations, observations):
+    """
+    Compute the mean of the RMSE of the return periods for flattened simulations of
+    shape (N * R,) or (N * R, K).
+    """
+    catchments_nb, ret_periods_nb = observations.shape
+    sim = simulations.reshape(catchments_nb, ret_periods_nb, -1)
+    rmse = np.sqrt(np.mean((sim - observations[:, :, np.newaxis]) ** 2, axis=0))
+    scores = rmse.mean(axis=0)
+
+    return scores if simulations.ndim > 1 else scores[0]
@@ -2,13 +2,24 @@ import pandas as pd
 import spotpy
 import matplotlib.pyplot as plt
 
-METHODS = ['sceua', 'mc', 'mcmc']
+METHODS = ['sceua', 'mc', 'mcmc', 'de']
+
+
+def get_parameter_columns(dbname):
+    # The likelihood and parameter columns, whether the soil types were optimized
+    # or not
+    with open(f'{dbname}.csv') as f:
+        header = f.readline().strip().split(',')
+    return [i for i, column in enumerate(header) if column.startswith(('like', 'par'))]
+
 
 for method in METHODS:
     print(f'Extracting {method}')
 
     # Load the results
-    results = spotpy.analyser.load_csv_results(f'AUGUR_Lamah_{method}', usecols=range(24))
+    dbname = f'AUGUR_Lamah_{method}'
+    results = spotpy.analyser.load_csv_results(
+        dbname, usecols=get_parameter_columns(dbname))
 
     # Get the best parameter set
     spotpy.analyser.get_best_parameterset(results, maximize=False)
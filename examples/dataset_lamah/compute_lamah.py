@@ -48,32 +48,26 @@ df = agd.classify_soil_type_augur(df)
 df = df[df.soil_type != '']
 df.reset_index(inplace=True, drop=True)
 
-rel_diffs = np.zeros((len(df), 3))
-diffs = np.zeros((len(df), 3))
+# Get the peak discharge of all catchments at once
+peaks_q = agc.compute_peak_discharge(df, df['soil_type'], df, cns)
+obs_q = df[['q10', 'q30', 'q100']].to_numpy()
 
-for i, catchment in df.iterrows():
-    time, hydrograph = agc.compute_hydrograph(catchment, catchment['soil_type'],
-                                              catchment, cns)
+rel_diffs = 100 * (peaks_q - obs_q) / obs_q
+diffs = peaks_q - obs_q
+
+if PLOT_HYDROGRAPHS:
+    time, hydrographs = agc.compute_hydrograph_batch(df, df['soil_type'], df, cns)
 
+for i, catchment in df.iterrows():
     # Plot the hydrograph
     if PLOT_HYDROGRAPHS:
-        plt.plot(time, hydrograph)
+        plt.plot(time, hydrographs[i])
         plt.xlabel('Time [h]')
         plt.ylabel('Discharge [m$^3$/s]')
         plt.tight_layout()
         plt.show()
 
-    # Get the peak discharge
-    peak_q = hydrograph.max(axis=0)
-
-    rel_diffs[i, 0] = 100 * (peak_q[0] - catchment.loc['q10']) / catchment.loc['q10']
-    rel_diffs[i, 1] = 100 * (peak_q[1] - catchment.loc['q30']) / catchment.loc['q30']
-    rel_diffs[i, 2] = 100 * (peak_q[2] - catchment.loc['q100']) / catchment.loc['q100']
-    diffs[i, 0] = peak_q[0] - catchment.loc['q10']
-    diffs[i, 1] = peak_q[1] - catchment.loc['q30']
-    diffs[i, 2] = peak_q[2] - catchment.loc['q100']
-
-    print(f'Peak discharge for {catchment["name"]}: {peak_q}')
+    print(f'Peak discharge for {catchment["name"]}: {peaks_q[i]}')
 
 
 # Total RMSE
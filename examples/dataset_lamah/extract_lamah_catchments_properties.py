@@ -21,79 +21,66 @@ PATH_ATTRIBUTES = PATH_LAMAH / 'A_basins_total_upstrm' / '1_attributes'
 PATH_GAUGE_ATTRIBUTES = PATH_LAMAH / 'D_gauges' / '1_attributes'
 PATH_WCOVER = Path(config['PATH_WCOVER'])
 OUTPUT_DIR = Path(config['OUTPUT_DIR']) / 'LamaH catchments'
-
-catchments_shp_files = Path(PATH_CATCHMENTS) / 'Basins_A_wgs84.shp'
-shp_catchments = gpd.read_file(catchments_shp_files)
-
-cover_file = PATH_WCOVER / '_Lamah.vrt'
-
-attributes_file = PATH_ATTRIBUTES / 'Catchment_attributes.csv'
-stream_dist_file = PATH_ATTRIBUTES / 'Stream_dist.csv'
-gauge_attributes_file = PATH_GAUGE_ATTRIBUTES / 'Gauge_attributes.csv'
-
-df_attributes = pd.read_csv(attributes_file, sep=';')
-df_gauge_attributes = pd.read_csv(gauge_attributes_file, sep=';')
-df_stream_dist = pd.read_csv(stream_dist_file, sep=';')
-df = pd.merge(df_attributes, df_gauge_attributes, on='ID')
-df = pd.merge(df, df_stream_dist, on='ID')
-
-# Only keep relevant attributes
-df = df[['ID', 'area_calc', 'elev_mean', 'slope_mean', 'bedrk_dep', 'sand_fra',
-         'silt_fra', 'clay_fra', 'grav_fra', 'oc_fra', 'name', 'river',
-         'lon', 'lat', 'country', 'gaps_post', 'dist_hup', 'degimpact']]
-
-# Only keep catchments between 1 and 300 km2
-df = df[df.area_calc > 1]
-df = df[df.area_calc < 300]
-
-# Only keep catchments with no influence (u) or low influence (l)
-df = df[df.degimpact.isin(['u', 'l'])]
-
-df.reset_index(inplace=True, drop=True)
-
-# Convert units
-df['slope_mean'] = df['slope_mean'] / 1000
-
-# Extract catchment properties.
-for row in df.iterrows():
-    catchment = row[1]
-    print(catchment['name'])
-
-    # Compute rainfall return periods
-    precip_file = PATH_TS_PRECIP / f'ID_{catchment.ID}.csv'
-    precip = pd.read_csv(precip_file, sep=';', usecols=[0, 22])
-    annual_max_p = precip.groupby(['YYYY']).max()
-    p_rps = agd.get_value_return_periods(annual_max_p['prec'], ret_periods=[10, 30, 100])
-    df.at[row[0], 'p10'] = p_rps[0]
-    df.at[row[0], 'p30'] = p_rps[1]
-    df.at[row[0], 'p100'] = p_rps[2]
-
-    # Compute discharge return periods
-    discharge_file = PATH_TS_DISCHARGE / f'ID_{catchment.ID}.csv'
-    discharge = pd.read_csv(discharge_file, sep=';', usecols=[0, 5])
-    annual_max_p = discharge.groupby(['YYYY']).max()
-    q_rps = agd.get_value_return_periods(annual_max_p['qobs'], ret_periods=[10, 30, 100])
-    df.at[row[0], 'q10'] = q_rps[0]
-    df.at[row[0], 'q30'] = q_rps[1]
-    df.at[row[0], 'q100'] = q_rps[2]
-
-    # Compute land cover
-    shp = shp_catchments.loc[shp_catchments['ID'] == catchment.ID]
-    df.at[row[0], 'cover_forest'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'forest'),
-    df.at[row[0], 'cover_farmland'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'farmland'),
-    df.at[row[0], 'cover_pasture'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'pasture'),
-    df.at[row[0], 'cover_settlement'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'settlement'),
-    df.at[row[0], 'cover_bare'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'bare'),
-    df.at[row[0], 'cover_cryo'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'cryo'),
-    df.at[row[0], 'cover_water'] = agd.get_land_cover(
-        'worldcover', cover_file, shp, 'water'),
-
-
-df.to_csv(OUTPUT_DIR / 'Lamah_stats.csv')
-print('Done.')
+CACHE_DIR = Path(config['OUTPUT_DIR']) / 'cache'
+
+def main():
+    catchments_shp_files = Path(PATH_CATCHMENTS) / 'Basins_A_wgs84.shp'
+    shp_catchments = gpd.read_file(catchments_shp_files)
+
+    cover_file = PATH_WCOVER / '_Lamah.vrt'
+
+    attributes_file = PATH_ATTRIBUTES / 'Catchment_attributes.csv'
+    stream_dist_file = PATH_ATTRIBUTES / 'Stream_dist.csv'
+    gauge_attributes_file = PATH_GAUGE_ATTRIBUTES / 'Gauge_attributes.csv'
+
+    df_attributes = pd.read_csv(attributes_file, sep=';')
+    df_gauge_attributes = pd.read_csv(gauge_attributes_file, sep=';')
+    df_stream_dist = pd.read_csv(stream_dist_file, sep=';')
+    df = pd.merge(df_attributes, df_gauge_attributes, on='ID')
+    df = pd.merge(df, df_stream_dist, on='ID')
+
+    # Only keep relevant attributes
+    df = df[['ID', 'area_calc', 'elev_mean', 'slope_mean', 'bedrk_dep', 'sand_fra',
+             'silt_fra', 'clay_fra', 'grav_fra', 'oc_fra', 'name', 'river',
+             'lon', 'lat', 'country', 'gaps_post', 'dist_hup', 'degimpact']]
+
+    # Only keep catchments between 1 and 300 km2
+    df = df[df.area_calc > 1]
+    df = df[df.area_calc < 300]
+
+    # Only keep catchments with no influence (u) or low influence (l)
+    df = df[df.degimpact.isin(['u', 'l'])]
+
+    df.reset_index(inplace=True, drop=True)
+
+    # Convert units
+    df['slope_mean'] = df['slope_mean'] / 1000
+
+    # Compute the rainfall and discharge return periods of all catchments at once
+    annual_max_p = agd.read_annual_maxima_batch(
+        [PATH_TS_PRECIP / f'ID_{catchment_id}.csv' for catchment_id in df['ID']],
+        'prec', stations=df['ID'], cache_dir=CACHE_DIR)
+    annual_max_q = agd.read_annual_maxima_batch(
+        [PATH_TS_DISCHARGE / f'ID_{catchment_id}.csv' for catchment_id in df['ID']],
+        'qobs', stations=df['ID'], cache_dir=CACHE_DIR)
+    p_rps = agd.get_value_return_periods_batch(annual_max_p, ret_periods=[10, 30, 100])
+    q_rps = agd.get_value_return_periods_batch(annual_max_q, ret_periods=[10, 30, 100])
+    for ret_period in [10, 30, 100]:
+        df[f'p{ret_period}'] = df['ID'].map(p_rps[ret_period])
+        df[f'q{ret_period}'] = df['ID'].map(q_rps[ret_period])
+
+    # Extract catchment properties in parallel worker processes, all the land cover
+    # types from a single read of the raster.
+    shp = shp_catchments.set_index('ID').loc[df['ID']]
+    covers = agd.extract_properties(
+        shp, {'cover': ('land_cover', cover_file, 'worldcover')}, cache_dir=CACHE_DIR)
+    for land_cover_type in ['forest', 'farmland', 'pasture', 'settlement', 'bare',
+                            'cryo', 'water']:
+        df[f'cover_{land_cover_type}'] = covers[f'cover_{land_cover_type}'].to_numpy()
+
+    df.to_csv(OUTPUT_DIR / 'Lamah_stats.csv')
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
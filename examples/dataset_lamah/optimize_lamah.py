@@ -5,7 +5,7 @@ import augur.optim as ago
 CATCHMENTS_FILE = r'D:\Projects\2022 AUGUR+\Analyses\LamaH catchments\Lamah_stats.csv'
 DO_PLOT = False
 OPTIMIZE_SOIL_TYPE = False
-METHOD = 'sceua'  # sceua, mc, mcmc, rope
+METHOD = 'sceua'  # sceua, mc, mcmc, rope, lsq, de
 EXPERIMENT_ID = 2
 N_SAMPLES = 5000
 
@@ -38,6 +38,20 @@ elif METHOD == 'rope':
                                      dbname=f'AUGUR_Lamah_rope_{EXPERIMENT_ID}')
     sampler.sample(N_SAMPLES)
 
+elif METHOD == 'lsq':
+    # Direct bounded least-squares calibration (soil types are not optimized)
+    cns, rmse = spot_setup.calibrate_least_squares()
+    print(cns)
+    print(f'RMSE: {rmse}')
+
+elif METHOD == 'de':
+    # Native differential evolution on batched simulations
+    best, score = ago.optimize_differential_evolution(
+        spot_setup, max_generations=N_SAMPLES, seed=EXPERIMENT_ID,
+        dbname=f'AUGUR_Lamah_de_{EXPERIMENT_ID}')
+    print(best)
+    print(f'Score: {score}')
+
 else:
     raise ValueError(f'Unknown method: {METHOD}')
 
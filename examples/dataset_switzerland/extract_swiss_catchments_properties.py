@@ -3,6 +3,7 @@ import yaml
 from pathlib import Path
 import geopandas as gpd
 import pandas as pd
+import rasterio
 
 import augur.data as agd
 
@@ -17,9 +18,10 @@ PATH_CCILC = Path(config['PATH_CCILC'])
 PATH_WCOVER = Path(config['PATH_WCOVER'])
 OUTPUT_DIR = Path(config['OUTPUT_DIR']) / 'Swiss catchments'
 
-# Create a generator for the catchments
+# Load all the catchments
 catchments_ch_files = glob.glob(str(PATH_CATCHMENTS) + '/*.shp', recursive=True)
-catchments_ch = (gpd.read_file(file) for file in catchments_ch_files)  # generator
+catchments_ch = pd.concat([gpd.read_file(file) for file in catchments_ch_files],
+                          ignore_index=True)
 
 # Paths to global dataset files
 clay_0_5_file = PATH_SOILGRIDS / 'clay_content_0-5.tif'
@@ -30,49 +32,48 @@ depth_file = PATH_SOILDEPTH / 'BDRICM_M_250m_ll.tif'
 cover_cci_file = PATH_CCILC / 'land_cover_classes.tif'
 cover_wc_file = PATH_WCOVER / '_Switzerland.vrt'
 
-df = pd.DataFrame()
-
-# Extract catchment properties.
-for catchment in catchments_ch:
-    s = pd.DataFrame.from_dict(
-        {'id': [catchment.values[0][0]],
-         'clay_0_5': [agd.get_soil_content(clay_0_5_file, catchment)],
-         'clay_5_15': [agd.get_soil_content(clay_5_15_file, catchment)],
-         'sand_0_5': [agd.get_soil_content(sand_0_5_file, catchment)],
-         'sand_5_15': [agd.get_soil_content(sand_5_15_file, catchment)],
-         'depth': [agd.get_soil_depth(depth_file, catchment)],
-         'cover_cci_forest': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'forest')],
-         'cover_cci_farmland': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'farmland')],
-         'cover_cci_pasture': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'pasture')],
-         'cover_cci_settlement': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'settlement')],
-         'cover_cci_bare': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'bare')],
-         'cover_cci_cryo': [agd.get_land_cover(
-             'cci', cover_cci_file, catchment, 'cryo')],
-         'cover_cci_water': [agd.get_land_cover(
-             'cci', cover_wc_file, catchment, 'water')],
-         'cover_wc_forest': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'forest')],
-         'cover_wc_farmland': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'farmland')],
-         'cover_wc_pasture': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'pasture')],
-         'cover_wc_settlement': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'settlement')],
-         'cover_wc_bare': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'bare')],
-         'cover_wc_cryo': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'cryo')],
-         'cover_wc_water': [agd.get_land_cover(
-             'worldcover', cover_wc_file, catchment, 'water')],
-         })
-
-    df = pd.concat([df, s], ignore_index=True)
+# Land cover types, in the order of the output columns
+COVER_TYPES = ['forest', 'farmland', 'pasture', 'settlement', 'bare', 'cryo', 'water']
 
+# Pixel weights of the catchments, built once per raster grid
+zonal_weights = {}
+
+
+def get_zonal_weights(raster_file):
+    with rasterio.open(raster_file) as src:
+        grid = (src.shape, tuple(src.transform))
+    if grid not in zonal_weights:
+        zonal_weights[grid] = agd.ZonalWeights.from_raster(catchments_ch, raster_file)
+    return zonal_weights[grid]
+
+
+def get_zonal_mean(raster_file):
+    weights = get_zonal_weights(raster_file)
+    return weights.zonal_mean(raster_file, nodata=-999)
+
+
+def get_zonal_covers(dataset, raster_file):
+    weights = get_zonal_weights(raster_file)
+    fractions = weights.zonal_fractions(raster_file, agd.get_land_cover_lut(dataset))
+    return {land_cover_type: 100 * fractions[:, i]
+            for i, land_cover_type in enumerate(agd.LAND_COVER_TYPES)}
+
+
+# Extract catchment properties, every raster being read once for all catchments.
+covers_cci = get_zonal_covers('cci', cover_cci_file)
+covers_wc = get_zonal_covers('worldcover', cover_wc_file)
+df = pd.DataFrame.from_dict(
+    {'id': catchments_ch.iloc[:, 0],
+     'clay_0_5': 100 * get_zonal_mean(clay_0_5_file) / 1000,
+     'clay_5_15': 100 * get_zonal_mean(clay_5_15_file) / 1000,
+     'sand_0_5': 100 * get_zonal_mean(sand_0_5_file) / 1000,
+     'sand_5_15': 100 * get_zonal_mean(sand_5_15_file) / 1000,
+     'depth': get_zonal_mean(depth_file),
+     **{f'cover_cci_{land_cover_type}': covers_cci[land_cover_type]
+        for land_cover_type in COVER_TYPES},
+     **{f'cover_wc_{land_cover_type}': covers_wc[land_cover_type]
+        for land_cover_type in COVER_TYPES},
+     })
 
 df.to_csv(OUTPUT_DIR / 'stats.csv')
 print('Done.')
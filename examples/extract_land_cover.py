@@ -17,33 +17,26 @@ PATH_CATCHMENTS_SHP = Path(config['PATH_CATCHMENTS'])
 PATH_WCOVER_FILES = Path(config['PATH_WCOVER_FILES'])
 OUTPUT_DIR = Path(config['OUTPUT_DIR'])
 
-shp_catchments = gpd.read_file(PATH_CATCHMENTS_SHP)
-
-df = pd.DataFrame()
-
-# Extract catchment properties.
-for i, catchment in shp_catchments.iterrows():
-    s = pd.DataFrame.from_dict(
-        {'id': [catchment['Id']],
-         'name': [catchment['catchment']],
-         'cover_wc_forest': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'forest')],
-         'cover_wc_farmland': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'farmland')],
-         'cover_wc_pasture': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'pasture')],
-         'cover_wc_settlement': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'settlement')],
-         'cover_wc_bare': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'bare')],
-         'cover_wc_cryo': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'cryo')],
-         'cover_wc_water': [agd.get_land_cover(
-             'worldcover', PATH_WCOVER_FILES, catchment.geometry, 'water')],
-         })
-
-    df = pd.concat([df, s], ignore_index=True)
-
-df.to_csv(OUTPUT_DIR / 'stats_catchments.csv')
-
-print('Done.')
+# Land cover types, in the order of the output columns
+COVER_TYPES = ['forest', 'farmland', 'pasture', 'settlement', 'bare', 'cryo', 'water']
+
+def main():
+    shp_catchments = gpd.read_file(PATH_CATCHMENTS_SHP)
+
+    # Extract catchment properties (in parallel worker processes). The properties
+    # extracted by previous runs are reused from the cache.
+    covers = agd.extract_properties(
+        shp_catchments, {'cover_wc': ('land_cover', PATH_WCOVER_FILES, 'worldcover')},
+        cache_dir=OUTPUT_DIR / 'cache')
+    df = pd.concat([shp_catchments[['Id', 'catchment']].rename(
+        columns={'Id': 'id', 'catchment': 'name'}),
+        covers[[f'cover_wc_{land_cover_type}' for land_cover_type in COVER_TYPES]]],
+        axis=1).reset_index(drop=True)
+
+    df.to_csv(OUTPUT_DIR / 'stats_catchments.csv')
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
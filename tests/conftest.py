@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def catchments():
+    # Four catchments with their properties, precipitation, observed discharge and
+    # soil properties, the soil types being the ones classified from the latter
+    return pd.DataFrame(
+        {'area': [100, 5, 250, 40], 'slope_gradient': [0.08, 0.3, 0.7, 0.3],
+         'length_watercourse': [5000, 1200, 14000, 8000],
+         'cover_farmland': [40, 10, 0, 20], 'cover_forest': [5, 60, 30, 50],
+         'cover_pasture': [50, 20, 40, 20], 'cover_settlement': [5, 5, 2, 10],
+         'cover_bare': [0, 3, 10, 0], 'cover_water': [0, 2, 3, 0],
+         'cover_cryo': [0, 0, 15, 0], 'p10': [140, 90, 110, 100],
+         'p30': [221, 120, 150, 130], 'p100': [287, 160, 190, 170],
+         'q10': [150, 10, 300, 60], 'q30': [230, 15, 400, 80],
+         'q100': [300, 20, 500, 110], 'soil_depth': [0.5, 0.2, 0.1, 0.3],
+         'sand_fra': [0.3, 0.6, 0.2, 0.4], 'clay_fra': [0.1, 0.1, 0.5, 0.2],
+         'soil_type': ['A', 'B', 'D', 'C']})
@@ -64,6 +64,18 @@ def test_get_rain_area_with_invalid_input():
         agc.get_rain_area(-1)
 
 
+def test_get_rain_area_with_arrays():
+    area = np.array([[100, 5], [250, 50]])
+    expected = [[agc.get_rain_area(v) for v in row] for row in area]
+    np.testing.assert_allclose(agc.get_rain_area(area), expected, rtol=1e-12)
+    x = np.array([-0.289, -0.3])
+    np.testing.assert_allclose(agc.get_rain_area(area[0], x=x),
+                               [agc.get_rain_area(100), agc.get_rain_area(5, x=-0.3)],
+                               rtol=1e-12)
+    with pytest.raises(ValueError, match=r"\[ 0. -1.\]"):
+        agc.get_rain_area(np.array([100, 0, -1]))
+
+
 def test_get_production():
     assert agc.get_production(38, 140, 61.9) == pytest.approx(23, abs=0.5)
     assert agc.get_production(38, 221, 61.9) == pytest.approx(36, abs=0.5)
@@ -89,6 +101,20 @@ def test_get_time_to_peak_with_invalid_input():
         agc.get_time_to_peak(5000, 0.08, -1)
 
 
+def test_get_time_to_peak_with_arrays():
+    t_p = agc.get_time_to_peak(np.array([5000, 5000, 3500]),
+                               np.array([0.08, 0.23, 0.78]), 120)
+    np.testing.assert_allclose(t_p, [1.37, 1.25, 1.12], atol=0.01)
+    storm_duration = np.array([[60], [120]])
+    t_p = agc.get_time_to_peak(np.array([5000, 3500]), 0.23, storm_duration)
+    assert t_p.shape == (2, 2)
+    assert t_p[1, 0] == pytest.approx(agc.get_time_to_peak(5000, 0.23, 120))
+    with pytest.raises(ValueError):
+        agc.get_time_to_peak(np.array([5000, 3500]), np.array([0.1, -1]), 120)
+    with pytest.raises(ValueError):
+        agc.get_time_to_peak(5000, 0.08, np.array([120, 0]))
+
+
 def test_get_unit_peakflow():
     assert agc.get_unit_peakflow(250, 1.1179) == pytest.approx(46.52, abs=0.01)
     assert agc.get_unit_peakflow(500, 1.2242) == pytest.approx(84.96, abs=0.01)
@@ -171,6 +197,49 @@ def test_get_hyetogram_with_8_time_steps():
     assert hyetogram[7] == pytest.approx(6.1 / 2, abs=0.1)
 
 
+def test_get_hyetogram_template_cache():
+    agc.clear_template_cache()
+    first = agc.get_hyetogram(8, 23.1)
+    second = agc.get_hyetogram(8, 47.3)
+    info = agc.get_template_cache_info()['hyetogram']
+    assert (info.hits, info.misses) == (1, 1)
+    np.testing.assert_allclose(second / first, 47.3 / 23.1)
+    first[0] = 0
+    assert agc.get_hyetogram(8, 1)[0] == pytest.approx(0.18 / 2)
+
+
+def test_unit_discharge_template_cache(catchments):
+    # The unit discharge of a catchment is reused when its curve numbers change
+    cns = agc.get_default_cn_parameters()
+    catchment = catchments.iloc[0]
+    agc.clear_template_cache()
+    _, hydrograph = agc.compute_hydrograph(catchment, 'A', catchment, cns)
+    _, hydrograph_other = agc.compute_hydrograph(catchment, 'A', catchment, cns + 5)
+    info = agc.get_template_cache_info()['unit_discharge']
+    assert (info.hits, info.misses) == (1, 1)
+    assert not np.allclose(hydrograph, hydrograph_other)
+
+    agc.clear_template_cache()
+    _, hydrograph_again = agc.compute_hydrograph(catchment, 'A', catchment, cns)
+    np.testing.assert_array_equal(hydrograph_again, hydrograph)
+
+
+def test_register_hyetogram(monkeypatch):
+    monkeypatch.setattr(agc, 'HYETOGRAM_SHAPES', dict(agc.HYETOGRAM_SHAPES))
+    try:
+        agc.register_hyetogram('late', [0.1, 0.2, 0.7])
+        hyetogram = agc.get_hyetogram(6, 10, method='late')
+        np.testing.assert_allclose(hyetogram, [0.5, 0.5, 1, 1, 3.5, 3.5])
+        with pytest.raises(ValueError):
+            agc.get_hyetogram(8, 10, method='late')
+        with pytest.raises(ValueError):
+            agc.register_hyetogram('invalid', [0.5, 0.6])
+        with pytest.raises(ValueError):
+            agc.get_hyetogram(8, 10, method='invalid')
+    finally:
+        agc.clear_template_cache()
+
+
 def test_get_hyetogram_constant_with_8_time_steps():
     hyetogram = agc.get_hyetogram(8, 23.1)
     assert hyetogram[0] == pytest.approx(23.1 / 8, abs=0.1)
@@ -198,3 +267,241 @@ def test_peak_discharge():
     assert peak_discharge[0] == pytest.approx(170, rel=0.06)
     assert peak_discharge[1] == pytest.approx(268, rel=0.06)
     assert peak_discharge[2] == pytest.approx(348, rel=0.06)
+
+
+def test_compute_hydrograph_batch_matches_scalar(catchments):
+    cns = agc.get_default_cn_parameters()
+    time, hydrographs = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns)
+
+    assert hydrographs.shape == (4, len(time), 3)
+    for i, catchment in catchments.iterrows():
+        time_ref, hydrograph = agc.compute_hydrograph(
+            catchment, catchment['soil_type'], catchment, cns)
+        np.testing.assert_allclose(time, time_ref)
+        np.testing.assert_allclose(hydrographs[i], hydrograph, rtol=1e-12)
+
+
+def test_compute_hydrograph_batch_with_invalid_input(catchments):
+    cns = agc.get_default_cn_parameters()
+    with pytest.raises(ValueError):
+        agc.compute_hydrograph_batch(catchments, ['A', 'B', 'E'], catchments, cns)
+    catchments.loc[1, 'cover_forest'] = 10
+    with pytest.raises(ValueError):
+        agc.compute_hydrograph_batch(
+            catchments, catchments['soil_type'], catchments, cns)
+
+
+def test_compute_hydrograph_scalar_checks(catchments, monkeypatch):
+    cns = agc.get_default_cn_parameters()
+    catchment = catchments.iloc[0].copy()
+
+    # The single catchment path only runs the cheap scalar checks
+    monkeypatch.setattr(agc.agd, 'check_catchments', None)
+    agc.compute_hydrograph(catchment, 'A', catchment, cns)
+    catchment['cover_forest'] = 10
+    with pytest.raises(ValueError):
+        agc.compute_hydrograph(catchment, 'A', catchment, cns)
+    agc.compute_hydrograph(catchment, 'A', catchment, cns, validate=False)
+
+
+def convolve_with_loops(q_uh, hyetogram):
+    q_array = np.zeros((len(q_uh), len(q_uh)))
+    for i_time in range(len(q_uh)):
+        for i_hyeto in range(len(hyetogram)):
+            if i_time + i_hyeto > len(q_uh) - 1:
+                break
+            q_array[i_time + i_hyeto, i_time] = q_uh[i_time] * hyetogram[i_hyeto]
+
+    return np.sum(q_array, axis=1)
+
+
+@pytest.mark.parametrize('method', ['direct', 'fft', 'auto'])
+def test_convolve_hyetogram_matches_loops(method):
+    rng = np.random.default_rng(42)
+    for time_steps_nb, hyeto_steps_nb in [(50, 20), (30, 45), (300, 120)]:
+        q_uh = rng.uniform(0, 80, time_steps_nb)
+        hyetogram = rng.uniform(0, 10, hyeto_steps_nb)
+        q = agc.convolve_hyetogram(q_uh, hyetogram, method=method)
+        np.testing.assert_allclose(q, convolve_with_loops(q_uh, hyetogram),
+                                   rtol=1e-10, atol=1e-9)
+
+
+@pytest.mark.parametrize('method', ['direct', 'fft'])
+def test_convolve_hyetogram_stacked(method):
+    rng = np.random.default_rng(42)
+    q_uh = rng.uniform(0, 80, (4, 1, 50))
+    hyetogram = rng.uniform(0, 10, (3, 20))
+    q = agc.convolve_hyetogram(q_uh, hyetogram, method=method)
+
+    assert q.shape == (4, 3, 50)
+    np.testing.assert_allclose(q[2, 1], convolve_with_loops(q_uh[2, 0], hyetogram[1]),
+                               rtol=1e-10, atol=1e-9)
+
+
+def test_convolve_hyetogram_with_invalid_method():
+    with pytest.raises(ValueError):
+        agc.convolve_hyetogram(np.ones(10), np.ones(4), method='other')
+
+
+def test_build_hydrograph_from_uh():
+    time = np.arange(0, 5, 0.1)
+    q_uh = agc.get_unit_discharge(time, 84.96, 1.2242)
+    hydrograph = agc.build_hydrograph_from_uh(time, q_uh, 23.1, 20)
+    expected = convolve_with_loops(q_uh, agc.get_hyetogram(20, 23.1)) * 0.9
+    np.testing.assert_allclose(hydrograph, expected, rtol=1e-12)
+
+
+def test_compute_peak_discharge_matches_hydrographs(catchments):
+    cns = agc.get_default_cn_parameters()
+    time, hydrographs = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns)
+    peak_q, peak_time = agc.compute_peak_discharge(
+        catchments, catchments['soil_type'], catchments, cns, return_time=True)
+
+    assert peak_q.shape == (4, 3)
+    np.testing.assert_array_equal(peak_q, hydrographs.max(axis=1))
+    np.testing.assert_array_equal(peak_time, time[hydrographs.argmax(axis=1)])
+
+
+def test_compute_peak_discharge_matches_scalar(catchments):
+    cns = agc.get_default_cn_parameters()
+    peak_q = agc.compute_peak_discharge(
+        catchments, catchments['soil_type'], catchments, cns)
+    for i, catchment in catchments.iterrows():
+        time, hydrograph = agc.compute_hydrograph(
+            catchment, catchment['soil_type'], catchment, cns)
+        np.testing.assert_allclose(peak_q[i], hydrograph.max(axis=0), rtol=1e-12)
+
+
+def test_compute_peak_discharge_with_soil_type_codes(catchments):
+    cns = agc.get_default_cn_parameters()
+    peak_q = agc.compute_peak_discharge(
+        catchments, catchments['soil_type'], catchments, cns)
+    peak_q_codes = agc.compute_peak_discharge(
+        catchments, np.array([0, 1, 3, 2], dtype=np.int8), catchments, cns)
+
+    np.testing.assert_array_equal(peak_q, peak_q_codes)
+    assert agc.compute_cn_factor(catchments.iloc[1], cns, 2) == \
+        agc.compute_cn_factor(catchments.iloc[1], cns, 'C')
+
+
+def test_compute_hydrograph_with_other_return_periods(catchments):
+    cns = agc.get_default_cn_parameters()
+    catchments['p2'] = catchments['p10'] / 2
+    ret_periods = [2, 10, 100]
+    time, hydrographs = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns, ret_periods=ret_periods)
+    time, hydrographs_default = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns)
+
+    assert hydrographs.shape == (4, 50, 3)
+    np.testing.assert_allclose(hydrographs[:, :, 0], hydrographs[:, :, 1] / 2,
+                               rtol=1e-12)
+    np.testing.assert_array_equal(hydrographs[:, :, 1:], hydrographs_default[:, :, ::2])
+    for i, catchment in catchments.iterrows():
+        time, hydrograph = agc.compute_hydrograph(
+            catchment, catchment['soil_type'], catchment, cns, ret_periods=ret_periods)
+        np.testing.assert_allclose(hydrograph, hydrographs[i], rtol=1e-12, atol=1e-12)
+    with pytest.raises(KeyError):
+        agc.compute_peak_discharge(catchments, catchments['soil_type'], catchments, cns,
+                                   validate=False, ret_periods=[5])
+
+
+def test_get_adaptive_time_grid():
+    time = agc.get_adaptive_time_grid(np.array([0.5, 3.5]), 120)
+
+    assert time.shape == (2, 5 + 20 + 10)
+    assert np.all(np.diff(time, axis=1) > 0)
+    np.testing.assert_allclose(time[:, 5], [0.5, 3.5])
+    np.testing.assert_allclose(time[:, -1], [1.9 + 1.5, 1.9 + 10.5])
+
+
+def test_compute_hydrograph_with_adaptive_time_grid(catchments):
+    cns = agc.get_default_cn_parameters()
+    catchments.loc[2, 'length_watercourse'] = 200000
+    time, hydrographs = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns, time_grid='adaptive')
+    time_fixed, hydrographs_fixed = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns)
+    peak_q = agc.compute_peak_discharge(
+        catchments, catchments['soil_type'], catchments, cns, time_grid='adaptive')
+
+    assert time.shape == (4, 35)
+    np.testing.assert_array_equal(peak_q, hydrographs.max(axis=1))
+    assert np.all(peak_q >= hydrographs_fixed.max(axis=1))
+    np.testing.assert_allclose(hydrographs[:, -1], 0, atol=1e-9)
+
+    # The fixed grid truncates the hydrograph of the slow catchment
+    assert time[2, -1] > time_fixed[-1]
+    assert hydrographs_fixed[2, -1, 0] > 0.5 * hydrographs_fixed[2, :, 0].max()
+
+    # The peak is the maximum of the hydrograph evaluated on a dense grid
+    hyetogram = agc.get_hyetogram(20, 1)
+    for i, catchment in catchments.iterrows():
+        time_i, hydrograph = agc.compute_hydrograph(
+            catchment, catchment['soil_type'], catchment, cns, time_grid='adaptive')
+        np.testing.assert_allclose(hydrograph, hydrographs[i], rtol=1e-12)
+        t_p = time_i[5]
+        q_up = agc.get_unit_peakflow(catchment['area'], t_p)
+        response = agc._compute_unit_response(time_i, q_up, t_p, hyetogram)
+        dense_response = agc._compute_unit_response(
+            np.linspace(0, time_i[-1], 20001), q_up, t_p, hyetogram)
+        assert dense_response.max() <= response.max() * (1 + 1e-12)
+        assert dense_response.max() == pytest.approx(response.max(), rel=1e-3)
+
+
+@pytest.mark.parametrize('time_grid', ['fixed', 'adaptive'])
+@pytest.mark.parametrize('storm_duration', [120, 240])
+def test_get_time_steps_nb(catchments, time_grid, storm_duration):
+    cns = agc.get_default_cn_parameters()
+    time, hydrographs = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns,
+        storm_duration=storm_duration, time_grid=time_grid)
+    time_steps_nb = agc.get_time_steps_nb(storm_duration, time_grid)
+    assert time.shape[-1] == hydrographs.shape[1] == time_steps_nb
+    if time_grid == 'adaptive':
+        assert time_steps_nb == 5 + storm_duration // 6 + 10
+
+
+def test_catchment_batch_from_dataframe(catchments):
+    numeric = catchments.drop(columns='soil_type').astype(float)
+    batch = agc.CatchmentBatch.from_dataframe(numeric)
+
+    assert len(batch) == 4
+    assert 'p100' in batch
+    assert batch.soil_types is None
+    assert np.shares_memory(batch['area'], numeric['area'].to_numpy())
+    assert batch['area'].flags.c_contiguous
+    with pytest.raises(ValueError):
+        batch['area'][0] = 1
+
+    batch = agc.CatchmentBatch.from_dataframe(catchments)
+    np.testing.assert_array_equal(batch.soil_types, [0, 1, 3, 2])
+
+
+def test_catchment_batch_with_invalid_input(catchments):
+    with pytest.raises(ValueError):
+        agc.CatchmentBatch.from_dataframe(catchments.drop(columns='area'))
+    columns = {name: catchments[name].to_numpy() for name in agc.CATCHMENT_COLUMNS}
+    columns['area'] = columns['area'][:2]
+    with pytest.raises(ValueError):
+        agc.CatchmentBatch(columns)
+
+
+def test_core_functions_accept_catchment_batch(catchments):
+    cns = agc.get_default_cn_parameters()
+    batch = agc.CatchmentBatch.from_dataframe(catchments)
+
+    time, hydrographs = agc.compute_hydrograph(batch, batch.soil_types, batch, cns)
+    time_ref, hydrographs_ref = agc.compute_hydrograph_batch(
+        catchments, catchments['soil_type'], catchments, cns)
+    np.testing.assert_array_equal(hydrographs, hydrographs_ref)
+    np.testing.assert_array_equal(
+        agc.compute_peak_discharge(batch, batch.soil_types, batch, cns),
+        hydrographs_ref.max(axis=1))
+
+    cn_factor = agc.compute_cn_factor(batch, cns, batch.soil_types)
+    for i, catchment in catchments.iterrows():
+        assert cn_factor[i] == pytest.approx(
+            agc.compute_cn_factor(catchment, cns, catchment['soil_type']))
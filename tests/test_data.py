@@ -1,3 +1,5 @@
+import os
+import numpy as np
 import pandas as pd
 
 import augur.data as data
@@ -15,3 +17,558 @@ def test_reclassify_slope_gradients():
     assert data.reclassify_slope_gradients(catchment).iloc[6, 0] == 0.7
     assert data.reclassify_slope_gradients(catchment).iloc[7, 0] == 0.7
 
+
+def create_soil_data():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'soil_depth': rng.uniform(0, 1, 200),
+                       'sand_fra': rng.uniform(0, 1, 200),
+                       'clay_fra': rng.uniform(0, 0.6, 200)})
+    df.loc[::17, 'soil_depth'] = np.nan
+    df.loc[::23, 'clay_fra'] = np.nan
+
+    return df
+
+
+def classify_soil_type_usa_with_masks(df):
+    df['soil_type'] = ''
+    df.loc[(df['soil_depth'] >= 0.5) &
+           (df['clay_fra'] < 0.1), 'soil_type'] = 'A'
+    df.loc[(df['soil_depth'] >= 0.5) &
+           (df['clay_fra'] >= 0.1) &
+           (df['clay_fra'] < 0.2), 'soil_type'] = 'B'
+    df.loc[(df['soil_depth'] >= 0.5) &
+           (df['sand_fra'] < 0.5) &
+           (df['clay_fra'] >= 0.2) &
+           (df['clay_fra'] < 0.4), 'soil_type'] = 'C'
+    df.loc[(df['clay_fra'] >= 0.4) &
+           (df['sand_fra'] < 0.5), 'soil_type'] = 'D'
+    df.loc[(df['soil_depth'] < 0.5), 'soil_type'] = 'D'
+
+    return df
+
+
+def classify_soil_type_augur_with_masks(df, thr_soil_depth, thr_sand_frac,
+                                        thr_clay_frac):
+    df['soil_type'] = ''
+    df.loc[(df['soil_depth'] >= thr_soil_depth), 'soil_type'] = 'A'
+    df.loc[(df['soil_depth'] < thr_soil_depth) &
+           (df['sand_fra'] >= thr_sand_frac), 'soil_type'] = 'B'
+    df.loc[(df['soil_depth'] < thr_soil_depth) &
+           (df['sand_fra'] < thr_sand_frac), 'soil_type'] = 'C'
+    df.loc[(df['clay_fra'] >= thr_clay_frac), 'soil_type'] = 'D'
+
+    return df
+
+
+def test_classify_soil_type_codes_augur():
+    df = create_soil_data()
+    codes = data.classify_soil_type_codes_augur(df)
+    expected = classify_soil_type_augur_with_masks(df.copy(), 0.4, 0.5, 0.4)
+
+    assert codes.dtype == np.int8
+    assert 'soil_type' not in df.columns
+    np.testing.assert_array_equal(data.soil_type_codes_to_labels(codes),
+                                  expected['soil_type'].to_numpy())
+    np.testing.assert_array_equal(
+        data.classify_soil_type_augur(df.copy())['soil_type'],
+        expected['soil_type'])
+
+
+def test_classify_soil_type_codes_augur_multiple_thresholds():
+    df = create_soil_data()
+    thresholds = np.array([[0.3, 0.4, 0.2], [0.6, 0.7, 0.5]])
+    codes = data.classify_soil_type_codes_augur(
+        df, thresholds[:, [0]], thresholds[:, [1]], thresholds[:, [2]])
+
+    assert codes.shape == (2, 200)
+    for i, row in enumerate(thresholds):
+        expected = classify_soil_type_augur_with_masks(df.copy(), *row)
+        np.testing.assert_array_equal(data.soil_type_codes_to_labels(codes[i]),
+                                      expected['soil_type'].to_numpy())
+        np.testing.assert_array_equal(
+            data.classify_soil_type_augur_params(df.copy(), *row)['soil_type'],
+            expected['soil_type'])
+
+
+def test_classify_soil_type_codes_usa():
+    df = create_soil_data()
+    codes = data.classify_soil_type_codes_usa(df)
+    expected = classify_soil_type_usa_with_masks(df.copy())
+
+    np.testing.assert_array_equal(data.soil_type_codes_to_labels(codes),
+                                  expected['soil_type'].to_numpy())
+    np.testing.assert_array_equal(data.classify_soil_type_usa(df.copy())['soil_type'],
+                                  expected['soil_type'])
+
+
+def test_soil_type_labels_to_codes():
+    np.testing.assert_array_equal(data.soil_type_labels_to_codes(['A', 'D', 'C']),
+                                  [0, 3, 2])
+    np.testing.assert_array_equal(data.soil_type_labels_to_codes(np.array([1, 3])),
+                                  [1, 3])
+    with pytest.raises(ValueError):
+        data.soil_type_labels_to_codes(['A', ''])
+    with pytest.raises(ValueError):
+        data.soil_type_labels_to_codes(np.array([0, 4]))
+
+
+def create_catchment_data():
+    return pd.DataFrame({
+        'area': [250, 0, 100, np.nan],
+        'length_watercourse': [5000, -1, 3000, 4000],
+        'slope_gradient': [0.08, 0.3, -0.1, 0.7],
+        'cover_farmland': [20, 10, 30, 10],
+        'cover_pasture': [20, 10, 10, 10],
+        'cover_forest': [20, 10, 30, 10],
+        'cover_settlement': [20, 10, 20, 10],
+        'cover_bare': [10, 20, 10, 30],
+        'cover_cryo': [5, 20, 0, 30],
+        'cover_water': [5, 20, 10, 10],
+        'p10': [50, 60, -5, 80],
+        'p30': [60, 70, 80, 90],
+        'p100': [70, 80, 90, 100]}, index=[10, 11, 12, 13])
+
+
+def test_validate_catchments():
+    df = create_catchment_data()
+    errors = data.validate_catchments(df, df)
+
+    assert list(errors['row']) == [11, 11, 12, 12, 12, 13, 13]
+    assert list(errors['column']) == ['area', 'length_watercourse', 'slope_gradient',
+                                      'land_cover_total', 'p10', 'area',
+                                      'land_cover_total']
+    assert errors['value'].iloc[3] == 110
+    assert errors['reason'].iloc[5] == "Missing value."
+
+    assert len(data.validate_catchments(df.iloc[:1], df.iloc[:1])) == 0
+    assert len(data.validate_catchments(df, None)) == 6
+    assert list(data.validate_catchments(df.to_dict('list'))['row']) == \
+           [1, 1, 2, 2, 3, 3]
+
+
+def test_check_catchments():
+    df = create_catchment_data()
+    with pytest.raises(ValueError, match="7 errors"):
+        data.check_catchments(df, df)
+    with pytest.raises(ValueError, match="Missing catchment properties"):
+        data.check_catchments(df.drop(columns='cover_water'))
+    data.check_catchments(df.iloc[0])
+
+
+def create_annual_maxima():
+    rng = np.random.default_rng(1)
+    annual_max = rng.gumbel(50, 10, (6, 40))
+    annual_max[1, ::3] = np.nan
+    annual_max[4, 1:] = np.nan
+
+    return annual_max
+
+
+def test_get_value_return_periods_batch_with_array():
+    annual_max = create_annual_maxima()
+    values = data.get_value_return_periods_batch(annual_max, ret_periods=[2, 10, 300])
+
+    assert values.shape == (6, 3)
+    assert np.all(np.isnan(values[4]))
+    for i in [0, 1, 2, 3, 5]:
+        expected = data.get_value_return_periods(pd.Series(annual_max[i]), [2, 10, 300])
+        np.testing.assert_allclose(values[i], expected, rtol=1e-12)
+
+    mask = np.isnan(annual_max)
+    masked = np.ma.masked_array(np.where(mask, -999, annual_max), mask)
+    np.testing.assert_allclose(data.get_value_return_periods_batch(masked),
+                               data.get_value_return_periods_batch(annual_max),
+                               rtol=1e-12)
+    np.testing.assert_allclose(
+        data.get_value_return_periods_batch(np.where(mask, -999, annual_max), mask=mask),
+        data.get_value_return_periods_batch(annual_max), rtol=1e-12)
+
+
+def test_get_value_return_periods_batch_with_dataframe():
+    annual_max = create_annual_maxima()
+    df = pd.DataFrame({'station': np.repeat(['s0', 's1', 's2', 's3', 's4', 's5'], 40),
+                       'year': np.tile(np.arange(1981, 2021), 6),
+                       'value': annual_max.ravel()}).sample(frac=1, random_state=0)
+    values = data.get_value_return_periods_batch(df)
+
+    assert list(values.columns) == [10, 30, 100]
+    assert list(values.index) == ['s0', 's1', 's2', 's3', 's4', 's5']
+    np.testing.assert_allclose(values.to_numpy(),
+                               data.get_value_return_periods_batch(annual_max),
+                               rtol=1e-12)
+
+
+def create_time_series_files(directory):
+    rng = np.random.default_rng(2)
+    files = []
+    for i in range(3):
+        years = np.repeat(np.arange(2000, 2010), 365)
+        values = rng.gumbel(20, 5, len(years))
+        values[rng.integers(0, len(years), 50)] = -999
+        df = pd.DataFrame({'YYYY': years, 'MM': 1, 'DD': 1, 'qobs': values})
+        file = directory / f'ID_{i}.csv'
+        df.to_csv(file, sep=';', index=False)
+        files.append(file)
+
+    return files
+
+
+def test_read_annual_maxima(tmp_path):
+    file = create_time_series_files(tmp_path)[0]
+    annual_max = data.read_annual_maxima(file, 'qobs', nodata=-999, chunk_size=1000)
+
+    expected = pd.read_csv(file, sep=';').groupby('YYYY')['qobs'].max()
+    pd.testing.assert_series_equal(annual_max, expected, check_index_type=False)
+
+
+def test_read_annual_maxima_batch(tmp_path):
+    files = create_time_series_files(tmp_path)
+    annual_max = data.read_annual_maxima_batch(files, 'qobs', chunk_size=500,
+                                               workers_nb=2)
+
+    assert list(annual_max.columns) == ['station', 'year', 'value']
+    assert list(annual_max['station'].unique()) == ['ID_0', 'ID_1', 'ID_2']
+    for file in files:
+        expected = data.read_annual_maxima(file, 'qobs')
+        np.testing.assert_array_equal(
+            annual_max.loc[annual_max['station'] == file.stem, 'value'], expected)
+    pd.testing.assert_frame_equal(
+        data.read_annual_maxima_batch(files, 'qobs', stations=[1, 2, 3],
+                                      workers_nb=1)[['year', 'value']],
+        annual_max[['year', 'value']])
+
+
+@pytest.mark.parametrize('fingerprint', ['mtime', 'hash'])
+def test_read_annual_maxima_with_cache(tmp_path, monkeypatch, fingerprint):
+    file = create_time_series_files(tmp_path)[0]
+    cache_dir = tmp_path / 'cache'
+    annual_max = data.read_annual_maxima(file, 'qobs', cache_dir=cache_dir,
+                                         fingerprint=fingerprint)
+    assert len(list(cache_dir.glob('*.npz'))) == 1
+
+    # The cached values are used without parsing the file
+    with monkeypatch.context() as m:
+        m.setattr(data.pd, 'read_csv', None)
+        cached = data.read_annual_maxima(file, 'qobs', cache_dir=cache_dir,
+                                         fingerprint=fingerprint)
+    pd.testing.assert_series_equal(cached, annual_max)
+
+    # The cache is invalidated when the file changes
+    df = pd.read_csv(file, sep=';')
+    df['qobs'] *= 2
+    df.to_csv(file, sep=';', index=False)
+    os.utime(file, ns=(0, 10 ** 9))
+    updated = data.read_annual_maxima(file, 'qobs', cache_dir=cache_dir,
+                                      fingerprint=fingerprint)
+    np.testing.assert_allclose(updated, annual_max * 2)
+
+
+COVER_FUNCTIONS = {
+    'cci': [data.cover_cci_farmland, data.cover_cci_pasture, data.cover_cci_forest,
+            data.cover_cci_settlement, data.cover_cci_water, data.cover_cci_bare,
+            data.cover_cci_cryo],
+    'worldcover': [data.cover_wc_farmland, data.cover_wc_pasture, data.cover_wc_forest,
+                   data.cover_wc_settlement, data.cover_wc_water, data.cover_wc_bare,
+                   data.cover_wc_cryo]}
+
+
+@pytest.mark.parametrize('dataset', ['cci', 'worldcover'])
+def test_count_land_covers_matches_cover_functions(dataset):
+    rng = np.random.default_rng(4)
+    x = np.ma.masked_equal(rng.integers(0, 256, (60, 70)), 0)
+    fractions = data.count_land_covers(x, data.get_land_cover_lut(dataset))
+
+    expected = [cover(x) for cover in COVER_FUNCTIONS[dataset]]
+    np.testing.assert_allclose(fractions, expected, rtol=1e-12)
+
+
+def test_register_land_cover_schema(monkeypatch):
+    # The schema is removed from LAND_COVER_SCHEMAS at the end of the test
+    monkeypatch.setitem(data.LAND_COVER_SCHEMAS, 'custom', {})
+    data.register_land_cover_schema('custom', {'forest': [(1, 3)], 'water': [(9, 9)]})
+    x = np.ma.masked_equal([0, 1, 2, 3, 4, 9, 9, 300], 0)
+    np.testing.assert_allclose(
+        data.count_land_covers(x, data.get_land_cover_lut('custom')),
+        np.array([0, 0, 3, 0, 2, 0, 0]) / 7)
+
+    with pytest.raises(ValueError):
+        data.register_land_cover_schema('overlap', {'forest': [(1, 3)],
+                                                    'water': [(3, 4)]})
+    with pytest.raises(ValueError):
+        data.register_land_cover_schema('unknown', {'glacier': [(1, 3)]})
+    with pytest.raises(ValueError):
+        data.get_land_cover_lut('overlap')
+    assert 'overlap' not in data.LAND_COVER_SCHEMAS
+
+
+def create_zonal_weights():
+    # Three catchments on a 6 x 8 grid, the last one without pixel
+    masks = np.zeros((3, 6, 8))
+    masks[0, 1:4, 1:5] = 1
+    masks[0, 1, 1] = 0.5
+    masks[1, 2:6, 4:8] = 1
+    indptr = [0]
+    pixels, weights = [], []
+    for mask in masks:
+        mask_pixels = np.flatnonzero(mask)
+        pixels.append(mask_pixels)
+        weights.append(mask.ravel()[mask_pixels])
+        indptr.append(indptr[-1] + len(mask_pixels))
+
+    zonal_weights = data.ZonalWeights(indptr, np.concatenate(pixels),
+                                      np.concatenate(weights), (6, 8))
+
+    return zonal_weights, masks
+
+
+def test_zonal_weights_mean():
+    zonal_weights, masks = create_zonal_weights()
+    rng = np.random.default_rng(5)
+    values = rng.uniform(0, 100, (6, 8))
+    values[2, 2] = -999
+    values[3, 6] = np.nan
+
+    mean = zonal_weights.mean(values, nodata=-999)
+    for i in range(2):
+        valid = (masks[i] > 0) & (values != -999) & ~np.isnan(values)
+        expected = np.average(values[valid], weights=masks[i][valid])
+        assert mean[i] == pytest.approx(expected, rel=1e-12)
+    assert np.isnan(mean[2])
+
+    assert zonal_weights.window == (1, 6, 1, 8)
+    np.testing.assert_array_equal(zonal_weights.mean(values[1:6, 1:8], nodata=-999),
+                                  mean)
+    np.testing.assert_array_equal(zonal_weights.mean(values, -999, chunk_size=1), mean)
+    assert zonal_weights.pixels.dtype == np.int32
+    assert zonal_weights.weights.dtype == np.float32
+    with pytest.raises(ValueError):
+        zonal_weights.mean(values[1:, :])
+
+
+def test_zonal_weights_fractions():
+    zonal_weights, masks = create_zonal_weights()
+    rng = np.random.default_rng(6)
+    codes = rng.choice([0, 10, 40, 50, 80, 190, 230], (6, 8))
+    lut = data.get_land_cover_lut('cci')
+
+    fractions = zonal_weights.fractions(codes, lut)
+    assert fractions.shape == (3, len(data.LAND_COVER_TYPES))
+    x = np.ma.masked_equal(codes[masks[1] > 0], 0)
+    np.testing.assert_allclose(fractions[1], data.count_land_covers(x, lut), rtol=1e-12)
+
+    valid = (masks[0] > 0) & (codes != 0)
+    total = masks[0][valid].sum()
+    i_forest = data.LAND_COVER_TYPES.index('forest')
+    assert fractions[0, i_forest] == pytest.approx(
+        masks[0][valid & (codes >= 50) & (codes <= 90)].sum() / total, rel=1e-12)
+    assert np.all(np.isnan(fractions[2]))
+
+
+def create_raster(directory):
+    rasterio = pytest.importorskip('rasterio')
+    from affine import Affine
+
+    values = np.arange(40 * 50, dtype=np.uint16).reshape(40, 50)
+    file = directory / 'raster.tif'
+    with rasterio.open(file, 'w', driver='GTiff', height=40, width=50, count=1,
+                       dtype='uint16', crs='EPSG:4326', nodata=9999,
+                       transform=Affine(1, 0, 0, 0, -1, 40)) as dst:
+        dst.write(values, 1)
+
+    return file, values
+
+
+def test_raster_block_cache(tmp_path):
+    file, values = create_raster(tmp_path)
+    with data.RasterBlockCache(block_size=16) as cache:
+        np.testing.assert_array_equal(cache.read(file, (3, 20, 5, 30)),
+                                      values[3:20, 5:30])
+        info = cache.cache_info()
+        assert (info['hits'], info['misses']) == (0, 4)
+        assert info['bytes_read'] == 4 * 16 * 16 * 2
+
+        # Overlapping windows reuse the cached blocks
+        np.testing.assert_array_equal(cache.read(file, (10, 14, 10, 14)),
+                                      values[10:14, 10:14])
+        assert cache.cache_info()['hits'] == 1
+
+        # Windows beyond the raster are filled with the nodata value
+        window = cache.read(file, (35, 45, -2, 3))
+        np.testing.assert_array_equal(window[:5, 2:], values[35:, :3])
+        assert np.all(window[5:] == 9999) and np.all(window[:, :2] == 9999)
+        assert cache.cache_info()['datasets_nb'] == 1
+
+
+def test_raster_block_cache_fill_value_outside_dtype(tmp_path):
+    file, values = create_raster(tmp_path)
+    with data.RasterBlockCache(block_size=16) as cache:
+        window = cache.read(file, (-2, 3, 0, 4), fill_value=-999)
+        assert window.dtype == np.int32
+        np.testing.assert_array_equal(window[2:], values[:3, :4])
+        assert np.all(window[:2] == -999)
+
+        window = cache.read(file, (38, 42, 0, 4), fill_value=np.nan)
+        np.testing.assert_array_equal(window[:2], values[38:, :4])
+        assert np.all(np.isnan(window[2:]))
+
+
+def test_raster_block_cache_eviction(tmp_path):
+    file, values = create_raster(tmp_path)
+    cache = data.RasterBlockCache(max_bytes=2 * 16 * 16 * 2, block_size=16)
+    cache.read(file, (0, 16, 0, 48))
+    info = cache.cache_info()
+    assert (info['misses'], info['blocks_nb']) == (3, 2)
+    assert info['bytes_cached'] <= cache.max_bytes
+
+    # The first block was evicted, the last ones are still cached
+    cache.read(file, (0, 16, 32, 48))
+    cache.read(file, (0, 16, 0, 16))
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.close()
+    assert cache.cache_info()['datasets_nb'] == 0
+
+
+def test_zonal_weights_read_with_cache(tmp_path):
+    file, values = create_raster(tmp_path)
+    zonal_weights = data.ZonalWeights([0, 2, 3], [5 * 50 + 7, 6 * 50 + 8, 30 * 50 + 40],
+                                      [1, 1, 0.5], (40, 50))
+    with data.RasterBlockCache(block_size=16) as cache:
+        window, nodata = zonal_weights.read(file, cache=cache)
+        np.testing.assert_array_equal(window, values[5:31, 7:41])
+        assert nodata == 9999
+        np.testing.assert_allclose(zonal_weights.zonal_mean(file, cache=cache),
+                                   [(values[5, 7] + values[6, 8]) / 2, values[30, 40]])
+        assert cache.hits > 0
+
+    # The catchments are read by chunks, with or without cache
+    np.testing.assert_allclose(zonal_weights.zonal_mean(file, chunk_size=1),
+                               [(values[5, 7] + values[6, 8]) / 2, values[30, 40]])
+
+    # The nodata value of the raster can be overridden
+    mean = zonal_weights.zonal_mean(file, nodata=values[5, 7], chunk_size=1)
+    np.testing.assert_allclose(mean, [values[6, 8], values[30, 40]])
+
+
+def test_zonal_fractions_match_land_covers(tmp_path):
+    rasterio = pytest.importorskip('rasterio')
+    from affine import Affine
+
+    # The raster nodata value (255) differs from the nodata code of the land covers
+    rng = np.random.default_rng(7)
+    codes = rng.choice([0, 10, 40, 50, 80, 190, 230, 255], (20, 30)).astype(np.uint8)
+    file = tmp_path / 'cover.tif'
+    with rasterio.open(file, 'w', driver='GTiff', height=20, width=30, count=1,
+                       dtype='uint8', crs='EPSG:4326', nodata=255,
+                       transform=Affine(1, 0, 0, 0, -1, 20)) as dst:
+        dst.write(codes, 1)
+    masks = np.zeros((2, 20, 30), dtype=bool)
+    masks[0, 2:9, 3:20] = True
+    masks[1, 10:18, 15:28] = True
+    zonal_weights = data.ZonalWeights(
+        [0, masks[0].sum(), masks.sum()],
+        np.concatenate([np.flatnonzero(mask) for mask in masks]),
+        np.ones(masks.sum()), (20, 30))
+    lut = data.get_land_cover_lut('cci')
+
+    # get_land_covers() counts the codes masked with nodata=0
+    fractions = zonal_weights.zonal_fractions(file, lut, chunk_size=1)
+    for i, mask in enumerate(masks):
+        x = np.ma.masked_equal(codes[mask], 0)
+        np.testing.assert_allclose(fractions[i], data.count_land_covers(x, lut),
+                                   rtol=1e-12)
+
+
+@pytest.mark.parametrize('workers_nb', [1, 2])
+def test_extract_properties(monkeypatch, workers_nb):
+    from shapely.geometry import box
+
+    # The extraction from the rasters is replaced to check the orchestration only
+    monkeypatch.setattr(data, 'get_soil_depth',
+                        lambda raster_file, polygon, cache: polygon.area)
+    monkeypatch.setattr(data, 'get_land_covers',
+                        lambda dataset, raster_file, polygon, cache:
+                        {'forest': polygon.bounds[0], 'water': len(dataset)})
+    catchments = [box(i, 0, i + 1, 2) for i in range(11)]
+    properties = {'depth': ('soil_depth', 'depth.tif'),
+                  'cover_wc': ('land_cover', 'wc.tif', 'worldcover')}
+    df = data.extract_properties(catchments, properties, workers_nb=workers_nb,
+                                 chunk_size=3)
+
+    assert list(df.columns) == ['depth', 'cover_wc_forest', 'cover_wc_water']
+    np.testing.assert_array_equal(df['depth'], 2)
+    np.testing.assert_array_equal(df['cover_wc_forest'], np.arange(11))
+    np.testing.assert_array_equal(df['cover_wc_water'], 10)
+
+    with pytest.raises(ValueError):
+        data.extract_properties(catchments, {'depth': ('depth', 'depth.tif')})
+
+
+def create_vrt(directory, tile_file):
+    vrt_file = directory / 'raster.vrt'
+    vrt_file.write_text(
+        '<VRTDataset rasterXSize="50" rasterYSize="40">'
+        '<SRS>EPSG:4326</SRS><GeoTransform>0, 1, 0, 40, 0, -1</GeoTransform>'
+        '<VRTRasterBand dataType="UInt16" band="1"><SimpleSource>'
+        f'<SourceFilename relativeToVRT="1">{tile_file.name}</SourceFilename>'
+        '<SourceBand>1</SourceBand></SimpleSource></VRTRasterBand></VRTDataset>')
+
+    return vrt_file
+
+
+def test_extract_properties_with_cache(monkeypatch, tmp_path):
+    from shapely.geometry import box
+
+    calls = []
+    cover_calls = []
+
+    def get_soil_depth(raster_file, polygon, cache):
+        calls.append(polygon.bounds[0])
+        return polygon.area
+
+    def get_land_covers(dataset, raster_file, polygon, cache):
+        cover_calls.append(polygon.bounds[0])
+        return {'forest': polygon.bounds[0], 'water': 1}
+
+    monkeypatch.setattr(data, 'get_soil_depth', get_soil_depth)
+    monkeypatch.setattr(data, 'get_land_covers', get_land_covers)
+    monkeypatch.setitem(data.LAND_COVER_SCHEMAS, 'custom', {})
+    data.register_land_cover_schema('custom', {'forest': [(1, 3)]})
+    tile_file, values = create_raster(tmp_path)
+    depth_file = create_vrt(tmp_path, tile_file)
+    wc_dir = tmp_path / 'wc'
+    wc_dir.mkdir()
+    wc_file, _ = create_raster(wc_dir)
+    properties = {'depth': ('soil_depth', depth_file),
+                  'cover_wc': ('land_cover', wc_file, 'custom')}
+    cache_dir = tmp_path / 'cache'
+    catchments = [box(i, 0, i + 1, 2) for i in range(4)]
+
+    df = data.extract_properties(catchments, properties, workers_nb=1,
+                                 cache_dir=cache_dir)
+    assert calls == [0, 1, 2, 3]
+
+    # Only the new catchment is extracted
+    catchments.insert(1, box(10, 0, 11, 3))
+    df_cached = data.extract_properties(catchments, properties, workers_nb=1,
+                                        cache_dir=cache_dir)
+    assert calls == [0, 1, 2, 3, 10]
+    assert list(df_cached.columns) == list(df.columns)
+    np.testing.assert_array_equal(df_cached['depth'], [2, 3, 2, 2, 2])
+    np.testing.assert_array_equal(df_cached['cover_wc_forest'], [0, 10, 1, 2, 3])
+
+    # Modifying a source tile of the VRT invalidates the properties of the VRT only
+    rasterio = pytest.importorskip('rasterio')
+    with rasterio.open(tile_file, 'r+') as dst:
+        dst.write(values + 1, 1)
+    os.utime(tile_file, ns=(0, 10 ** 9))
+    data.extract_properties(catchments, properties, workers_nb=1,
+                            cache_dir=cache_dir)
+    assert calls == [0, 1, 2, 3, 10, 0, 10, 1, 2, 3]
+    assert cover_calls == [0, 1, 2, 3, 10]
+
+    # Registering the land cover schema again invalidates the land covers
+    data.register_land_cover_schema('custom', {'forest': [(1, 4)]})
+    data.extract_properties(catchments, properties, workers_nb=1,
+                            cache_dir=cache_dir)
+    assert cover_calls == [0, 1, 2, 3, 10, 0, 10, 1, 2, 3]
+    assert len(calls) == 10
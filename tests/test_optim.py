@@ -0,0 +1,331 @@
+import gc
+
+import numpy as np
+import pandas as pd
+import pytest
+import spotpy
+
+import augur.core as agc
+import augur.data as agd
+import augur.optim as ago
+
+
+def create_parameters(cns, thresholds=None):
+    x = {} if thresholds is None else dict(thresholds)
+    for i_soil, soil in enumerate(['A', 'B', 'C', 'D']):
+        for i_land in range(5):
+            x[f'{soil}{i_land + 1}'] = cns.iloc[i_land, i_soil]
+
+    return x
+
+
+def compute_reference(df, soil_types, cns):
+    sim = np.zeros((len(df), 3))
+    for i, catch in df.iterrows():
+        time, hydrograph = agc.compute_hydrograph(catch, soil_types[i], catch, cns)
+        sim[i] = hydrograph.max(axis=0)
+
+    return sim
+
+
+def test_simulation_matches_reference(catchments):
+    cns = agc.get_default_cn_parameters('augur')
+    setup = ago.SpotpySetup(catchments)
+    sim = setup.simulation(create_parameters(cns))
+
+    expected = compute_reference(catchments, ['A', 'B', 'D', 'C'], cns)
+    np.testing.assert_allclose(sim, expected, rtol=1e-12)
+
+
+def test_simulation_with_soil_type_thresholds(catchments):
+    cns = agc.get_default_cn_parameters('augur')
+    setup = ago.SpotpySetup(catchments, optimize_soil_type=True)
+    thresholds = {'thr_soil_depth': 0.25, 'thr_sand_frac': 0.5,
+                  'thr_clay_frac': 0.45}
+    sim = setup.simulation(create_parameters(cns, thresholds))
+
+    expected = compute_reference(catchments, ['A', 'B', 'D', 'A'], cns)
+    np.testing.assert_allclose(sim, expected, rtol=1e-12)
+
+
+def test_simulation_with_other_return_periods(catchments):
+    cns = agc.get_default_cn_parameters('augur')
+    df = catchments
+    df['p2'] = df['p10'] / 2
+    df['p300'] = df['p100'] * 1.2
+    df['q2'] = df['q10'] / 2
+    df['q300'] = df['q100'] * 1.2
+    setup = ago.SpotpySetup(df, ret_periods=[2, 100, 300])
+    sim = setup.simulation(create_parameters(cns))
+
+    assert sim.shape == (4, 3)
+    np.testing.assert_array_equal(setup.evaluation(), df[['q2', 'q100', 'q300']])
+    for i, catch in df.iterrows():
+        time, hydrograph = agc.compute_hydrograph(
+            catch, ['A', 'B', 'D', 'C'][i], catch, cns, ret_periods=[2, 100, 300])
+        np.testing.assert_allclose(sim[i], hydrograph.max(axis=0), rtol=1e-12)
+
+
+def test_cache_is_read_only(catchments):
+    setup = ago.SpotpySetup(catchments)
+    with pytest.raises(ValueError):
+        setup.cache.response[0, 0] = 1
+    with pytest.raises(AttributeError):
+        setup.cache.t_p = None
+
+
+def test_design_matrix_matches_reference(catchments):
+    df = catchments
+    cache = agc.precompute_catchments(df, df)
+    soil_types = ['A', 'B', 'D', 'C']
+    design_matrix = ago.build_design_matrix(cache, soil_types)
+    assert design_matrix.shape == (12, 20)
+
+    population = []
+    for version in ['redcross', 'augur']:
+        cns = agc.get_default_cn_parameters(version)
+        cns_vector = ago.get_cn_vector(cns)
+        population.append(cns_vector)
+        sim = ago.simulate_peak_discharge(design_matrix, cns_vector, len(df))
+        expected = agc.compute_peak_discharge_from_cache(cache, soil_types, cns)
+        np.testing.assert_allclose(sim, expected, rtol=1e-12)
+
+    sims = ago.simulate_peak_discharge(design_matrix, np.array(population), len(df))
+    assert sims.shape == (2, 4, 3)
+    np.testing.assert_allclose(
+        sims[1], compute_reference(df, soil_types, agc.get_default_cn_parameters(
+            'augur')), rtol=1e-12)
+
+
+def create_random_catchments(catchments_nb, seed=0):
+    rng = np.random.default_rng(seed)
+    covers = rng.dirichlet(np.ones(7), catchments_nb) * 100
+    df = pd.DataFrame(
+        {'area': rng.uniform(2, 300, catchments_nb),
+         'slope_gradient': rng.uniform(0.05, 0.8, catchments_nb),
+         'length_watercourse': rng.uniform(1000, 30000, catchments_nb),
+         'cover_farmland': covers[:, 0], 'cover_pasture': covers[:, 1],
+         'cover_forest': covers[:, 2], 'cover_settlement': covers[:, 3],
+         'cover_bare': covers[:, 4], 'cover_cryo': covers[:, 5],
+         'cover_water': covers[:, 6],
+         'p10': rng.uniform(60, 140, catchments_nb),
+         'soil_depth': rng.uniform(0, 2, catchments_nb),
+         'sand_fra': rng.uniform(0, 1, catchments_nb),
+         'clay_fra': rng.uniform(0, 0.6, catchments_nb)})
+    df['p30'] = df['p10'] * 1.3
+    df['p100'] = df['p10'] * 1.6
+
+    return df
+
+
+def add_observations(df, cns, noise=0, seed=0):
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    cache = agc.precompute_catchments(df, df)
+    soil_types = agd.classify_soil_type_augur(df.copy())['soil_type']
+    sim = agc.compute_peak_discharge_from_cache(cache, soil_types, cns)
+    sim *= 1 + noise * rng.standard_normal(sim.shape)
+    df['q10'] = sim[:, 0]
+    df['q30'] = sim[:, 1]
+    df['q100'] = sim[:, 2]
+
+    return df
+
+
+def test_calibrate_cn_least_squares_recovers_parameters():
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(200), cns)
+    setup = ago.SpotpySetup(df)
+    cns_calib, rmse = setup.calibrate_least_squares()
+
+    assert cns_calib.shape == (5, 4)
+    assert list(cns_calib.columns) == ['A', 'B', 'C', 'D']
+    assert rmse.shape == (3,)
+    np.testing.assert_allclose(rmse, 0, atol=1e-8)
+    np.testing.assert_array_equal(cns_calib.to_numpy(), cns.to_numpy())
+
+
+def test_calibrate_cn_least_squares_is_better_than_reference():
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(200), cns, noise=0.2)
+    setup = ago.SpotpySetup(df)
+    cns_calib, rmse = setup.calibrate_least_squares()
+
+    score_ref = setup.objectivefunction(
+        setup.simulation(create_parameters(cns)), setup.evaluation())
+    score = setup.objectivefunction(
+        setup.simulation(create_parameters(cns_calib)), setup.evaluation())
+    assert np.all((cns_calib.to_numpy() >= 0) & (cns_calib.to_numpy() <= 100))
+    assert score == pytest.approx(np.mean(rmse))
+    assert score <= score_ref
+
+
+def test_enumerate_soil_classifications_covers_sampled_thresholds():
+    df = create_random_catchments(12)
+    classifications = {soil_types.tobytes(): thresholds for thresholds, soil_types
+                       in ago.enumerate_soil_classifications(df)}
+
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        thresholds = (rng.uniform(0, 2.5), rng.uniform(0, 1), rng.uniform(0, 0.7))
+        soil_types = agd.classify_soil_type_augur_params(
+            df.copy(), *thresholds)['soil_type']
+        assert agd.soil_type_labels_to_codes(soil_types).tobytes() in classifications
+
+    for key, thresholds in classifications.items():
+        soil_types = agd.classify_soil_type_augur_params(
+            df.copy(), thresholds['thr_soil_depth'], thresholds['thr_sand_frac'],
+            thresholds['thr_clay_frac'])['soil_type']
+        assert agd.soil_type_labels_to_codes(soil_types).tobytes() == key
+
+
+def test_enumerate_soil_classifications_with_values_above_bounds():
+    df = pd.DataFrame({'soil_depth': [2, 5, 12], 'sand_fra': [0.5, 0.5, 0.5],
+                       'clay_fra': [0.1, 0.1, 0.1]})
+    classifications = {soil_types.tobytes() for _, soil_types
+                       in ago.enumerate_soil_classifications(df)}
+
+    soil_types = agd.classify_soil_type_augur_params(
+        df.copy(), 9.9, 0.5, 0.5)['soil_type']
+    assert agd.soil_type_labels_to_codes(soil_types).tobytes() in classifications
+
+
+def test_search_soil_thresholds_warns_on_full_sweep(monkeypatch):
+    monkeypatch.setattr(ago, 'SOIL_CLASSIFICATIONS_WARNING_NB', 10)
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(6), cns)
+    setup = ago.SpotpySetup(df, optimize_soil_type=True)
+    with pytest.warns(UserWarning):
+        setup.search_soil_thresholds(max_breakpoints=None)
+
+
+def test_search_soil_thresholds():
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(40), cns)
+    setup = ago.SpotpySetup(df, optimize_soil_type=True)
+    results, cns_calib, rmse = setup.search_soil_thresholds(max_breakpoints=5)
+
+    assert list(results.columns) == ['thr_soil_depth', 'thr_sand_frac',
+                                     'thr_clay_frac', 'score']
+    assert results['score'].is_monotonic_increasing
+    assert np.mean(rmse) == pytest.approx(results['score'].iloc[0], rel=0.05)
+    nb_scores = len(setup.classification_scores)
+    setup.search_soil_thresholds(max_breakpoints=5)
+    assert len(setup.classification_scores) == nb_scores
+
+
+def test_simulate_parallel_matches_serial(catchments):
+    df = catchments
+    rng = np.random.default_rng(0)
+    thresholds = rng.uniform(0, [0.6, 1, 1], (6, 3))
+    cns = rng.integers(0, 100, (6, 20))
+    parameter_sets = np.hstack([thresholds, cns])
+
+    with ago.SpotpySetup(df, optimize_soil_type=True) as setup:
+        sims = setup.simulate_parallel(parameter_sets, workers_nb=2, chunk_size=2)
+        sims_again = setup.simulate_parallel(parameter_sets[::-1], workers_nb=2)
+
+    assert sims.shape == (6, 4, 3)
+    names = [param.name for param in setup.params]
+    for i, row in enumerate(parameter_sets):
+        expected = setup.simulation(dict(zip(names, row)))
+        np.testing.assert_array_equal(sims[i], expected)
+        np.testing.assert_array_equal(sims_again[5 - i], expected)
+
+
+def test_simulate_parallel_releases_shared_memory(catchments):
+    from multiprocessing import shared_memory
+
+    df = catchments
+    setup = ago.SpotpySetup(df)
+    with pytest.raises(KeyError):
+        setup.simulate_parallel([{'A1': 50}], workers_nb=1)
+    assert setup._shared_memory is None
+
+    setup.simulate_parallel(np.full((2, 20), 50), workers_nb=1)
+    name = setup._shared_memory.name
+    del setup
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_simulation_does_not_modify_data(catchments):
+    df = catchments.drop(columns='soil_type')
+    df.index = df.index + 10
+    setup = ago.SpotpySetup(df, optimize_soil_type=True)
+    setup.simulation(create_parameters(
+        agc.get_default_cn_parameters(),
+        {'thr_soil_depth': 0.25, 'thr_sand_frac': 0.5, 'thr_clay_frac': 0.45}))
+
+    assert 'soil_type' not in df.columns
+    assert df.index[0] == 10
+
+
+@pytest.mark.parametrize('optimize_soil_type', [False, True])
+def test_simulate_batch_matches_simulation(optimize_soil_type):
+    df = create_random_catchments(30)
+    rng = np.random.default_rng(0)
+    parameter_sets = rng.integers(0, 100, (25, 20)).astype(float)
+    if optimize_soil_type:
+        thresholds = rng.uniform(0, [0.5, 1, 0.2], (25, 3))
+        thresholds[::3] = [0.3, 0.5, 0.1]
+        parameter_sets = np.hstack([thresholds, parameter_sets])
+
+    setup = ago.SpotpySetup(df, optimize_soil_type=optimize_soil_type)
+    # Small memory budget to force several chunks
+    sims = setup.simulate_batch(parameter_sets, memory_budget=10000)
+
+    assert sims.shape == (25, 30, 3)
+    names = [param.name for param in setup.params]
+    for i, row in enumerate(parameter_sets):
+        expected = setup.simulation(dict(zip(names, row)))
+        np.testing.assert_allclose(sims[i], expected, rtol=1e-12)
+
+
+def test_simulate_batch_with_invalid_shape(catchments):
+    setup = ago.SpotpySetup(catchments)
+    with pytest.raises(ValueError):
+        setup.simulate_batch(np.zeros((3, 23)))
+
+
+def test_optimize_differential_evolution(tmp_path):
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(50), cns)
+    setup = ago.SpotpySetup(df, optimize_soil_type=True)
+    dbname = str(tmp_path / 'AUGUR_de')
+    best, score = ago.optimize_differential_evolution(
+        setup, population_size=40, max_generations=30, seed=1, dbname=dbname)
+
+    assert list(best.index) == [param.name for param in setup.params]
+    assert np.all(best.iloc[3:] == np.round(best.iloc[3:]))
+    assert np.all((best >= 0) & (best <= 100))
+    assert score == pytest.approx(setup.objectivefunction(
+        setup.simulation(best), setup.evaluation()))
+
+    results = spotpy.analyser.load_csv_results(dbname)
+    assert len(results) >= 40 * 2
+    simulation_columns = [name for name in results.dtype.names
+                          if name.startswith('simulation')]
+    assert len(simulation_columns) == setup.evaluation().size
+    assert 'simulation1_1' in simulation_columns
+    assert results['like1'].min() == pytest.approx(score, rel=1e-6)
+
+    best_again, score_again = ago.optimize_differential_evolution(
+        setup, population_size=40, max_generations=30, seed=1)
+    assert score_again == score
+    pd.testing.assert_series_equal(best_again, best)
+
+
+def test_optimize_differential_evolution_early_stopping(tmp_path):
+    cns = agc.get_default_cn_parameters('augur')
+    df = add_observations(create_random_catchments(20), cns)
+    setup = ago.SpotpySetup(df)
+    dbname = str(tmp_path / 'AUGUR_de')
+    ago.optimize_differential_evolution(
+        setup, population_size=20, max_generations=10000, seed=0, patience=5,
+        tolerance=1e6, dbname=dbname)
+
+    results = spotpy.analyser.load_csv_results(dbname)
+    assert results['chain'].max() == 5
+    assert len(results) == 20 * 6